@@ -12,25 +12,28 @@ Por que um arquivo separado?
 
 Segurança:
   - Todo acesso exige o header  X-Admin-Token  igual à variável de ambiente
-    ADMIN_TOKEN (comparação em tempo constante).
+    ADMIN_TOKEN (comparação em tempo constante; ver admin_token.py).
   - CORS liberado apenas para a origem do dashboard (env DASHBOARD_ORIGIN).
 
 Endpoint:
   GET /api/admin/dashboard?periodo=7d|30d|90d|todos
+  (resposta em cache por período — ver dashboard_cache.py —, gzip e ETag)
 """
 
 import os
-import json
-import hmac
+import gzip
 from datetime import datetime, timedelta
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request
 from sqlalchemy import create_engine, text
 
+import admin_token
+import dashboard_cache
+import vendas_diarias
+
 # ----------------------------------------------------------------------
 # Configuração
 # ----------------------------------------------------------------------
-ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
 # O CORS (origem do painel + header X-Admin-Token) é configurado no app.py.
 
 # Status que contam como venda paga (faturamento real).
@@ -67,56 +70,17 @@ dashboard_bp = Blueprint("dashboard_admin", __name__)
 # ----------------------------------------------------------------------
 # Obs.: o CORS é tratado pelo flask-cors no app.py (origem do painel +
 # header X-Admin-Token liberados lá). Não duplicamos headers aqui.
-def _token_ok():
-    enviado = request.headers.get("X-Admin-Token", "")
-    if not ADMIN_TOKEN or not enviado:
-        return False
-    # Comparação em tempo constante (evita ataque de timing).
-    return hmac.compare_digest(enviado, ADMIN_TOKEN)
+# O token é conferido por admin_token.token_ok() (o mesmo do app.py).
 
 
 # ----------------------------------------------------------------------
 # Helpers de cálculo
 # ----------------------------------------------------------------------
-def _categoria(tipo):
-    """
-    Classifica o produto numa das 3 categorias de comissão da BrooStore.
-    Ajuste aqui se surgirem novos 'tipo' no catálogo.
-      - fisico                       -> produtos físicos
-      - game / app                   -> jogos e aplicativos
-      - ebook / digital / assinatura -> produtos digitais (default)
-    """
-    t = (tipo or "").strip().lower()
-    if t == "fisico":
-        return "fisico"
-    if t in ("game", "app", "jogo", "aplicativo"):
-        return "jogos_apps"
-    return "digital"
-
-
-def _parse_obs(raw):
-    """Lê o JSON da coluna observacoes com segurança. Retorna dict."""
-    if not raw:
-        return {}
-    try:
-        return json.loads(raw) if isinstance(raw, str) else dict(raw)
-    except Exception:
-        return {}
-
-
+# categoria(), ler_observacoes() e valores() vivem em vendas_diarias.py
+# (mesma regra no rollup e nas linhas lidas aqui).
 def _split_valores(row):
-    """
-    Decompõe o valor de uma cobrança em (subtotal_produto, frete).
-    - 'frete' e 'subtotal_produto' vêm de observacoes quando existirem.
-    - Pedidos antigos/digitais podem não ter: usa fallback seguro.
-    """
-    valor = float(row["valor"] or 0)
-    obs = _parse_obs(row["observacoes"])
-    frete = float(obs.get("frete") or 0)
-    subtotal = obs.get("subtotal_produto")
-    if subtotal is None:
-        subtotal = max(0.0, valor - frete)
-    return round(float(subtotal), 2), round(frete, 2)
+    """(subtotal_produto, frete) de uma linha de cobrança."""
+    return vendas_diarias.valores(row["valor"], row["observacoes"], row["frete"], row["subtotal_produto"])
 
 
 def _intervalo(periodo):
@@ -131,81 +95,273 @@ def _intervalo(periodo):
 
 
 # ----------------------------------------------------------------------
-# Endpoint principal
+# Agregação
 # ----------------------------------------------------------------------
-@dashboard_bp.route("/api/admin/dashboard", methods=["GET"])
-def dashboard():
-    if not _token_ok():
-        return jsonify({"erro": "Não autorizado"}), 401
+# Os totais vêm do rollup vendas_diarias (uma linha por dia x produto x
+# categoria x status x vendedor). Como o rollup é por dia e os períodos
+# começam numa hora qualquer ("agora - 7 dias"), os dois dias de borda
+# (início do período anterior e início do atual) são lidos direto de
+# cobrancas e somados por fora. Sem o rollup (migração 0004 pendente),
+# agrega direto em cobrancas com GROUP BY.
+#
+# Formato comum: {"fatias": {"atual"|"anterior": {...}}, "serie": {dia: {...}},
+# "produtos": {(id, nome): {...}}, "categorias": {cat: {...}}, "status": {st: {...}}}
+def _agregado_vazio():
+    return {"fatias": {}, "serie": {}, "produtos": {}, "categorias": {}, "status": {}}
 
-    periodo = request.args.get("periodo", "30d")
-    inicio, fim, inicio_ant, fim_ant = _intervalo(periodo)
 
-    # Busca o conjunto de linhas necessário em UMA query.
-    # Para comparação de período, puxamos desde o início do período anterior.
-    desde = inicio_ant if inicio_ant else None
+def _somar(destino, chave, **valores):
+    alvo = destino.setdefault(chave, dict.fromkeys(valores, 0.0))
+    for campo, v in valores.items():
+        alvo[campo] += float(v or 0)
+
+
+_PAGO = "c.status IN ('approved', 'delivered')"
+
+
+def _agregados_rollup(conn, inicio, inicio_ant):
+    agg = _agregado_vazio()
+    pago = "v.status IN ('approved', 'delivered')"
+    params = {}
+    if inicio:
+        params = {"d_ini": inicio.date(), "d_ant": inicio_ant.date()}
+        # Dias inteiros: (d_ant, d_ini) = período anterior, (d_ini, hoje] = atual.
+        fatia = "CASE WHEN v.dia > :d_ini THEN 'atual' ELSE 'anterior' END"
+        onde = "v.dia > :d_ant AND v.dia <> :d_ini"
+        atual = "v.dia > :d_ini"
+    else:
+        fatia, onde, atual = "'atual'", "1 = 1", "1 = 1"
+
+    for r in conn.execute(text(f"""
+        SELECT {fatia} AS fatia, SUM(v.pedidos) AS linhas,
+               SUM(CASE WHEN {pago} THEN v.pedidos END) AS pedidos,
+               SUM(CASE WHEN {pago} THEN v.bruto END) AS bruto,
+               SUM(CASE WHEN {pago} THEN v.frete END) AS frete,
+               SUM(CASE WHEN {pago} THEN v.subtotal END) AS produtos
+        FROM vendas_diarias v WHERE {onde} GROUP BY 1
+    """), params):
+        _somar(agg["fatias"], r.fatia, linhas=r.linhas, pedidos=r.pedidos,
+               bruto=r.bruto, frete=r.frete, produtos=r.produtos)
+
+    for r in conn.execute(text(f"""
+        SELECT v.dia, SUM(v.bruto) AS valor FROM vendas_diarias v
+        WHERE {atual} AND {pago} GROUP BY v.dia
+    """), params):
+        _somar(agg["serie"], str(r.dia)[:10], valor=r.valor)
+
+    for r in conn.execute(text(f"""
+        SELECT NULLIF(v.product_id, {vendas_diarias.SEM_PRODUTO}) AS product_id, p.nome,
+               SUM(v.pedidos) AS qtd, SUM(v.bruto) AS valor
+        FROM vendas_diarias v LEFT JOIN produtos p ON p.id = v.product_id
+        WHERE {atual} AND {pago} GROUP BY v.product_id, p.nome
+    """), params):
+        _somar(agg["produtos"], (r.product_id, r.nome), qtd=r.qtd, valor=r.valor)
+
+    for r in conn.execute(text(f"""
+        SELECT v.categoria, SUM(v.pedidos) AS pedidos, SUM(v.subtotal) AS subtotal
+        FROM vendas_diarias v WHERE {atual} AND {pago} GROUP BY v.categoria
+    """), params):
+        _somar(agg["categorias"], r.categoria, pedidos=r.pedidos, subtotal=r.subtotal)
+
+    for r in conn.execute(text(f"""
+        SELECT v.status, SUM(v.pedidos) AS n FROM vendas_diarias v
+        WHERE {atual} GROUP BY v.status
+    """), params):
+        _somar(agg["status"], r.status, n=r.n)
+
+    if inicio:
+        _somar_bordas(conn, agg, inicio, inicio_ant)
+    return agg
+
+
+def _somar_bordas(conn, agg, inicio, inicio_ant):
+    """Cobranças dos dois dias de borda, que o rollup (por dia) não separa."""
+    d = vendas_diarias.sql_dialeto(conn.dialect.name)
+    um_dia = timedelta(days=1)
+    dia_ini = datetime.combine(inicio.date(), datetime.min.time())
+    dia_ant = datetime.combine(inicio_ant.date(), datetime.min.time())
+    linhas = conn.execute(text(f"""
+        SELECT CASE WHEN c.data_criacao >= :inicio THEN 'atual' ELSE 'anterior' END AS fatia,
+               {d['dia']} AS dia, c.valor, c.status, c.observacoes, c.frete, c.subtotal_produto, c.product_id,
+               p.nome AS produto_nome, p.tipo AS produto_tipo
+        FROM cobrancas c
+        LEFT JOIN produtos p ON p.id = c.product_id
+        WHERE (c.data_criacao >= :inicio_ant AND c.data_criacao < :fim_ant)
+           OR (c.data_criacao >= :dia_ini AND c.data_criacao < :fim_ini)
+    """), {"inicio": inicio, "inicio_ant": inicio_ant, "fim_ant": dia_ant + um_dia,
+           "dia_ini": dia_ini, "fim_ini": dia_ini + um_dia})
+    for r in linhas:
+        pago = r.status in STATUS_PAGOS
+        sub, fr = vendas_diarias.valores(r.valor, r.observacoes, r.frete, r.subtotal_produto)
+        _somar(agg["fatias"], r.fatia, linhas=1, pedidos=int(pago),
+               bruto=r.valor if pago else 0, frete=fr if pago else 0, produtos=sub if pago else 0)
+        if r.fatia != "atual":
+            continue
+        _somar(agg["status"], r.status or vendas_diarias.SEM_STATUS, n=1)
+        if pago:
+            _somar(agg["serie"], r.dia, valor=r.valor)
+            _somar(agg["produtos"], (r.product_id, r.produto_nome), qtd=1, valor=r.valor)
+            _somar(agg["categorias"], vendas_diarias.categoria(r.produto_tipo), pedidos=1, subtotal=sub)
+
+
+# Linhas pagas do período com frete/subtotal já extraídos (CTE base).
+_BASE_PAGOS = """
+    WITH base AS (
+        SELECT c.id, c.valor, c.status, c.data_criacao, c.product_id,
+               p.nome AS produto_nome, p.tipo AS produto_tipo, {dia} AS dia,
+               {frete} AS frete, {subtotal} AS subtotal_obs
+        FROM cobrancas c
+        LEFT JOIN produtos p ON p.id = c.product_id
+        WHERE {pago} {filtro}
+    ), pagos AS (
+        SELECT base.*,
+               COALESCE(subtotal_obs, {maior}(COALESCE(valor, 0) - frete, 0)) AS subtotal
+        FROM base
+    )
+"""
+
+
+def _agregados_cobrancas(conn, inicio, inicio_ant):
+    """Mesmo resultado de _agregados_rollup, com GROUP BY direto em cobrancas."""
+    agg = _agregado_vazio()
+    d = vendas_diarias.sql_dialeto(conn.dialect.name)
+    params = {"inicio": inicio, "inicio_ant": inicio_ant}
+    filtro = "AND c.data_criacao >= :inicio" if inicio else ""
+    base = _BASE_PAGOS.format(pago=_PAGO, filtro=filtro, **d)
+
+    # Período atual e anterior numa passada só (agrupados pela fatia).
+    fatia = "CASE WHEN c.data_criacao >= :inicio THEN 'atual' ELSE 'anterior' END" if inicio else "'atual'"
+    for r in conn.execute(text(f"""
+        SELECT {fatia} AS fatia,
+               COUNT(*) AS linhas,
+               COUNT(CASE WHEN {_PAGO} THEN 1 END) AS pedidos,
+               SUM(CASE WHEN {_PAGO} THEN c.valor END) AS bruto,
+               SUM(CASE WHEN {_PAGO} THEN {d['frete']} END) AS frete,
+               SUM(CASE WHEN {_PAGO} THEN COALESCE({d['subtotal']},
+                   {d['maior']}(COALESCE(c.valor, 0) - {d['frete']}, 0)) END) AS produtos
+        FROM cobrancas c
+        {"WHERE c.data_criacao >= :inicio_ant" if inicio_ant else ""}
+        GROUP BY 1
+    """), params):
+        _somar(agg["fatias"], r.fatia, linhas=r.linhas, pedidos=r.pedidos,
+               bruto=r.bruto, frete=r.frete, produtos=r.produtos)
+
+    for r in conn.execute(text(base + """
+        SELECT dia, SUM(valor) AS valor FROM pagos GROUP BY dia
+    """), params):
+        _somar(agg["serie"], r.dia, valor=r.valor)
+
+    for r in conn.execute(text(base + """
+        SELECT product_id, produto_nome, COUNT(*) AS qtd, SUM(valor) AS valor
+        FROM pagos GROUP BY product_id, produto_nome
+    """), params):
+        _somar(agg["produtos"], (r.product_id, r.produto_nome), qtd=r.qtd, valor=r.valor)
+
+    for r in conn.execute(text(base + """
+        SELECT produto_tipo, COUNT(*) AS pedidos, SUM(subtotal) AS subtotal
+        FROM pagos GROUP BY produto_tipo
+    """), params):
+        _somar(agg["categorias"], vendas_diarias.categoria(r.produto_tipo),
+               pedidos=r.pedidos, subtotal=r.subtotal)
+
+    for r in conn.execute(text(f"""
+        SELECT COALESCE(c.status, '{vendas_diarias.SEM_STATUS}') AS status, COUNT(*) AS n
+        FROM cobrancas c {"WHERE c.data_criacao >= :inicio" if inicio else ""}
+        GROUP BY 1
+    """), params):
+        _somar(agg["status"], r.status, n=r.n)
+
+    return agg
+
+
+def _agregados(conn, inicio, inicio_ant):
+    try:
+        return _agregados_rollup(conn, inicio, inicio_ant)
+    except Exception as e:
+        print(f"[DASHBOARD] Rollup vendas_diarias indisponível ({type(e).__name__}); agregando direto em cobrancas.")
+        conn.rollback()
+        return _agregados_cobrancas(conn, inicio, inicio_ant)
+
 
-    sql = """
+def _linhas_pagas(conn, inicio, extra="", limite=None):
+    """Linhas de cobranças pagas do período (últimas vendas / envios)."""
+    sql = f"""
         SELECT c.id, c.valor, c.status, c.data_criacao,
                c.cliente_nome, c.cliente_email, c.cliente_telefone,
-               c.observacoes, c.product_id,
+               c.observacoes, c.frete, c.subtotal_produto, c.transportadora, c.product_id,
                p.nome AS produto_nome, p.tipo AS produto_tipo,
                cup.codigo AS cupom_codigo
         FROM cobrancas c
         LEFT JOIN produtos p ON p.id = c.product_id
         LEFT JOIN cupons  cup ON cup.id = c.cupom_id
-        {filtro}
+        WHERE {_PAGO} {"AND c.data_criacao >= :inicio" if inicio else ""} {extra}
         ORDER BY c.data_criacao DESC
+        {f"LIMIT {int(limite)}" if limite else ""}
     """
-    params = {}
-    if desde:
-        sql = sql.format(filtro="WHERE c.data_criacao >= :desde")
-        params["desde"] = desde
+    return [dict(r._mapping) for r in conn.execute(text(sql), {"inicio": inicio})]
+
+
+def _data_iso(dt):
+    return dt.isoformat() if hasattr(dt, "isoformat") else str(dt)
+
+
+# ----------------------------------------------------------------------
+# Endpoint principal
+# ----------------------------------------------------------------------
+@dashboard_bp.route("/api/admin/dashboard", methods=["GET"])
+def dashboard():
+    if not admin_token.token_ok():
+        return jsonify({"erro": "Não autorizado"}), 401
+
+    periodo = request.args.get("periodo", "30d")
+    entrada = dashboard_cache.obter(periodo)
+    if entrada is None:
+        try:
+            with get_engine().connect() as conn:
+                payload = _montar_payload(conn, periodo)
+        except Exception as e:
+            return jsonify({"erro": f"Falha ao consultar o banco: {e}"}), 500
+        entrada = dashboard_cache.gravar(periodo, payload)
+    return _responder(entrada)
+
+
+def _responder(entrada):
+    """JSON já comprimido (ou descomprimido, se o cliente não aceitar gzip) + ETag."""
+    gz = dashboard_cache.corpo_gzip(entrada)
+    if "gzip" in request.accept_encodings:
+        resp = Response(gz, mimetype="application/json")
+        resp.headers["Content-Encoding"] = "gzip"
     else:
-        sql = sql.format(filtro="")
+        resp = Response(gzip.decompress(gz), mimetype="application/json")
+    resp.headers["Vary"] = "Accept-Encoding"
+    resp.set_etag(entrada["etag"], weak=True)
+    # O painel sempre revalida; sem mudança, o If-None-Match devolve 304.
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp.make_conditional(request)
 
-    try:
-        with get_engine().connect() as conn:
-            rows = [dict(r._mapping) for r in conn.execute(text(sql), params)]
-    except Exception as e:
-        return jsonify({"erro": f"Falha ao consultar o banco: {e}"}), 500
-
-    # ---- Separa período atual x anterior ---------------------------------
-    def no_periodo(r, ini, fi):
-        if ini is None:
-            return True
-        dt = r["data_criacao"]
-        if isinstance(dt, str):
-            try:
-                dt = datetime.fromisoformat(dt)
-            except Exception:
-                return True
-        return (ini <= dt) if fi is None else (ini <= dt < fi)
-
-    atuais = [r for r in rows if no_periodo(r, inicio, None)]
-    anteriores = [r for r in rows if (inicio_ant and no_periodo(r, inicio_ant, inicio))]
-
-    # ---- Agrega métricas do período atual --------------------------------
-    def agrega(lista):
-        bruto = frete_total = produtos_total = 0.0
-        n_pagos = 0
-        for r in lista:
-            if r["status"] in STATUS_PAGOS:
-                sub, fr = _split_valores(r)
-                bruto += float(r["valor"] or 0)
-                frete_total += fr
-                produtos_total += sub
-                n_pagos += 1
+
+def _montar_payload(conn, periodo):
+    inicio, fim, inicio_ant, fim_ant = _intervalo(periodo)
+    agg = _agregados(conn, inicio, inicio_ant)
+    ultimas_rows = _linhas_pagas(conn, inicio, limite=25)
+    envios_rows = _linhas_pagas(conn, inicio, extra="AND lower(p.tipo) = 'fisico'")
+
+    # ---- Métricas do período atual x anterior ----------------------------
+    def agrega(m):
+        m = m or {}
+        bruto = m.get("bruto", 0.0)
+        n_pagos = int(m.get("pedidos", 0))
         return {
             "bruto": round(bruto, 2),
-            "frete": round(frete_total, 2),
-            "produtos": round(produtos_total, 2),
+            "frete": round(m.get("frete", 0.0), 2),
+            "produtos": round(m.get("produtos", 0.0), 2),
             "pedidos": n_pagos,
             "ticket_medio": round(bruto / n_pagos, 2) if n_pagos else 0.0,
         }
 
-    metricas = agrega(atuais)
-    metricas_ant = agrega(anteriores) if anteriores else None
+    anterior = agg["fatias"].get("anterior")
+    metricas = agrega(agg["fatias"].get("atual"))
+    metricas_ant = agrega(anterior) if anterior and anterior["linhas"] else None
 
     def variacao(atual, anterior):
         if not anterior or anterior == 0:
@@ -220,28 +376,19 @@ def dashboard():
         }
 
     # ---- Série temporal diária (faturamento bruto por dia) ---------------
-    serie = {}
-    for r in atuais:
-        if r["status"] in STATUS_PAGOS:
-            dt = r["data_criacao"]
-            if isinstance(dt, str):
-                try:
-                    dt = datetime.fromisoformat(dt)
-                except Exception:
-                    continue
-            dia = dt.strftime("%Y-%m-%d")
-            serie[dia] = round(serie.get(dia, 0) + float(r["valor"] or 0), 2)
-    serie_ordenada = [{"data": d, "valor": v} for d, v in sorted(serie.items())]
+    serie_ordenada = [{"data": dia, "valor": round(s["valor"], 2)}
+                      for dia, s in sorted(agg["serie"].items()) if dia]
 
     # ---- Top produtos ----------------------------------------------------
     top = {}
-    for r in atuais:
-        if r["status"] in STATUS_PAGOS:
-            nome = r["produto_nome"] or f"Produto #{r['product_id']}"
-            if nome not in top:
-                top[nome] = {"nome": nome, "qtd": 0, "valor": 0.0}
-            top[nome]["qtd"] += 1
-            top[nome]["valor"] = round(top[nome]["valor"] + float(r["valor"] or 0), 2)
+    for (product_id, produto_nome), s in agg["produtos"].items():
+        if not s["qtd"]:
+            continue
+        nome = produto_nome or f"Produto #{product_id}"
+        if nome not in top:
+            top[nome] = {"nome": nome, "qtd": 0, "valor": 0.0}
+        top[nome]["qtd"] += int(s["qtd"])
+        top[nome]["valor"] = round(top[nome]["valor"] + s["valor"], 2)
     top_produtos = sorted(top.values(), key=lambda x: x["valor"], reverse=True)[:8]
 
     # ---- Faturamento real por categoria (base p/ comissão) ---------------
@@ -252,55 +399,46 @@ def dashboard():
         "fisico":     {"subtotal": 0.0, "pedidos": 0},
         "jogos_apps": {"subtotal": 0.0, "pedidos": 0},
     }
-    for r in atuais:
-        if r["status"] in STATUS_PAGOS:
-            cat = _categoria(r["produto_tipo"])
-            sub, _fr = _split_valores(r)
-            por_categoria[cat]["subtotal"] = round(por_categoria[cat]["subtotal"] + sub, 2)
-            por_categoria[cat]["pedidos"] += 1
+    for cat, s in agg["categorias"].items():
+        por_categoria[cat]["subtotal"] = round(por_categoria[cat]["subtotal"] + s["subtotal"], 2)
+        por_categoria[cat]["pedidos"] += int(s["pedidos"])
 
     # ---- Distribuição por status (todos, não só pagos) -------------------
-    por_status = {}
-    for r in atuais:
-        s = r["status"] or "desconhecido"
-        por_status[s] = por_status.get(s, 0) + 1
+    por_status = {st: int(s["n"]) for st, s in agg["status"].items() if s["n"]}
 
     # ---- Últimas vendas pagas (para o feed de notificações) --------------
     ultimas = []
-    for r in atuais:
-        if r["status"] in STATUS_PAGOS:
-            sub, fr = _split_valores(r)
-            ultimas.append({
-                "id": r["id"],
-                "cliente": r["cliente_nome"],
-                "email": r["cliente_email"],
-                "produto": r["produto_nome"] or f"#{r['product_id']}",
-                "valor": float(r["valor"] or 0),
-                "frete": fr,
-                "status": r["status"],
-                "cupom": r["cupom_codigo"],
-                "data": r["data_criacao"].isoformat() if hasattr(r["data_criacao"], "isoformat") else str(r["data_criacao"]),
-            })
-    ultimas = ultimas[:25]
+    for r in ultimas_rows:
+        sub, fr = _split_valores(r)
+        ultimas.append({
+            "id": r["id"],
+            "cliente": r["cliente_nome"],
+            "email": r["cliente_email"],
+            "produto": r["produto_nome"] or f"#{r['product_id']}",
+            "valor": float(r["valor"] or 0),
+            "frete": fr,
+            "status": r["status"],
+            "cupom": r["cupom_codigo"],
+            "data": _data_iso(r["data_criacao"]),
+        })
 
     # ---- Envios pendentes (etiquetas): produtos físicos pagos ------------
     envios = []
-    for r in atuais:
-        if r["status"] in STATUS_PAGOS and (r["produto_tipo"] or "").lower() == "fisico":
-            obs = _parse_obs(r["observacoes"])
-            end = obs.get("endereco") or {}
-            sub, fr = _split_valores(r)
-            envios.append({
-                "id": r["id"],
-                "cliente": r["cliente_nome"],
-                "email": r["cliente_email"],
-                "telefone": r["cliente_telefone"],
-                "produto": r["produto_nome"] or f"#{r['product_id']}",
-                "transportadora": obs.get("transportadora"),
-                "frete": fr,
-                "endereco": end,
-                "data": r["data_criacao"].isoformat() if hasattr(r["data_criacao"], "isoformat") else str(r["data_criacao"]),
-            })
+    for r in envios_rows:
+        obs = vendas_diarias.ler_observacoes(r["observacoes"])
+        end = obs.get("endereco") or {}
+        sub, fr = _split_valores(r)
+        envios.append({
+            "id": r["id"],
+            "cliente": r["cliente_nome"],
+            "email": r["cliente_email"],
+            "telefone": r["cliente_telefone"],
+            "produto": r["produto_nome"] or f"#{r['product_id']}",
+            "transportadora": r["transportadora"] or obs.get("transportadora"),
+            "frete": fr,
+            "endereco": end,
+            "data": _data_iso(r["data_criacao"]),
+        })
 
     payload = {
         "periodo": periodo,
@@ -314,4 +452,4 @@ def dashboard():
         "ultimas_vendas": ultimas,
         "envios_pendentes": envios,
     }
-    return jsonify(payload), 200
+    return payload
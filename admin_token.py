@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+admin_token.py
+==============
+Autenticação dos endpoints administrativos: header X-Admin-Token igual à
+variável de ambiente ADMIN_TOKEN (comparação em tempo constante). Sem
+ADMIN_TOKEN configurado, tudo é recusado.
+
+Usado pelo /api/admin/dashboard (Dashboard_api.py) e pelo /api/admin/filas
+(app.py), para que os dois não divirjam.
+
+Autossuficiente: não importa nada do app.py nem do worker.py.
+"""
+
+import os
+import hmac
+
+from flask import request
+
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+
+def token_ok():
+    """True se a requisição atual traz o X-Admin-Token correto."""
+    enviado = request.headers.get("X-Admin-Token", "")
+    if not ADMIN_TOKEN or not enviado:
+        return False
+    # Comparação em tempo constante (evita ataque de timing).
+    return hmac.compare_digest(enviado, ADMIN_TOKEN)
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+alocador_chaves.py
+==================
+Reserva de chaves de licença (produtos game/app) para entregas em paralelo.
+
+O worker fazia SELECT ... ORDER BY id FOR UPDATE e pegava a primeira linha:
+com vários processos entregando o mesmo produto, todos esperavam o lock da
+MESMA chave. Aqui:
+
+  1. Lote pré-separado no Redis (opcional, CHAVES_LOTE > 0): uma lista
+     "chaves:lote:<produto>" com ids livres. Cada entrega faz LPOP (atômico:
+     dois workers nunca recebem o mesmo id) e confirma com UPDATE
+     condicional (WHERE vendida = false; no Postgres com SKIP LOCKED, para
+     não esperar uma chave reservada por entrega ainda não commitada). Id
+     velho ou travado na lista = UPDATE não pega nada e passa para o
+     próximo.
+  2. Sem Redis/lote: Postgres usa FOR UPDATE SKIP LOCKED (cada worker pula
+     a chave que outro já travou); SQLite usa o UPDATE condicional com
+     poucas tentativas.
+
+Estoque: contador por produto no hash Redis "chaves:estoque" (HINCRBY na
+venda confirmada e na importação), inicializado com um COUNT só quando o
+campo não existe. O alerta de estoque baixo usa o contador (sem COUNT por
+venda) e dispara no máximo uma vez a cada ALERTA_ESTOQUE_INTERVALO_S.
+
+Os modelos são injetados no construtor (o worker tem os seus próprios).
+"""
+
+import os
+from datetime import datetime
+
+import redis
+
+from cache import get_redis
+
+CHAVES_LOTE = int(os.environ.get("CHAVES_LOTE", 20))
+CHAVES_LOTE_TTL_S = 3600
+ESTOQUE_MINIMO = int(os.environ.get("ESTOQUE_MINIMO", 10))
+ALERTA_ESTOQUE_INTERVALO_S = 6 * 3600
+TENTATIVAS_CONDICIONAL = 5
+
+CHAVE_ESTOQUE = "chaves:estoque"
+
+
+def _chave_lote(produto_id):
+    return f"chaves:lote:{produto_id}"
+
+
+def registrar_entrada(produto_id, quantidade):
+    """Chaves novas importadas (chamar depois do commit da importação)."""
+    r = get_redis()
+    if r is None or not quantidade:
+        return
+    try:
+        # Sem o campo, o próximo estoque() faz o COUNT e já inclui as novas.
+        if r.hexists(CHAVE_ESTOQUE, produto_id):
+            r.hincrby(CHAVE_ESTOQUE, produto_id, quantidade)
+        r.delete(f"chaves:alerta:{produto_id}")
+    except redis.RedisError as e:
+        print(f"[CHAVES] Falha ao atualizar contador do produto {produto_id}: {e}")
+
+
+class AlocadorChaves:
+    def __init__(self, db, ChaveLicenca, alertar=None):
+        self.db = db
+        self.ChaveLicenca = ChaveLicenca
+        # alertar(produto_id, restantes): chamado quando o estoque fica baixo.
+        self.alertar = alertar
+
+    # ------------------------------------------------------------------
+    # Reserva (dentro da transação da entrega; o commit é de quem chama)
+    # ------------------------------------------------------------------
+    def reservar(self, produto_id):
+        """Marca uma chave livre do produto como vendida. None = esgotado."""
+        chave = None
+        if CHAVES_LOTE > 0:
+            chave = self._reservar_do_lote(produto_id)
+        if chave is None:
+            if self.db.engine.dialect.name == "postgresql":
+                chave = self._reservar_skip_locked(produto_id)
+            else:
+                chave = self._reservar_condicional(produto_id)
+        return chave
+
+    def _livres(self, produto_id):
+        C = self.ChaveLicenca
+        return C.query.filter(C.produto_id == produto_id, C.vendida == False)  # noqa: E712
+
+    def _marcar(self, chave_id):
+        """UPDATE condicional: só pega a chave se ela ainda estiver livre.
+
+        No Postgres a linha é escolhida com FOR UPDATE SKIP LOCKED: uma chave
+        que outra entrega reservou e ainda não commitou (o lock dura até o
+        fim do e-mail) é pulada, em vez de o UPDATE esperar aquele commit."""
+        C = self.ChaveLicenca
+        alvo = C.query.filter(C.id == chave_id, C.vendida == False)  # noqa: E712
+        if self.db.engine.dialect.name == "postgresql":
+            livre = (self.db.session.query(C.id)
+                     .filter(C.id == chave_id, C.vendida == False)  # noqa: E712
+                     .with_for_update(skip_locked=True))
+            alvo = C.query.filter(C.id.in_(livre.scalar_subquery()))
+        pegou = alvo.update({"vendida": True, "vendida_em": datetime.utcnow()},
+                            synchronize_session=False)
+        if not pegou:
+            return None
+        return C.query.filter(C.id == chave_id).populate_existing().first()
+
+    def _reservar_skip_locked(self, produto_id):
+        chave = (self._livres(produto_id)
+                 .order_by(self.ChaveLicenca.id.asc())
+                 .with_for_update(skip_locked=True)
+                 .first())
+        if chave is not None:
+            chave.vendida = True
+            chave.vendida_em = datetime.utcnow()
+        return chave
+
+    def _reservar_condicional(self, produto_id):
+        for _ in range(TENTATIVAS_CONDICIONAL):
+            candidata = self._livres(produto_id).with_entities(self.ChaveLicenca.id) \
+                .order_by(self.ChaveLicenca.id.asc()).first()
+            if candidata is None:
+                return None
+            chave = self._marcar(candidata[0])
+            if chave is not None:
+                return chave
+        return None
+
+    def _reservar_do_lote(self, produto_id):
+        r = get_redis()
+        if r is None:
+            return None
+        try:
+            for _ in range(CHAVES_LOTE + 1):
+                bruto = r.lpop(_chave_lote(produto_id))
+                if bruto is None:
+                    if not self._encher_lote(r, produto_id):
+                        return None
+                    bruto = r.lpop(_chave_lote(produto_id))
+                    if bruto is None:
+                        return None
+                chave = self._marcar(int(bruto))
+                if chave is not None:
+                    return chave
+        except redis.RedisError as e:
+            print(f"[CHAVES] Redis indisponível para o lote ({e}); usando o banco direto.")
+        return None
+
+    def _encher_lote(self, r, produto_id):
+        """Separa os próximos CHAVES_LOTE ids livres. Só um processo enche por vez."""
+        if not r.set(f"{_chave_lote(produto_id)}:enchendo", 1, nx=True, ex=5):
+            return False
+        try:
+            ids = [i for (i,) in self._livres(produto_id)
+                   .with_entities(self.ChaveLicenca.id)
+                   .order_by(self.ChaveLicenca.id.asc())
+                   .limit(CHAVES_LOTE)]
+            if not ids:
+                return False
+            pipe = r.pipeline()
+            pipe.rpush(_chave_lote(produto_id), *ids)
+            pipe.expire(_chave_lote(produto_id), CHAVES_LOTE_TTL_S)
+            pipe.execute()
+            return True
+        finally:
+            r.delete(f"{_chave_lote(produto_id)}:enchendo")
+
+    # ------------------------------------------------------------------
+    # Contador de estoque (depois do commit)
+    # ------------------------------------------------------------------
+    def _contar_no_banco(self, produto_id):
+        return self._livres(produto_id).count()
+
+    def estoque(self, produto_id):
+        """Chaves livres do produto pelo contador (COUNT só na primeira vez)."""
+        r = get_redis()
+        if r is None:
+            return self._contar_no_banco(produto_id)
+        try:
+            valor = r.hget(CHAVE_ESTOQUE, produto_id)
+            if valor is not None:
+                return int(valor)
+            return self.recontar(produto_id)
+        except redis.RedisError:
+            return self._contar_no_banco(produto_id)
+
+    def recontar(self, produto_id):
+        """Recalcula o contador a partir do banco (reconciliação)."""
+        total = self._contar_no_banco(produto_id)
+        r = get_redis()
+        if r is not None:
+            try:
+                r.hset(CHAVE_ESTOQUE, produto_id, total)
+            except redis.RedisError as e:
+                print(f"[CHAVES] Falha ao gravar contador do produto {produto_id}: {e}")
+        return total
+
+    def confirmar_venda(self, produto_id):
+        """Chamar depois do commit da entrega: baixa o contador e alerta se estiver baixo."""
+        r = get_redis()
+        restantes = None
+        if r is not None:
+            try:
+                if r.hexists(CHAVE_ESTOQUE, produto_id):
+                    restantes = r.hincrby(CHAVE_ESTOQUE, produto_id, -1)
+            except redis.RedisError as e:
+                print(f"[CHAVES] Falha ao baixar contador do produto {produto_id}: {e}")
+        if restantes is None:
+            restantes = self.estoque(produto_id)
+        if restantes <= ESTOQUE_MINIMO and self.alertar is not None:
+            self._alertar_uma_vez(r, produto_id, restantes)
+        return restantes
+
+    def _alertar_uma_vez(self, r, produto_id, restantes):
+        if r is not None:
+            try:
+                if not r.set(f"chaves:alerta:{produto_id}", 1, nx=True, ex=ALERTA_ESTOQUE_INTERVALO_S):
+                    return
+            except redis.RedisError:
+                pass
+        try:
+            self.alertar(produto_id, restantes)
+        except Exception as e:
+            print(f"[CHAVES] Falha ao alertar estoque baixo do produto {produto_id}: {e}")
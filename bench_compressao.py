@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+bench_compressao.py
+===================
+Benchmark da compressão de PDF (/api/comprimir-pdf): gera PDFs sintéticos
+de 1, 10 e 100 MB (páginas com content streams sem compressão) e mede, cada
+caminho num processo novo, o RSS de pico e a latência:
+
+  antigo     upload copiado para um NamedTemporaryFile, pikepdf salva num
+             segundo arquivo, resposta lê esse arquivo (como o send_file);
+             "/tmp extra" = os dois arquivos (o de saída nunca era apagado);
+  streaming  compressor_pdf: pikepdf lê do upload e grava no tubo que a
+             resposta consome (mostra também o tempo até o primeiro bloco).
+
+  python bench_compressao.py [tamanhos em MB, padrão 1 10 100]
+
+O upload é simulado como o Werkzeug faz (TemporaryFile anônimo acima de
+500 KB). Os PDFs gerados ficam em BENCH_DIR (padrão: diretório temporário)
+e são apagados no fim.
+"""
+
+import os
+import sys
+import time
+import shutil
+import resource
+import tempfile
+import multiprocessing
+
+import compressor_pdf
+
+MB = 1024 * 1024
+LINHA = b"BT /F1 9 Tf 36 %d Td (BrooStore compressao de PDF - linha de teste %08d) Tj ET\n"
+
+
+def gerar_pdf(caminho, megabytes):
+    """PDF com ~1 MB de content stream (texto, sem compressão) por página."""
+    import pikepdf
+
+    pdf = pikepdf.new()
+    n = 0
+    for _ in range(megabytes):
+        linhas = []
+        tamanho = 0
+        while tamanho < MB:
+            linha = LINHA % (700 - n % 650, n)
+            linhas.append(linha)
+            tamanho += len(linha)
+            n += 1
+        pdf.add_blank_page()
+        pdf.pages[-1].Contents = pdf.make_stream(b"".join(linhas))
+    pdf.save(caminho, compress_streams=False)
+    pdf.close()
+
+
+def _memoria_mb(campo):
+    """VmRSS/VmHWM do /proc (Linux). O ru_maxrss não serve: atravessa o
+    fork+exec e traria o pico do processo pai (que gerou os PDFs)."""
+    try:
+        with open("/proc/self/status") as status:
+            for linha in status:
+                if linha.startswith(campo + ":"):
+                    return int(linha.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _linha_de_base():
+    """RSS atual, zerando o pico (VmHWM) para medir só o que vem depois."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+    return _memoria_mb("VmRSS")
+
+
+def _upload(caminho):
+    """Stream como o que o Werkzeug entrega para um upload grande."""
+    arquivo = tempfile.TemporaryFile()
+    with open(caminho, "rb") as origem:
+        shutil.copyfileobj(origem, arquivo)
+    arquivo.seek(0)
+    return arquivo
+
+
+def _antigo(caminho, resultado):
+    import pikepdf  # noqa: F401  (carregado antes da linha de base)
+    upload = _upload(caminho)
+    base = _linha_de_base()
+    inicio = time.monotonic()
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp_in:
+        shutil.copyfileobj(upload, tmp_in)
+    tmp_out = tmp_in.name.replace(".pdf", "_out.pdf")
+    try:
+        pdf = compressor_pdf.abrir(tmp_in.name)
+        compressor_pdf.salvar(pdf, tmp_out)
+        pdf.close()
+        disco = os.path.getsize(tmp_in.name) + os.path.getsize(tmp_out)
+        primeiro = time.monotonic() - inicio
+        total = 0
+        with open(tmp_out, "rb") as saida:
+            for bloco in iter(lambda: saida.read(compressor_pdf.PDF_BLOCO), b""):
+                total += len(bloco)
+    finally:
+        for p in (tmp_in.name, tmp_out):
+            if os.path.exists(p):
+                os.unlink(p)
+    resultado.send((base, _memoria_mb("VmHWM"), disco, primeiro, time.monotonic() - inicio, total))
+
+
+def _streaming(caminho, resultado):
+    import pikepdf  # noqa: F401
+    upload = _upload(caminho)
+    base = _linha_de_base()
+    inicio = time.monotonic()
+    primeiro = None
+    total = 0
+    for bloco in compressor_pdf.comprimir_em_stream(compressor_pdf.abrir(upload)):
+        if primeiro is None:
+            primeiro = time.monotonic() - inicio
+        total += len(bloco)
+    resultado.send((base, _memoria_mb("VmHWM"), 0, primeiro, time.monotonic() - inicio, total))
+
+
+def medir(funcao, caminho):
+    ctx = multiprocessing.get_context("spawn")
+    recebe, envia = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=funcao, args=(caminho, envia))
+    proc.start()
+    dados = recebe.recv()
+    proc.join()
+    return dados
+
+
+def main():
+    tamanhos = [int(a) for a in sys.argv[1:]] or [1, 10, 100]
+    pasta = tempfile.mkdtemp(dir=os.environ.get("BENCH_DIR"))
+    try:
+        print(f"{'entrada':>8} {'caminho':<10} {'saída':>9} {'RSS pico':>9} {'acima base':>10} "
+              f"{'/tmp extra':>10} {'1º bloco':>9} {'total':>8}")
+        for mb in tamanhos:
+            caminho = os.path.join(pasta, f"bench_{mb}mb.pdf")
+            gerar_pdf(caminho, mb)
+            entrada = os.path.getsize(caminho) / MB
+            for nome, funcao in (("antigo", _antigo), ("streaming", _streaming)):
+                base, pico, disco, primeiro, total_s, saida = medir(funcao, caminho)
+                print(f"{entrada:>6.1f}MB {nome:<10} {saida / MB:>7.2f}MB {pico:>7.0f}MB {pico - base:>8.0f}MB "
+                      f"{disco / MB:>8.1f}MB {primeiro:>8.2f}s {total_s:>7.2f}s")
+            os.unlink(caminho)
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
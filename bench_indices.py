@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+bench_indices.py
+================
+Benchmark dos índices das migrações (migracoes.py): popula um banco de
+TESTE com N cobranças (padrão 1.000.000) e proporcionais de chaves e
+licenças, roda as consultas quentes sem os índices, aplica as migrações e
+roda de novo, mostrando plano (EXPLAIN) e tempo de cada uma.
+
+  BENCH_DATABASE_URL=postgresql://... python bench_indices.py [N]
+
+Sem BENCH_DATABASE_URL usa sqlite:///bench_indices.db. NUNCA aponte para o
+banco de produção: o script apaga os índices das migrações antes de medir.
+"""
+
+import os
+import sys
+import time
+
+from sqlalchemy import create_engine, text
+
+import migracoes
+
+CONSULTAS = [
+    ("ranking (entregues por vendedor)",
+     "SELECT vendedor_codigo, COUNT(id) FROM cobrancas "
+     "WHERE status = 'delivered' AND vendedor_codigo IS NOT NULL GROUP BY vendedor_codigo", {}),
+    ("dashboard 30d (cobranças por data)",
+     "SELECT id, valor, status, data_criacao FROM cobrancas "
+     "WHERE data_criacao >= :desde ORDER BY data_criacao DESC", {"desde": None}),
+    ("reserva de chave (livre por produto)",
+     "SELECT id FROM chaves_licenca WHERE produto_id = 7 AND vendida = false ORDER BY id LIMIT 1", {}),
+    ("status de licença (mais recente por e-mail)",
+     "SELECT plano, status, expira_em FROM licencas "
+     "WHERE cliente_email = 'c123@bench' ORDER BY expira_em DESC LIMIT 1", {}),
+]
+
+# Tabelas mínimas (só se o banco de teste estiver vazio; com o schema do app também funciona).
+DDL = [
+    """CREATE TABLE IF NOT EXISTS cobrancas (
+        id INTEGER PRIMARY KEY, external_reference VARCHAR(100) UNIQUE NOT NULL,
+        cliente_nome VARCHAR(200) NOT NULL, cliente_email VARCHAR(200) NOT NULL,
+        valor FLOAT NOT NULL, status VARCHAR(50) NOT NULL, data_criacao TIMESTAMP NOT NULL,
+        vendedor_codigo VARCHAR(50), product_id INTEGER, observacoes TEXT)""",
+    """CREATE TABLE IF NOT EXISTS produtos (
+        id INTEGER PRIMARY KEY, nome VARCHAR(200), tipo VARCHAR(50))""",
+    """CREATE TABLE IF NOT EXISTS chaves_licenca (
+        id INTEGER PRIMARY KEY, chave_serial VARCHAR(100) UNIQUE NOT NULL,
+        produto_id INTEGER NOT NULL, vendida BOOLEAN NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS licencas (
+        id INTEGER PRIMARY KEY, cliente_email VARCHAR(200) NOT NULL, plano VARCHAR(50),
+        status VARCHAR(30) NOT NULL, expira_em TIMESTAMP NOT NULL)""",
+]
+
+SEED_PG = [
+    """INSERT INTO cobrancas (external_reference, cliente_nome, cliente_email, valor, status, data_criacao, vendedor_codigo)
+       SELECT 'bench-' || g, 'Cliente', 'c' || (g % 50000) || '@bench', 10 + g % 90,
+              (ARRAY['pending','approved','delivered','cancelled'])[1 + g % 4],
+              now() - (g % 365) * interval '1 day' - (g % 86400) * interval '1 second',
+              CASE WHEN g % 3 = 0 THEN 'V' || (g % 50) END
+       FROM generate_series(1, :n) g""",
+    """INSERT INTO chaves_licenca (chave_serial, produto_id, vendida)
+       SELECT 'KEY-' || g, 1 + g % 20, g % 10 <> 0 FROM generate_series(1, :n / 10) g""",
+    """INSERT INTO licencas (cliente_email, plano, status, expira_em)
+       SELECT 'c' || (g % 50000) || '@bench', 'mensal', 'ativa', now() + (g % 60 - 30) * interval '1 day'
+       FROM generate_series(1, :n / 5) g""",
+]
+
+SEED_SQLITE = [
+    """INSERT INTO cobrancas (external_reference, cliente_nome, cliente_email, valor, status, data_criacao, vendedor_codigo)
+       WITH RECURSIVE s(g) AS (SELECT 1 UNION ALL SELECT g + 1 FROM s WHERE g < :n)
+       SELECT 'bench-' || g, 'Cliente', 'c' || (g % 50000) || '@bench', 10 + g % 90,
+              CASE g % 4 WHEN 0 THEN 'pending' WHEN 1 THEN 'approved' WHEN 2 THEN 'delivered' ELSE 'cancelled' END,
+              datetime('now', '-' || (g % 365) || ' days', '-' || (g % 86400) || ' seconds'),
+              CASE WHEN g % 3 = 0 THEN 'V' || (g % 50) END
+       FROM s""",
+    """INSERT INTO chaves_licenca (chave_serial, produto_id, vendida)
+       WITH RECURSIVE s(g) AS (SELECT 1 UNION ALL SELECT g + 1 FROM s WHERE g < :n / 10)
+       SELECT 'KEY-' || g, 1 + g % 20, g % 10 <> 0 FROM s""",
+    """INSERT INTO licencas (cliente_email, plano, status, expira_em)
+       WITH RECURSIVE s(g) AS (SELECT 1 UNION ALL SELECT g + 1 FROM s WHERE g < :n / 5)
+       SELECT 'c' || (g % 50000) || '@bench', 'mensal', 'ativa', datetime('now', (g % 60 - 30) || ' days')
+       FROM s""",
+]
+
+
+def _indices_das_migracoes():
+    return [d[0] for _mid, _desc, funcao in migracoes.MIGRACOES for d in getattr(funcao, "indices", ())]
+
+
+def popular(conn, n):
+    postgres = conn.dialect.name == "postgresql"
+    for ddl in DDL:
+        conn.execute(text(ddl.replace("INTEGER PRIMARY KEY", "SERIAL PRIMARY KEY") if postgres else ddl))
+    ja_tem = conn.execute(text("SELECT COUNT(*) FROM cobrancas WHERE external_reference LIKE 'bench-%'")).scalar()
+    if ja_tem >= n:
+        print(f"[BENCH] Banco já populado ({ja_tem} cobranças de teste).")
+        return
+    inicio = time.monotonic()
+    for sql in (SEED_PG if postgres else SEED_SQLITE):
+        conn.execute(text(sql), {"n": n})
+    if postgres:
+        conn.execute(text("ANALYZE"))
+    print(f"[BENCH] {n} cobranças (+ chaves e licenças) inseridas em {time.monotonic() - inicio:.1f}s.")
+
+
+def medir(conn, titulo):
+    postgres = conn.dialect.name == "postgresql"
+    print(f"\n===== {titulo} =====")
+    resultados = {}
+    for nome, sql, params in CONSULTAS:
+        params = dict(params)
+        if "desde" in params:
+            params["desde"] = conn.execute(text(
+                "SELECT now() - interval '30 days'" if postgres else "SELECT datetime('now', '-30 days')")).scalar()
+        plano_sql = ("EXPLAIN (ANALYZE, BUFFERS) " if postgres else "EXPLAIN QUERY PLAN ") + sql
+        plano = [" | ".join(str(c) for c in r) for r in conn.execute(text(plano_sql), params)]
+        tempos = []
+        for _ in range(3):
+            inicio = time.monotonic()
+            conn.execute(text(sql), params).fetchall()
+            tempos.append((time.monotonic() - inicio) * 1000)
+        resultados[nome] = min(tempos)
+        print(f"\n-- {nome}: {min(tempos):.1f} ms (melhor de 3)")
+        for linha in plano:
+            print(f"   {linha}")
+    return resultados
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    url = os.environ.get("BENCH_DATABASE_URL", "sqlite:///bench_indices.db")
+    if url.startswith("postgres://") or url.startswith("postgresql://"):
+        url = url.replace("postgres://", "postgresql+psycopg://", 1).replace("postgresql://", "postgresql+psycopg://", 1)
+    engine = create_engine(url)
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        popular(conn, n)
+        migracoes.pendentes(conn)  # garante schema_migracoes
+        for nome in _indices_das_migracoes():
+            conn.execute(text(f"DROP INDEX IF EXISTS {nome}"))
+        conn.execute(text("DELETE FROM schema_migracoes"))
+        antes = medir(conn, "ANTES (sem índices das migrações)")
+
+    migracoes.aplicar(engine)
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("ANALYZE"))
+        depois = medir(conn, "DEPOIS (migrações aplicadas)")
+
+    print("\n===== RESUMO (ms) =====")
+    for nome, _sql, _p in CONSULTAS:
+        ganho = antes[nome] / depois[nome] if depois[nome] else float("inf")
+        print(f"{nome:45s} {antes[nome]:10.1f} -> {depois[nome]:8.1f}   ({ganho:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+cache.py
+========
+Cache em dois níveis para os caminhos quentes da BrooStore:
+
+  1. LRU em memória do processo (com TTL) — leitura sem rede;
+  2. Redis compartilhado entre os workers do gunicorn e o worker RQ (com TTL).
+
+Invalidação explícita (delete) apaga a chave no Redis e publica no canal
+CANAL_INVALIDACAO; cada processo escuta o canal e descarta a cópia local.
+O ouvinte só sobe na primeira leitura (processo que nunca lê não precisa
+dele) e ignora as mensagens do próprio processo (marcadas com _origem).
+Se o Redis estiver fora, o cache degrada para apenas o nível local (e a
+cópia local expira sozinha pelo TTL).
+
+Autossuficiente: não importa nada do app.py nem do worker.py.
+Os valores precisam ser serializáveis em JSON.
+"""
+
+import os
+import json
+import time
+import secrets
+import threading
+from collections import OrderedDict
+
+import redis
+
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379")
+CANAL_INVALIDACAO = "cache:invalidacao"
+
+# Depois de uma falha de conexão, espera este tempo antes de tentar de novo
+# (evita pagar o connect timeout em toda requisição com o Redis fora).
+REDIS_RECONEXAO_S = 30
+
+_redis = None
+_redis_falhou_em = 0.0
+_redis_lock = threading.Lock()
+
+
+def get_redis():
+    """Conexão Redis lazy e compartilhada no processo. Retorna None se indisponível."""
+    global _redis, _redis_falhou_em
+    if _redis is not None:
+        return _redis
+    if time.monotonic() - _redis_falhou_em < REDIS_RECONEXAO_S:
+        return None
+    with _redis_lock:
+        if _redis is not None:
+            return _redis
+        try:
+            conn = redis.from_url(REDIS_URL, socket_connect_timeout=3, socket_timeout=3)
+            conn.ping()
+            _redis = conn
+        except Exception as e:
+            _redis_falhou_em = time.monotonic()
+            print(f"[CACHE] Redis indisponível: {e}")
+    return _redis
+
+
+def _marcar_redis_falho():
+    """Descarta a conexão após erro de rede; a próxima chamada reconecta (com backoff)."""
+    global _redis, _redis_falhou_em
+    _redis = None
+    _redis_falhou_em = time.monotonic()
+
+
+# ----------------------------------------------------------------------
+# Nível 1: LRU local
+# ----------------------------------------------------------------------
+class CacheLRU:
+    """LRU thread-safe com TTL por item."""
+
+    def __init__(self, max_itens=1024, ttl=60):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._itens = OrderedDict()  # chave -> (expira_em, valor)
+        self._lock = threading.Lock()
+
+    def get(self, chave):
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                return None
+            expira_em, valor = item
+            if expira_em < time.monotonic():
+                del self._itens[chave]
+                return None
+            self._itens.move_to_end(chave)
+            return valor
+
+    def set(self, chave, valor, ttl=None):
+        with self._lock:
+            self._itens[chave] = (time.monotonic() + (ttl or self.ttl), valor)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    def delete(self, chave):
+        with self._lock:
+            self._itens.pop(chave, None)
+
+    def clear(self):
+        with self._lock:
+            self._itens.clear()
+
+
+# ----------------------------------------------------------------------
+# Nível 1 + 2
+# ----------------------------------------------------------------------
+_caches = {}  # nome -> CacheDoisNiveis (para o ouvinte de invalidação)
+_ouvinte = None
+# Identifica as mensagens deste processo no canal (o pid se repete entre
+# máquinas; refeito depois de um fork).
+_origem = secrets.token_hex(6)
+
+
+def _mensagem(nome, chave):
+    return f"@{_origem}|{nome}|{chave}"
+
+
+class CacheDoisNiveis:
+    """LRU local na frente de um Redis compartilhado.
+
+    As chaves no Redis ficam como "<nome>:<chave>". Erros do Redis nunca
+    sobem para quem chama: a operação cai para o nível local.
+    """
+
+    def __init__(self, nome, ttl_local=30, ttl_redis=300, max_itens=1024):
+        self.nome = nome
+        self.ttl_redis = ttl_redis
+        self.local = CacheLRU(max_itens=max_itens, ttl=ttl_local)
+        self.stats = {"hit_local": 0, "hit_redis": 0, "miss": 0}
+        _caches[nome] = self
+
+    def _chave_redis(self, chave):
+        return f"{self.nome}:{chave}"
+
+    def get(self, chave):
+        chave = str(chave)
+        if _ouvinte is None:
+            _iniciar_ouvinte()
+        valor = self.local.get(chave)
+        if valor is not None:
+            self.stats["hit_local"] += 1
+            return valor
+        r = get_redis()
+        if r is not None:
+            try:
+                bruto = r.get(self._chave_redis(chave))
+            except redis.RedisError as e:
+                print(f"[CACHE] {self.nome}: falha no GET ({e})")
+                _marcar_redis_falho()
+                bruto = None
+            if bruto is not None:
+                valor = json.loads(bruto)
+                self.local.set(chave, valor)
+                self.stats["hit_redis"] += 1
+                return valor
+        self.stats["miss"] += 1
+        return None
+
+    def set(self, chave, valor, ttl_redis=None):
+        chave = str(chave)
+        self.local.set(chave, valor)
+        r = get_redis()
+        if r is None:
+            return
+        try:
+            r.set(self._chave_redis(chave), json.dumps(valor), ex=ttl_redis or self.ttl_redis)
+        except redis.RedisError as e:
+            print(f"[CACHE] {self.nome}: falha no SET ({e})")
+            _marcar_redis_falho()
+
+    def delete(self, chave):
+        """Invalida a chave em todos os processos."""
+        chave = str(chave)
+        self.local.delete(chave)
+        r = get_redis()
+        if r is None:
+            return
+        try:
+            pipe = r.pipeline()
+            pipe.delete(self._chave_redis(chave))
+            pipe.publish(CANAL_INVALIDACAO, _mensagem(self.nome, chave))
+            pipe.execute()
+        except redis.RedisError as e:
+            print(f"[CACHE] {self.nome}: falha ao invalidar ({e})")
+            _marcar_redis_falho()
+
+    def atualizar(self, chave, valor, ttl_redis=None):
+        """Write-through: grava o valor novo e derruba as cópias locais dos outros processos."""
+        chave = str(chave)
+        self.local.set(chave, valor)
+        r = get_redis()
+        if r is None:
+            return
+        try:
+            pipe = r.pipeline()
+            pipe.set(self._chave_redis(chave), json.dumps(valor), ex=ttl_redis or self.ttl_redis)
+            pipe.publish(CANAL_INVALIDACAO, _mensagem(self.nome, chave))
+            pipe.execute()
+        except redis.RedisError as e:
+            print(f"[CACHE] {self.nome}: falha no write-through ({e})")
+            _marcar_redis_falho()
+
+    def obter(self, chave, carregar):
+        """Lê do cache; no miss chama carregar() e guarda o resultado (se não for None)."""
+        valor = self.get(chave)
+        if valor is None:
+            valor = carregar()
+            if valor is not None:
+                self.set(chave, valor)
+        return valor
+
+
+def _escutar_invalidacoes():
+    """Thread daemon: descarta cópias locais invalidadas por outros processos."""
+    while True:
+        try:
+            # Conexão própria, sem socket_timeout (listen() fica bloqueado esperando).
+            conn = redis.from_url(REDIS_URL, socket_connect_timeout=3, health_check_interval=30)
+            pubsub = conn.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CANAL_INVALIDACAO)
+            for msg in pubsub.listen():
+                dado = msg.get("data")
+                if isinstance(dado, bytes):
+                    dado = dado.decode()
+                dado = str(dado)
+                if dado.startswith("@"):
+                    origem, _, dado = dado[1:].partition("|")
+                    if origem == _origem:
+                        continue  # o próprio processo já atualizou a cópia local
+                nome, _, chave = dado.partition("|")
+                cache = _caches.get(nome)
+                if cache is not None:
+                    cache.local.delete(chave)
+        except Exception as e:
+            print(f"[CACHE] Ouvinte de invalidação caiu ({e}); nova tentativa em {REDIS_RECONEXAO_S}s.")
+            # Enquanto o ouvinte está fora, nada garante que as cópias locais
+            # estão frescas: limpa tudo e deixa o TTL/Redis repopular.
+            for cache in list(_caches.values()):
+                cache.local.clear()
+            time.sleep(REDIS_RECONEXAO_S)
+
+
+def _iniciar_ouvinte():
+    global _ouvinte
+    if _ouvinte is not None:
+        return
+    with _redis_lock:
+        if _ouvinte is None:
+            _ouvinte = threading.Thread(target=_escutar_invalidacoes, name="cache-invalidacao", daemon=True)
+            _ouvinte.start()
+
+
+def _apos_fork():
+    """Processo filho (fork): não reaproveita o socket nem o ouvinte do pai.
+    O ouvinte do filho sobe na primeira leitura (nada de thread aqui)."""
+    global _redis, _ouvinte, _redis_lock, _origem
+    _redis = None
+    _ouvinte = None
+    _redis_lock = threading.Lock()
+    _origem = secrets.token_hex(6)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_apos_fork)
@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+"""
+checkout.py
+===========
+Motor único do checkout (PIX e cartão) e fan-out das consultas externas.
+
+MotorCheckout concentra o que os dois endpoints têm em comum: consultas,
+cupom, frete, total, criação do pagamento no Mercado Pago (SDK compartilhado
+do mp_cliente.py) e gravação da Cobranca. O que muda entre PIX e cartão fica
+numa classe de método de pagamento (MetodoPix / MetodoCartao).
+
+Os modelos e a fase de consultas com banco vêm do app.py por injeção no
+construtor, para este módulo não importar o app (import circular).
+
+O gunicorn roda poucos workers síncronos; se o checkout fizer Supabase,
+Melhor Envio e banco em fila, um upstream lento segura o worker inteiro.
+Aqui as chamadas de rede vão para um pool de threads enquanto o thread da
+requisição cuida do banco local; só a criação do pagamento no Mercado Pago
+espera pelos resultados.
+
+Cada upstream tem seu timeout e todos dividem um orçamento total de
+latência (CHECKOUT_ORCAMENTO_S). Estourou: a consulta é abandonada e o
+checkout segue com o valor padrão (ex.: frete fixo do produto). A chamada
+abandonada termina sozinha no pool (e alimenta os caches).
+"""
+
+import os
+import json
+import time
+import uuid
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturoTimeout
+
+from mercadopago.config import RequestOptions
+
+import mp_cliente
+import vendas_diarias
+
+CHECKOUT_THREADS = int(os.environ.get("CHECKOUT_THREADS", 8))
+CHECKOUT_ORCAMENTO_S = float(os.environ.get("CHECKOUT_ORCAMENTO_S", 8))
+
+# Timeouts por upstream (segundos), sempre limitados pelo orçamento restante.
+TIMEOUTS = {
+    "catalogo": float(os.environ.get("CHECKOUT_TIMEOUT_CATALOGO", 4)),
+    "melhor_envio": float(os.environ.get("CHECKOUT_TIMEOUT_FRETE", 6)),
+}
+
+# Timeout da criação do pagamento. Fica FORA do orçamento: abandonar uma
+# chamada que já pode ter criado o pagamento deixaria uma cobrança órfã.
+TIMEOUT_MERCADO_PAGO = float(os.environ.get("CHECKOUT_TIMEOUT_MP", 20))
+
+_pool = ThreadPoolExecutor(max_workers=CHECKOUT_THREADS, thread_name_prefix="checkout")
+
+
+class Orcamento:
+    """Orçamento de latência de um checkout (cronômetro + tempos por etapa)."""
+
+    def __init__(self, total=CHECKOUT_ORCAMENTO_S):
+        self.total = total
+        self.inicio = time.monotonic()
+        self.etapas = {}
+
+    def restante(self):
+        return max(0.0, self.total - (time.monotonic() - self.inicio))
+
+    def limite(self, upstream):
+        return min(TIMEOUTS.get(upstream, self.total), self.restante())
+
+    def marcar(self, etapa, desde):
+        self.etapas[etapa] = round((time.monotonic() - desde) * 1000)
+
+    def resumo(self):
+        total = round((time.monotonic() - self.inicio) * 1000)
+        partes = " ".join(f"{k}={v}ms" for k, v in self.etapas.items())
+        return f"{partes} total={total}ms"
+
+
+def em_paralelo(fn, *args, **kwargs):
+    """Agenda fn no pool do checkout e devolve o Future."""
+    return _pool.submit(fn, *args, **kwargs)
+
+
+def aguardar(futuro, upstream, orcamento, padrao=None):
+    """Resultado do futuro dentro do timeout do upstream/orçamento; senão `padrao`."""
+    if futuro is None:
+        return padrao
+    inicio = time.monotonic()
+    limite = orcamento.limite(upstream)
+    try:
+        return futuro.result(timeout=limite)
+    except FuturoTimeout:
+        print(f"[CHECKOUT] {upstream} não respondeu em {limite:.1f}s; seguindo com o padrão.")
+        return padrao
+    except Exception as e:
+        print(f"[CHECKOUT] {upstream} falhou: {e}")
+        return padrao
+    finally:
+        orcamento.marcar(upstream, inicio)
+
+
+# ----------------------------------------------------------------------
+# Métodos de pagamento
+# ----------------------------------------------------------------------
+class MetodoPix:
+    nome = "pix"
+    msg_sem_dados = "Nenhum dado foi enviado."
+    msg_falha = "Falha ao criar cobrança"
+
+    def validar(self, dados):
+        email = dados.get("email")
+        if not email or "@" not in email or "." not in email:
+            return "Por favor, insira um email válido e obrigatório."
+        telefone = dados.get("telefone")
+        if telefone and len("".join(filter(str.isdigit, telefone))) < 10:
+            return "Telefone inválido."
+        return None
+
+    def montar_pagamento(self, dados, pedido):
+        return {
+            "transaction_amount": pedido["total_cobrado"],
+            "description": pedido["descricao"],
+            "payment_method_id": "pix",
+            "external_reference": pedido["external_reference"],
+            "payer": {
+                "email": pedido["email"],
+            }
+        }
+
+    def erro_mp(self, payment_response):
+        msg = (payment_response.get("response") or {}).get("message", "Erro desconhecido do Mercado Pago")
+        return f"Erro do Mercado Pago: {msg}"
+
+    def resposta(self, pedido, payment, cobranca_dict):
+        transaction_data = payment["point_of_interaction"]["transaction_data"]
+        return {
+            "status": "success",
+            "message": "Cobrança PIX criada com sucesso!",
+            "qr_code_base64": transaction_data["qr_code_base64"],
+            "qr_code_text": transaction_data["qr_code"],
+            "payment_id": payment["id"],
+            "cobranca": cobranca_dict,
+        }
+
+
+class MetodoCartao:
+    nome = "cartao"
+    msg_sem_dados = "Nenhum dado enviado."
+    msg_falha = "Falha ao criar cobrança com cartão"
+
+    def __init__(self, enfileirar_pagamento):
+        # Pagamento aprovado na hora: a entrega é enfileirada sem esperar o webhook.
+        self.enfileirar_pagamento = enfileirar_pagamento
+
+    def validar(self, dados):
+        if not dados.get("token"):
+            return "Token do cartão é obrigatório."
+        email = dados.get("email")
+        if not email or "@" not in email:
+            return "E-mail inválido."
+        return None
+
+    def montar_pagamento(self, dados, pedido):
+        nome = pedido["nome"]
+        cpf = dados.get("cpf", "")
+        payment_data = {
+            "transaction_amount": pedido["total_cobrado"],
+            "token":              dados.get("token"),
+            "description":        pedido["descricao"],
+            "installments":       int(dados.get("installments", 1)),
+            "payment_method_id":  dados.get("payment_method_id"),
+            "external_reference": pedido["external_reference"],
+            "payer": {
+                "email": pedido["email"],
+                "first_name": nome.split()[0] if nome else "Cliente",
+                "last_name":  " ".join(nome.split()[1:]) if len(nome.split()) > 1 else ".",
+                "identification": {
+                    "type":   "CPF",
+                    "number": cpf.replace(".", "").replace("-", "")
+                }
+            }
+        }
+        if dados.get("issuer_id"):
+            payment_data["issuer_id"] = int(dados["issuer_id"])
+        return payment_data
+
+    def erro_mp(self, payment_response):
+        resp_body = payment_response.get("response") or {}
+        error_msg = (
+            resp_body.get("message")
+            or resp_body.get("error")
+            or str(resp_body)
+            or "Erro desconhecido do Mercado Pago"
+        )
+        print(f"[CARTAO] ERRO MP completo: {payment_response}")
+        return f"Erro MP: {error_msg}"
+
+    def resposta(self, pedido, payment, cobranca_dict):
+        status_mp = payment.get("status")
+        status_detail = payment.get("status_detail", "")
+        if status_mp == "approved":
+            try:
+                self.enfileirar_pagamento(payment["id"])
+            except Exception as _rq_err:
+                print(f"[CARTAO] Falha ao enfileirar a entrega do pagamento: {_rq_err}")
+            mensagem = "Pagamento aprovado! Você receberá o produto por e-mail em instantes."
+        elif status_mp == "in_process":
+            mensagem = "Pagamento em análise. Você receberá o produto assim que aprovado."
+        else:
+            mensagem = f"Pagamento não aprovado ({status_detail}). Verifique os dados do cartão."
+        return {
+            "status":        status_mp,
+            "status_detail": status_detail,
+            "payment_id":    payment["id"],
+            "mensagem":      mensagem,
+        }
+
+
+# ----------------------------------------------------------------------
+# Motor
+# ----------------------------------------------------------------------
+# Produto de moedas: o external_reference carrega o usuario_id do jogo.
+PRODUTO_MOEDAS = 7
+
+
+class MotorCheckout:
+    """Checkout completo com um único commit por pedido.
+
+    db            -> instância Flask-SQLAlchemy do app
+    Cobranca      -> modelo da tabela cobrancas
+    preparar      -> app.preparar_checkout (consultas em paralelo)
+    """
+
+    def __init__(self, db, Cobranca, preparar):
+        self.db = db
+        self.Cobranca = Cobranca
+        self.preparar = preparar
+
+    def processar(self, dados, metodo):
+        """Executa o checkout. Retorna (corpo_json, status_http)."""
+        try:
+            return self._processar(dados, metodo)
+        except Exception as e:
+            self.db.session.rollback()
+            print(f"ERRO CRÍTICO GERAL ({metodo.nome.upper()}): {str(e)}")
+            return {"status": "error", "message": f"{metodo.msg_falha}: {str(e)}"}, 500
+
+    def _processar(self, dados, metodo):
+        if not dados:
+            return {"status": "error", "message": metodo.msg_sem_dados}, 400
+
+        erro = metodo.validar(dados)
+        if erro:
+            return {"status": "error", "message": erro}, 400
+
+        product_id = dados.get("product_id")
+        if not product_id:
+            return {"status": "error", "message": "ID do produto é obrigatório."}, 400
+
+        email_cliente = dados.get("email")
+        nome_cliente = dados.get("nome", "Cliente")
+        endereco = dados.get("endereco") or {}
+
+        # Consultas (Supabase / Melhor Envio / banco) em paralelo, com orçamento de latência
+        ck = self.preparar(
+            product_id,
+            cupom_id=dados.get("cupom_id"),
+            vendedor_codigo=dados.get("vendedor_codigo"),
+            cep_destino=endereco.get("cep") or dados.get("cep_destino"),
+            servico_id=dados.get("frete_servico_id"),
+        )
+        orc = ck["orcamento"]
+        produto = ck["produto"]
+        if not produto:
+            return {"status": "error", "message": "Produto não encontrado."}, 404
+
+        valor_original = produto.preco
+        valor_final = valor_original
+        cupom_obj = ck["cupom"]
+        cupom_aplicado = False
+        if cupom_obj:
+            valido, _ = cupom_obj.esta_valido()
+            if valido and (cupom_obj.produto_id is None or cupom_obj.produto_id == int(product_id)):
+                valor_final = cupom_obj.calcular_desconto(valor_original)["valor_final"]
+                cupom_obj.usos_atuais += 1
+                cupom_aplicado = True
+
+        # --- FRETE AUTORITATIVO (recotado no servidor; fallback = frete fixo) ---
+        if ck["frete_indisponivel"]:
+            return {"status": "error", "message": "Não foi possível calcular o frete agora. Tente novamente em instantes."}, 503
+        frete_aplicado = ck["frete_aplicado"]
+        frete_servico_desc = ck["frete_servico_desc"]
+        subtotal_produto = round(valor_final, 2)
+        total_cobrado = round(subtotal_produto + frete_aplicado, 2)
+
+        descricao = produto.nome
+        if cupom_aplicado:
+            descricao += f" (Cupom: {cupom_obj.codigo})"
+        if frete_aplicado > 0:
+            descricao += " + Frete"
+
+        # --- EXTERNAL_REFERENCE (mesmo valor no MP e na cobrança local) ---
+        unique_id = str(uuid.uuid4())
+        usuario_id = dados.get("usuario_id")
+        if usuario_id and int(product_id) == PRODUTO_MOEDAS:
+            external_reference = f"{usuario_id}:{unique_id}"
+        else:
+            external_reference = unique_id
+
+        # --- CRIAÇÃO DO PAGAMENTO NO MERCADO PAGO ---
+        sdk = mp_cliente.get_sdk()
+        if sdk is None:
+            return {"status": "error", "message": "Token do Mercado Pago não configurado."}, 500
+
+        pedido = {
+            "email": email_cliente,
+            "nome": nome_cliente,
+            "descricao": descricao,
+            "total_cobrado": total_cobrado,
+            "external_reference": external_reference,
+        }
+        payment_data = metodo.montar_pagamento(dados, pedido)
+        request_options = RequestOptions(
+            connection_timeout=TIMEOUT_MERCADO_PAGO,
+            custom_headers={"X-Idempotency-Key": str(uuid.uuid4())},
+        )
+
+        inicio_mp = time.monotonic()
+        payment_response = sdk.payment().create(payment_data, request_options)
+        orc.marcar("mercado_pago", inicio_mp)
+
+        if payment_response["status"] not in (200, 201):
+            self.db.session.rollback()
+            return {"status": "error", "message": metodo.erro_mp(payment_response)}, 500
+        payment = payment_response["response"]
+
+        # --- COBRANÇA NO BANCO: produto, cupom e cobrança num único commit ---
+        obs = {}
+        if endereco:
+            obs["endereco"] = endereco
+        if frete_aplicado > 0:
+            obs["frete"] = frete_aplicado
+        if frete_servico_desc:
+            obs["transportadora"] = frete_servico_desc
+        obs["subtotal_produto"] = subtotal_produto
+
+        nova_cobranca = self.Cobranca(
+            external_reference=external_reference,
+            cliente_nome=nome_cliente,
+            cliente_email=email_cliente,
+            cliente_telefone=dados.get("telefone"),
+            valor=total_cobrado,
+            valor_original=round(valor_original, 2),
+            status=payment.get("status"),
+            data_criacao=datetime.utcnow(),
+            product_id=produto.id,
+            vendedor_codigo=ck["vendedor_codigo"],
+            cupom_id=cupom_obj.id if cupom_aplicado else None,
+            frete=frete_aplicado,
+            subtotal_produto=subtotal_produto,
+            transportadora=frete_servico_desc[:100] if frete_servico_desc else None,
+            observacoes=json.dumps(obs),
+        )
+        self.db.session.add(nova_cobranca)
+        # Rollup do dashboard/ranking no mesmo commit da cobrança.
+        vendas_diarias.registrar(self.db.session, nova_cobranca, produto.tipo)
+        inicio_db = time.monotonic()
+        self.db.session.commit()
+        orc.marcar("commit", inicio_db)
+        print(f"[CHECKOUT] {metodo.nome} {orc.resumo()}")
+
+        resposta = metodo.resposta(pedido, payment, nova_cobranca.to_dict())
+        resposta.update({
+            "frete_aplicado": frete_aplicado,
+            "subtotal_produto": subtotal_produto,
+            "total_cobrado": total_cobrado,
+        })
+        if cupom_aplicado:
+            resposta["desconto_aplicado"] = {
+                "cupom_codigo": cupom_obj.codigo,
+                "tipo": cupom_obj.tipo,
+                "valor_desconto": round(valor_original - valor_final, 2),
+                "valor_original": round(valor_original, 2),
+                "valor_final": round(valor_final, 2)
+            }
+        return resposta, 201
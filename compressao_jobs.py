@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+compressao_jobs.py
+==================
+Compressão de PDF/imagem em segundo plano, fora dos workers do gunicorn.
+
+Uma compressão de 80 MB segurava um dos dois workers síncronos do web por
+minutos. Aqui o upload é gravado no disco local, a compressão vai para um
+pool de processos e a requisição volta na hora com o id do job:
+
+  POST /api/comprimir-pdf | /api/comprimir-imagem  (assincrono=1)  -> 202 {job_id}
+  GET  /api/compressao/<id>[?esperar=s]    estado (na_fila, processando, pronto, erro)
+  GET  /api/compressao/<id>/arquivo        resultado, por COMPRESSAO_RETENCAO_S
+
+  - pool de processos por worker do gunicorn (lazy, depois do fork),
+    COMPRESSAO_PROCESSOS cada; com os 2 workers, a soma usa todos os
+    núcleos da instância. Contexto "spawn": os processos filhos só
+    importam este módulo e os compressores (nem o app, nem o banco);
+  - o estado de cada job fica em COMPRESSAO_DIR/<id>/status.json (gravação
+    atômica), então qualquer worker do gunicorn responde o polling, e quem
+    grava "processando"/"pronto"/"erro" é o próprio processo do pool;
+  - no máximo COMPRESSAO_MAX_PENDENTES jobs na fila/rodando por instância
+    (o disco e a RAM do plano são pequenos); acima disso, 503;
+  - jobs vencidos (e os travados por um processo que morreu) são apagados
+    do disco numa limpeza a cada COMPRESSAO_LIMPEZA_S;
+  - o código de liberação é reservado pelo app antes do envio; se o job
+    termina em erro, o callback `ao_falhar` (rodando no worker do gunicorn)
+    devolve o código;
+  - PDF passa por compressor_pdf.comprimir_arquivo() (redução das imagens
+    em série dentro do job, já que o pool usa todos os núcleos, e
+    Ghostscript como reserva); motor e razão vão no status.
+
+Por que não uma fila RQ: o worker RQ roda noutro serviço do Render, sem
+disco compartilhado com o web; o upload e o resultado teriam que passar
+pelo Redis (25 MB no plano free). O pool local mantém os arquivos no disco
+da própria instância que recebe o upload e serve o download.
+
+Autossuficiente: não importa nada do app.py nem do worker.py.
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import secrets
+import tempfile
+import threading
+import multiprocessing
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import compressor_imagem
+import compressor_pdf
+
+
+def _nucleos():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+COMPRESSAO_DIR = os.environ.get("COMPRESSAO_DIR") or os.path.join(tempfile.gettempdir(), "broostore-compressao")
+# Cada worker do gunicorn (WEB_CONCURRENCY, 2 no render.yaml) tem o seu pool.
+COMPRESSAO_PROCESSOS = int(os.environ.get(
+    "COMPRESSAO_PROCESSOS", max(1, _nucleos() // int(os.environ.get("WEB_CONCURRENCY", 2)))))
+COMPRESSAO_MAX_PENDENTES = int(os.environ.get("COMPRESSAO_MAX_PENDENTES", 8))
+COMPRESSAO_RETENCAO_S = int(os.environ.get("COMPRESSAO_RETENCAO_S", 1800))
+COMPRESSAO_TRAVADO_S = 3600  # na fila/processando sem atualização há mais que isso = perdido
+COMPRESSAO_LIMPEZA_S = 60
+COMPRESSAO_ESPERA_MAX_S = 10  # long-poll: segura um worker síncrono, então pouco
+TAREFAS_POR_PROCESSO = 50     # renova o processo do pool (memória do qpdf/Pillow)
+
+ESTADOS_FINAIS = ("pronto", "erro")
+TIPOS = {
+    # tipo: (extensão de saída, mimetype, nome do download)
+    "pdf": (".pdf", "application/pdf", "comprimido.pdf"),
+    "imagem": (".jpg", "image/jpeg", "imagem_comprimida.jpg"),
+}
+
+_ID_VALIDO = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+_pool = None
+_pool_lock = threading.Lock()
+_limpeza_em = 0.0
+
+
+# ----------------------------------------------------------------------
+# Estado no disco
+# ----------------------------------------------------------------------
+def _pasta(job_id):
+    if not _ID_VALIDO.match(job_id or ""):
+        return None
+    return os.path.join(COMPRESSAO_DIR, job_id)
+
+
+def _agora():
+    return datetime.utcnow().isoformat(timespec="seconds")
+
+
+def _ler(job_id):
+    pasta = _pasta(job_id)
+    if pasta is None:
+        return None
+    try:
+        with open(os.path.join(pasta, "status.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _gravar(job_id, **campos):
+    """Atualiza o status.json do job (escrita atômica com os.replace)."""
+    pasta = _pasta(job_id)
+    atual = _ler(job_id) or {"id": job_id}
+    atual.update(campos, atualizado_em=_agora())
+    temporario = os.path.join(pasta, f"status.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(temporario, "w") as f:
+        json.dump(atual, f)
+    os.replace(temporario, os.path.join(pasta, "status.json"))
+    return atual
+
+
+def _saida(job_id, tipo):
+    return os.path.join(_pasta(job_id), "saida" + TIPOS[tipo][0])
+
+
+# ----------------------------------------------------------------------
+# Execução (dentro do processo do pool)
+# ----------------------------------------------------------------------
+def _executar(job_id):
+    atual = _gravar(job_id, estado="processando")
+    tipo, preset = atual["tipo"], atual.get("preset") or compressor_pdf.PDF_PRESET_PADRAO
+    entrada = os.path.join(_pasta(job_id), "entrada")
+    saida = _saida(job_id, tipo)
+    inicio = time.monotonic()
+    try:
+        relatorio = {}
+        if tipo == "pdf":
+            # Imagens reduzidas pelo preset, Ghostscript como reserva (compressor_pdf.py).
+            # Sem pool aninhado: este processo já é um dos COMPRESSAO_PROCESSOS.
+            completo = compressor_pdf.comprimir_arquivo(entrada, saida, preset, pool=None)
+            relatorio = {k: completo[k] for k in ("motor", "razao", "imagens")}
+        else:
+            buf, _kb = compressor_imagem.comprimir(entrada)
+            with open(saida, "wb") as f:
+                f.write(buf.getbuffer())
+        os.unlink(entrada)
+        expira_em = datetime.utcnow() + timedelta(seconds=COMPRESSAO_RETENCAO_S)
+        _gravar(job_id, estado="pronto", tamanho_saida=os.path.getsize(saida),
+                expira_em=expira_em.isoformat(timespec="seconds"), **relatorio)
+        print(f"[COMPRESSAO] ✅ Job {job_id[:8]} ({tipo}) pronto em {time.monotonic() - inicio:.1f}s.")
+    except Exception as e:
+        # O qpdf cita o caminho do arquivo; o cliente não precisa ver a pasta do job.
+        mensagem = str(e).replace(entrada + ": ", "").replace(entrada, "arquivo")
+        _gravar(job_id, estado="erro", mensagem=mensagem or type(e).__name__)
+        print(f"[COMPRESSAO] ❌ Job {job_id[:8]} ({tipo}) falhou: {e}")
+
+
+# ----------------------------------------------------------------------
+# Lado do web
+# ----------------------------------------------------------------------
+def _obter_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=COMPRESSAO_PROCESSOS,
+                mp_context=multiprocessing.get_context("spawn"),
+                max_tasks_per_child=TAREFAS_POR_PROCESSO,
+            )
+            print(f"[COMPRESSAO] Pool com {COMPRESSAO_PROCESSOS} processo(s) (pid {os.getpid()}).")
+        return _pool
+
+
+def _descartar_pool(pool=None):
+    """Descarta o pool (só se ainda for `pool`, quando informado); o próximo envio cria outro."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or (pool is not None and _pool is not pool):
+            return
+        pool, _pool = _pool, None
+    # Fora do lock: o shutdown chama os callbacks dos jobs cancelados.
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _ao_terminar(job_id, pool, ao_falhar=None):
+    def callback(futuro):
+        erro = BrokenProcessPool("pool encerrado") if futuro.cancelled() else futuro.exception()
+        if erro is not None:
+            # Processo do pool morreu (ex.: falta de memória): o job não gravou o erro.
+            print(f"[COMPRESSAO] ❌ Job {job_id[:8]} perdido: {type(erro).__name__}: {erro}")
+            try:
+                _gravar(job_id, estado="erro", mensagem="Falha interna na compressão. Tente novamente.")
+            except OSError:
+                pass
+            if isinstance(erro, BrokenProcessPool):
+                _descartar_pool(pool)
+        if ao_falhar is not None and (_ler(job_id) or {}).get("estado") == "erro":
+            try:
+                ao_falhar(job_id)
+            except Exception as e:
+                print(f"[COMPRESSAO] ⚠️ Job {job_id[:8]}: ao_falhar falhou: {e}")
+    return callback
+
+
+def pendentes():
+    """Jobs na fila ou processando nesta instância."""
+    try:
+        ids = os.listdir(COMPRESSAO_DIR)
+    except FileNotFoundError:
+        return 0
+    return sum(1 for job_id in ids if (_ler(job_id) or {}).get("estado") in ("na_fila", "processando"))
+
+
+def novo_id():
+    return secrets.token_urlsafe(18)
+
+
+def enviar(tipo, arquivo, codigo, preset=None, job_id=None, ao_falhar=None):
+    """Grava o upload (FileStorage) e enfileira a compressão (PDF no `preset`,
+    ver compressor_pdf.PRESETS). `job_id` (de novo_id()) permite reservar o
+    código antes do envio; `ao_falhar(job_id)` é chamado se o job terminar em
+    erro. Retorna o job_id, ou None se já houver COMPRESSAO_MAX_PENDENTES jobs
+    pendentes."""
+    limpar()
+    if pendentes() >= COMPRESSAO_MAX_PENDENTES:
+        return None
+    job_id = job_id or novo_id()
+    pasta = _pasta(job_id)
+    os.makedirs(pasta)
+    try:
+        arquivo.save(os.path.join(pasta, "entrada"))
+        _gravar(job_id, tipo=tipo, estado="na_fila", codigo=codigo, preset=preset, criado_em=_agora(),
+                tamanho_entrada=os.path.getsize(os.path.join(pasta, "entrada")))
+        for tentativa in range(2):
+            pool = _obter_pool()
+            try:
+                futuro = pool.submit(_executar, job_id)
+                break
+            except (BrokenProcessPool, RuntimeError):
+                _descartar_pool(pool)
+                if tentativa:
+                    raise
+    except Exception:
+        shutil.rmtree(pasta, ignore_errors=True)
+        raise
+    futuro.add_done_callback(_ao_terminar(job_id, pool, ao_falhar))
+    print(f"[COMPRESSAO] Job {job_id[:8]} ({tipo}) na fila.")
+    return job_id
+
+
+def status(job_id):
+    """Estado do job (dict do status.json) ou None se não existe/venceu."""
+    limpar()
+    return _ler(job_id)
+
+
+def aguardar(job_id, segundos):
+    """Long-poll: espera o job terminar por até `segundos` (limitado a COMPRESSAO_ESPERA_MAX_S)."""
+    limite = time.monotonic() + max(0, min(segundos, COMPRESSAO_ESPERA_MAX_S))
+    atual = status(job_id)
+    while atual is not None and atual.get("estado") not in ESTADOS_FINAIS and time.monotonic() < limite:
+        time.sleep(0.25)
+        atual = _ler(job_id)
+    return atual
+
+
+def resultado(job_id):
+    """(caminho, mimetype, nome do download) do job pronto, ou None."""
+    atual = status(job_id)
+    if not atual or atual.get("estado") != "pronto":
+        return None
+    _ext, mimetype, nome = TIPOS[atual["tipo"]]
+    caminho = _saida(job_id, atual["tipo"])
+    return (caminho, mimetype, nome) if os.path.exists(caminho) else None
+
+
+def limpar(forcar=False):
+    """Apaga jobs vencidos e travados (no máximo a cada COMPRESSAO_LIMPEZA_S)."""
+    global _limpeza_em
+    agora = time.monotonic()
+    if not forcar and agora - _limpeza_em < COMPRESSAO_LIMPEZA_S:
+        return 0
+    _limpeza_em = agora
+    try:
+        ids = os.listdir(COMPRESSAO_DIR)
+    except FileNotFoundError:
+        return 0
+    agora_utc = datetime.utcnow()
+    apagados = 0
+    for job_id in ids:
+        pasta = _pasta(job_id)
+        if pasta is None:
+            continue
+        atual = _ler(job_id)
+        try:
+            parado_s = time.time() - os.path.getmtime(pasta if atual is None else os.path.join(pasta, "status.json"))
+        except OSError:
+            continue
+        if atual is None or atual.get("estado") == "erro":
+            vencido = parado_s > COMPRESSAO_RETENCAO_S
+        elif atual.get("estado") == "pronto":
+            vencido = datetime.fromisoformat(atual["expira_em"]) <= agora_utc
+        else:
+            vencido = parado_s > COMPRESSAO_TRAVADO_S
+        if vencido:
+            shutil.rmtree(pasta, ignore_errors=True)
+            apagados += 1
+    if apagados:
+        print(f"[COMPRESSAO] {apagados} job(s) vencido(s) apagado(s).")
+    return apagados
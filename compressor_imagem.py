@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+compressor_imagem.py
+====================
+Compressão de imagem (produto 98): JPEG/PNG/WebP -> JPEG de até alvo_kb.
+
+Usado pelo /api/comprimir-imagem (modo síncrono) e pelos processos de
+compressão em segundo plano (compressao_jobs.py).
+Autossuficiente: não importa nada do app.py nem do worker.py.
+"""
+
+import io
+
+
+def comprimir(arquivo, qualidade=82, max_px=1920, alvo_kb=900):
+    """Redimensiona e comprime uma imagem para JPEG, respeitando alvo_kb.
+
+    arquivo: caminho ou stream. Retorna (BytesIO, tamanho_kb)."""
+    from PIL import Image  # só quando usado: o app sobe sem carregar o Pillow
+
+    img = Image.open(arquivo)
+
+    # Converte modos especiais para RGB (ex: RGBA, P)
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+
+    # Redimensiona mantendo proporção se maior que max_px
+    img.thumbnail((max_px, max_px), Image.LANCZOS)
+
+    # Tenta qualidade desejada; reduz até ficar abaixo do alvo
+    for q in [qualidade, 75, 65, 55]:
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=q, optimize=True, progressive=True)
+        tamanho_kb = buf.tell() / 1024
+        if tamanho_kb <= alvo_kb:
+            break
+
+    buf.seek(0)
+    return buf, tamanho_kb
@@ -0,0 +1,463 @@
+# -*- coding: utf-8 -*-
+"""
+compressor_pdf.py
+=================
+Compressão de PDF (produto 99) sem arquivo temporário no disco.
+
+O /api/comprimir-pdf gravava o upload num NamedTemporaryFile, salvava o
+resultado num segundo arquivo, devolvia com send_file e nunca apagava o de
+saída: o /tmp da instância (512 MB) enchia. Aqui:
+
+  - entrada: o próprio stream do upload. O Werkzeug já faz o spool
+    (até 500 KB em memória, acima disso num TemporaryFile anônimo, sem
+    nome no disco e liberado quando o request fecha), e o pikepdf lê dele
+    sob demanda;
+  - saída: o pikepdf salva numa thread, escrevendo num tubo (fila limitada
+    de blocos de PDF_BLOCO bytes) que a resposta consome em streaming. No
+    máximo PDF_BLOCOS_EM_VOO blocos ficam em memória; download cancelado
+    interrompe a gravação;
+  - nada com nome no disco para limpar: o Pdf é fechado no fim do stream,
+    com sucesso, erro ou cancelamento.
+
+Só recomprimir os streams quase não reduz PDF escaneado ou cheio de fotos.
+reduzir_imagens() percorre as imagens (XObjects) pelo conteúdo das páginas,
+calcula o DPI em que cada uma é exibida e, acima do DPI do preset, reduz e
+recodifica em JPEG com o Pillow:
+
+  preset   DPI  qualidade   Ghostscript
+  screen    72     50       /screen
+  ebook    150     70       /ebook      (padrão, PDF_PRESET_PADRAO)
+  print    300     85       /printer
+
+  - imagem que já é JPEG e não precisa reduzir fica como está, e a nova
+    só entra se ficar menor que a original; máscaras, 1 bit, CMYK e
+    /Decode ficam como estão;
+  - comprimir_arquivo() (jobs de compressao_jobs.py, que têm o arquivo no
+    disco): se o pikepdf falhar ou reduzir menos de 10%, tenta o
+    Ghostscript (instalado pelo build.sh) e fica com o menor. Devolve razão
+    e tempo do arquivo. Nos jobs as imagens são reduzidas em série: cada
+    job já ocupa um processo do pool de compressao_jobs.py, que usa todos
+    os núcleos. Quem passa um `pool` (a linha de comando, um só para todos
+    os arquivos) tem as páginas divididas entre os processos dele;
+  - no streaming a redução roda na própria thread de gravação, sem pool
+    nem Ghostscript (os dois precisam do arquivo com nome no disco).
+
+Razão e tempo por arquivo: python compressor_pdf.py [--preset ebook] a.pdf ...
+Benchmark (RSS de pico e latência para 1/10/100 MB): python bench_compressao.py
+Autossuficiente: não importa nada do app.py nem do worker.py.
+"""
+
+import io
+import os
+import sys
+import math
+import time
+import queue
+import shutil
+import threading
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+PDF_BLOCO = int(os.environ.get("PDF_BLOCO", 64 * 1024))
+PDF_BLOCOS_EM_VOO = 4
+_FIM = object()
+
+PRESETS = {
+    # preset: (DPI alvo das imagens, qualidade JPEG, -dPDFSETTINGS do Ghostscript)
+    "screen": (72, 50, "/screen"),
+    "ebook": (150, 70, "/ebook"),
+    "print": (300, 85, "/printer"),
+}
+PDF_PRESET_PADRAO = os.environ.get("PDF_PRESET_PADRAO", "ebook")
+PDF_LIMIAR_REDUCAO = 1.5   # só reduz acima de 1.5x o DPI alvo (como o Ghostscript)
+PDF_IMAGEM_MIN_PX = 32     # ícones e fios: não compensa recodificar
+# Pool da linha de comando; 0 = um processo por núcleo disponível
+PDF_IMAGENS_PROCESSOS = int(os.environ.get("PDF_IMAGENS_PROCESSOS", 0)) or (
+    len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1)
+PDF_IMAGENS_MIN_PARALELO = 4  # com menos imagens, dividir custa mais do que rende
+PDF_IMAGENS_POR_LOTE = 4      # cada lote reabre o PDF no processo do pool
+PDF_GHOSTSCRIPT = os.environ.get("PDF_GHOSTSCRIPT") or shutil.which("gs")
+PDF_GS_TIMEOUT_S = int(os.environ.get("PDF_GS_TIMEOUT_S", 300))
+PDF_GS_SE_RAZAO_ACIMA = 0.9   # pikepdf reduziu menos de 10%: tenta o Ghostscript
+_IDENTIDADE = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+
+def abrir(entrada):
+    """Abre o PDF (caminho ou stream binário com seek). Erro de PDF inválido sai aqui."""
+    import pikepdf  # só quando usado: o app sobe sem carregar o qpdf
+    return pikepdf.open(entrada)
+
+
+def salvar(pdf, saida):
+    """Grava o PDF comprimido (streams com Flate, object streams, linearizado)."""
+    import pikepdf
+    pdf.save(
+        saida,
+        compress_streams=True,
+        object_stream_mode=pikepdf.ObjectStreamMode.generate,
+        linearize=True,
+    )
+
+
+# ----------------------------------------------------------------------
+# Redução das imagens
+# ----------------------------------------------------------------------
+def _multiplicar(m, n):
+    """Produto de matrizes de transformação do PDF (a b c d e f)."""
+    a, b, c, d, e, f = m
+    A, B, C, D, E, F = n
+    return (a * A + b * C, a * B + b * D, c * A + d * C, c * B + d * D,
+            e * A + f * C + E, e * B + f * D + F)
+
+
+def _recursos(pagina):
+    """/Resources da página, herdado da árvore de páginas se ela não tiver."""
+    no = pagina.obj
+    for _ in range(32):
+        if no is None or "/Resources" in no:
+            return None if no is None else no.Resources
+        no = no.get("/Parent")
+    return None
+
+
+def _tamanhos_exibidos(pdf):
+    """{objgen da imagem: [largura_pt, altura_pt]}: o maior tamanho em que cada
+    imagem é desenhada (Do) nas páginas, entrando nos XObjects de formulário."""
+    import pikepdf
+
+    tamanhos = {}
+
+    def visitar(conteudo, recursos, ctm, caminho):
+        xobjects = recursos.get("/XObject") if recursos is not None else None
+        if xobjects is None:
+            return
+        pilha = []
+        for operandos, operador in pikepdf.parse_content_stream(conteudo, "q Q cm Do"):
+            op = str(operador)
+            if op == "q":
+                pilha.append(ctm)
+            elif op == "Q":
+                ctm = pilha.pop() if pilha else ctm
+            elif op == "cm" and len(operandos) == 6:
+                ctm = _multiplicar(tuple(float(x) for x in operandos), ctm)
+            elif op == "Do":
+                xobj = xobjects.get(operandos[0])
+                if not isinstance(xobj, pikepdf.Stream):
+                    continue
+                if xobj.get("/Subtype") == "/Image":
+                    largura, altura = math.hypot(ctm[0], ctm[1]), math.hypot(ctm[2], ctm[3])
+                    atual = tamanhos.setdefault(xobj.objgen, [0.0, 0.0])
+                    atual[0], atual[1] = max(atual[0], largura), max(atual[1], altura)
+                elif xobj.get("/Subtype") == "/Form" and xobj.objgen not in caminho:
+                    matriz = tuple(float(x) for x in xobj.get("/Matrix", _IDENTIDADE))
+                    visitar(xobj, xobj.get("/Resources", recursos),
+                            _multiplicar(matriz, ctm), caminho | {xobj.objgen})
+
+    for numero, pagina in enumerate(pdf.pages, 1):
+        try:
+            visitar(pagina, _recursos(pagina), _IDENTIDADE, frozenset())
+        except (pikepdf.PdfError, ValueError, TypeError) as e:
+            # Conteúdo que o qpdf não entende: as imagens dessa página ficam como estão.
+            print(f"[COMPRIMIR] Página {numero} ignorada na redução de imagens: {e}")
+    return tamanhos
+
+
+def _reduzivel(imagem):
+    """Imagem que dá para passar para JPEG sem mudar a aparência."""
+    import pikepdf
+
+    filtros = imagem.get("/Filter")
+    filtros = [str(f) for f in filtros] if isinstance(filtros, pikepdf.Array) else [str(filtros)]
+    return (
+        int(imagem.get("/Width", 0)) >= PDF_IMAGEM_MIN_PX
+        and int(imagem.get("/Height", 0)) >= PDF_IMAGEM_MIN_PX
+        and not imagem.get("/ImageMask", False)
+        and int(imagem.get("/BitsPerComponent", 0)) == 8
+        and "/Decode" not in imagem
+        and not isinstance(imagem.get("/Mask"), pikepdf.Array)  # cor-chave não sobrevive ao JPEG
+        and not {"/JBIG2Decode", "/CCITTFaxDecode"} & set(filtros)
+    ), "/DCTDecode" in filtros
+
+
+def _tarefas(pdf, dpi):
+    """[(objgen, (largura, altura) nova)] das imagens a recodificar, na ordem das páginas."""
+    tarefas = []
+    for objgen, (largura_pt, altura_pt) in _tamanhos_exibidos(pdf).items():
+        imagem = pdf.get_object(objgen)
+        reduzivel, ja_jpeg = _reduzivel(imagem)
+        if not reduzivel or not largura_pt or not altura_pt:
+            continue
+        w, h = int(imagem.Width), int(imagem.Height)
+        # Mesma escala nos dois eixos, pelo eixo que precisa de mais resolução.
+        escala = max(largura_pt * dpi / 72 / w, altura_pt * dpi / 72 / h)
+        if escala * PDF_LIMIAR_REDUCAO < 1:
+            tarefas.append((objgen, (max(1, round(w * escala)), max(1, round(h * escala)))))
+        elif not ja_jpeg:
+            tarefas.append((objgen, (w, h)))  # só recodifica (ex.: foto em Flate)
+    return tarefas
+
+
+def _reduzir(imagem, tamanho, qualidade):
+    """(jpeg, modo, bytes economizados) da imagem no `tamanho`, ou None se não
+    der para converter ou não ficar menor que a original."""
+    import pikepdf
+    from PIL import Image
+
+    try:
+        pil = pikepdf.PdfImage(imagem).as_pil_image()
+    except Exception:
+        return None  # espaço de cor/filtro que o pikepdf não decodifica
+    if pil.mode == "P":
+        pil = pil.convert("RGB")
+    if pil.mode not in ("RGB", "L"):
+        return None  # CMYK, 16 bits...: fica como está
+    if pil.size != tamanho:
+        pil = pil.resize(tamanho, Image.LANCZOS)
+    buf = io.BytesIO()
+    pil.save(buf, "JPEG", quality=qualidade, optimize=True)
+    economia = len(imagem.read_raw_bytes()) - buf.tell()
+    if economia <= 0:
+        return None
+    return buf.getvalue(), pil.mode, economia
+
+
+def _reduzir_lote(caminho, lote, qualidade):
+    """(Processo do pool) Reduz as imagens do lote, abrindo o PDF pelo caminho."""
+    pdf = abrir(caminho)
+    try:
+        return [(objgen, tamanho, _reduzir(pdf.get_object(objgen), tamanho, qualidade))
+                for objgen, tamanho in lote]
+    finally:
+        pdf.close()
+
+
+def _aplicar(imagem, tamanho, jpeg, modo):
+    import pikepdf
+
+    espaco = imagem.get("/ColorSpace")
+    # ICC com o mesmo número de componentes continua valendo para o JPEG.
+    icc = (isinstance(espaco, pikepdf.Array) and len(espaco) == 2 and espaco[0] == "/ICCBased"
+           and int(espaco[1].get("/N", 0)) == (3 if modo == "RGB" else 1))
+    imagem.write(jpeg, filter=pikepdf.Name.DCTDecode)
+    imagem.Width, imagem.Height = tamanho
+    imagem.BitsPerComponent = 8
+    if not icc:
+        imagem.ColorSpace = pikepdf.Name.DeviceRGB if modo == "RGB" else pikepdf.Name.DeviceGray
+    for chave in ("/DecodeParms", "/SMaskInData"):
+        if chave in imagem:
+            del imagem[chave]
+
+
+def novo_pool(processos=PDF_IMAGENS_PROCESSOS):
+    """Pool (spawn) para reduzir_imagens/comprimir_arquivo. Crie um e use em
+    vários arquivos: cada processo importa pikepdf e Pillow ao subir."""
+    return ProcessPoolExecutor(max_workers=processos, mp_context=multiprocessing.get_context("spawn"))
+
+
+def reduzir_imagens(pdf, preset=PDF_PRESET_PADRAO, caminho=None, pool=None):
+    """Reduz para o DPI e recodifica na qualidade do preset as imagens do `pdf`.
+
+    Com `caminho` (o arquivo de onde o `pdf` foi aberto) e um `pool` (ver
+    novo_pool), as páginas são divididas em lotes entre os processos dele;
+    sem, roda em série neste processo. Retorna (imagens trocadas, bytes
+    economizados)."""
+    dpi, qualidade, _ajuste_gs = PRESETS[preset]
+    tarefas = _tarefas(pdf, dpi)
+    if caminho and pool is not None and len(tarefas) >= PDF_IMAGENS_MIN_PARALELO:
+        # Lotes pequenos e contíguos: páginas vizinhas juntas, carga equilibrada.
+        lotes = [tarefas[i:i + PDF_IMAGENS_POR_LOTE] for i in range(0, len(tarefas), PDF_IMAGENS_POR_LOTE)]
+        resultados = [r for lote in pool.map(_reduzir_lote, [caminho] * len(lotes), lotes,
+                                             [qualidade] * len(lotes)) for r in lote]
+    else:
+        resultados = ((objgen, tamanho, _reduzir(pdf.get_object(objgen), tamanho, qualidade))
+                      for objgen, tamanho in tarefas)
+
+    trocadas = economizados = 0
+    for objgen, tamanho, reduzida in resultados:
+        if reduzida is None:
+            continue
+        jpeg, modo, economia = reduzida
+        _aplicar(pdf.get_object(objgen), tamanho, jpeg, modo)
+        trocadas += 1
+        economizados += economia
+    return trocadas, economizados
+
+
+# ----------------------------------------------------------------------
+# Arquivo no disco (jobs): pikepdf + imagens, Ghostscript como reserva
+# ----------------------------------------------------------------------
+def _ghostscript(entrada, saida, preset):
+    dpi, _qualidade, ajuste = PRESETS[preset]
+    subprocess.run(
+        [PDF_GHOSTSCRIPT, "-q", "-dNOPAUSE", "-dBATCH", "-dSAFER",
+         "-sDEVICE=pdfwrite", "-dCompatibilityLevel=1.5", f"-dPDFSETTINGS={ajuste}",
+         f"-dColorImageResolution={dpi}", f"-dGrayImageResolution={dpi}",
+         f"-sOutputFile={saida}", os.path.abspath(entrada)],
+        check=True, capture_output=True, timeout=PDF_GS_TIMEOUT_S,
+    )
+
+
+def comprimir_arquivo(entrada, saida, preset=PDF_PRESET_PADRAO, pool=None):
+    """Comprime o PDF `entrada` em `saida` (caminhos) e devolve o relatório
+    {"motor", "preset", "entrada", "saida", "razao", "segundos", "imagens"}.
+    `pool`: ver reduzir_imagens.
+
+    Motor pikepdf (com reduzir_imagens); se ele falhar ou reduzir menos que
+    PDF_GS_SE_RAZAO_ACIMA, o Ghostscript, ficando o menor. Se nada ficar
+    menor que a entrada, a saída é a própria entrada (motor "original")."""
+    inicio = time.monotonic()
+    tamanho = os.path.getsize(entrada)
+    relatorio = {"motor": "pikepdf", "preset": preset, "entrada": tamanho, "imagens": 0}
+    erro = None
+    try:
+        pdf = abrir(entrada)
+        try:
+            relatorio["imagens"], _ = reduzir_imagens(pdf, preset, caminho=entrada, pool=pool)
+            salvar(pdf, saida)
+        finally:
+            pdf.close()
+    except Exception as e:
+        erro = e
+
+    if PDF_GHOSTSCRIPT and (erro or os.path.getsize(saida) > tamanho * PDF_GS_SE_RAZAO_ACIMA):
+        alternativa = saida + ".gs"
+        try:
+            _ghostscript(entrada, alternativa, preset)
+            if erro or os.path.getsize(alternativa) < os.path.getsize(saida):
+                os.replace(alternativa, saida)
+                relatorio["motor"] = "ghostscript"
+                erro = None
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"[COMPRIMIR] Ghostscript falhou: {e}")
+        finally:
+            if os.path.exists(alternativa):
+                os.unlink(alternativa)
+    if erro is not None:
+        raise erro
+
+    if os.path.getsize(saida) >= tamanho:
+        shutil.copyfile(entrada, saida)
+        relatorio["motor"] = "original"
+    relatorio["saida"] = os.path.getsize(saida)
+    relatorio["razao"] = round(relatorio["saida"] / tamanho, 3) if tamanho else 1.0
+    relatorio["segundos"] = round(time.monotonic() - inicio, 2)
+    print(f"[COMPRIMIR] {relatorio['motor']}/{preset}: {tamanho / 1048576:.1f} MB -> "
+          f"{relatorio['saida'] / 1048576:.1f} MB (razão {relatorio['razao']}, "
+          f"{relatorio['segundos']}s, {relatorio['imagens']} imagem(ns) reduzida(s)).")
+    return relatorio
+
+
+# ----------------------------------------------------------------------
+# Streaming (resposta síncrona)
+# ----------------------------------------------------------------------
+class _Tubo(io.RawIOBase):
+    """Arquivo só de escrita que entrega blocos para outra thread por uma fila limitada."""
+
+    def __init__(self, bloco=PDF_BLOCO, em_voo=PDF_BLOCOS_EM_VOO):
+        super().__init__()
+        self.fila = queue.Queue(maxsize=em_voo)
+        self.bloco = bloco
+        self.cancelado = threading.Event()
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        if self.cancelado.is_set():
+            raise BrokenPipeError("download cancelado")
+        self._buffer += dados
+        if len(self._buffer) >= self.bloco:
+            self._entregar(bytes(self._buffer))
+            self._buffer.clear()
+        return len(dados)
+
+    def _entregar(self, item):
+        while True:
+            if self.cancelado.is_set():
+                raise BrokenPipeError("download cancelado")
+            try:
+                self.fila.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def terminar(self, erro=None):
+        """Fim da escrita: o que restou no buffer e o marcador de fim (ou o erro)."""
+        try:
+            if erro is None and self._buffer:
+                self._entregar(bytes(self._buffer))
+            self._buffer.clear()
+            self._entregar(_FIM if erro is None else erro)
+        except BrokenPipeError:
+            pass
+
+    def cancelar(self):
+        self.cancelado.set()
+        while True:  # desbloqueia um put() pendente
+            try:
+                self.fila.get_nowait()
+            except queue.Empty:
+                return
+
+
+def comprimir_em_stream(pdf, preset=None):
+    """Gera os bytes do PDF comprimido enquanto o pikepdf grava (numa thread).
+
+    Com `preset`, reduz as imagens antes de gravar. Fecha o `pdf` ao
+    terminar. Se o consumidor parar antes do fim (close() do gerador), a
+    gravação é interrompida."""
+    tubo = _Tubo()
+
+    def gravar():
+        try:
+            if preset:
+                try:
+                    trocadas, economizados = reduzir_imagens(pdf, preset)
+                    print(f"[COMPRIMIR] {trocadas} imagem(ns) reduzida(s) ({preset}), "
+                          f"-{economizados / 1048576:.1f} MB.")
+                except Exception as e:
+                    # Sem pool nem Ghostscript aqui: segue só com a recompressão.
+                    print(f"[COMPRIMIR] Redução de imagens falhou ({e}); seguindo sem ela.")
+            salvar(pdf, tubo)
+            tubo.terminar()
+        except BaseException as e:
+            tubo.terminar(e)
+        finally:
+            pdf.close()
+
+    thread = threading.Thread(target=gravar, name="comprimir-pdf", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = tubo.fila.get()
+            if item is _FIM:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        tubo.cancelar()
+        thread.join()
+
+
+def main():
+    args = sys.argv[1:]
+    preset = PDF_PRESET_PADRAO
+    if len(args) >= 2 and args[0] == "--preset":
+        preset, args = args[1], args[2:]
+    if preset not in PRESETS or not args:
+        print(f"uso: python compressor_pdf.py [--preset {'|'.join(PRESETS)}] arquivo.pdf ...")
+        sys.exit(2)
+    with novo_pool() as pool:
+        for entrada in args:
+            saida = os.path.splitext(entrada)[0] + "_comprimido.pdf"
+            try:
+                comprimir_arquivo(entrada, saida, preset, pool)
+            except Exception as e:
+                print(f"[COMPRIMIR] ❌ {entrada}: {e}")
+
+
+if __name__ == "__main__":
+    main()
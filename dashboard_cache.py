@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+dashboard_cache.py
+==================
+Cache da resposta do /api/admin/dashboard (Central Financeira), por período.
+
+O painel faz polling e cada chamada refazia todas as consultas. Aqui a
+resposta pronta fica no CacheDoisNiveis (LRU local + Redis) por
+DASHBOARD_CACHE_TTL_S, já em JSON comprimido com gzip e com o ETag
+calculado: o hit só devolve bytes (ou 304 se o painel mandar o ETag).
+
+Invalidação: o worker chama invalidar() depois de cada entrega (cobrança
+paga); o delete do cache.py publica no canal e todos os processos
+descartam a cópia local.
+
+Autossuficiente: não importa nada do app.py nem do worker.py.
+"""
+
+import os
+import gzip
+import json
+import base64
+import hashlib
+
+from cache import CacheDoisNiveis
+
+DASHBOARD_CACHE_TTL_S = int(os.environ.get("DASHBOARD_CACHE_TTL_S", 30))
+PERIODOS = ("7d", "30d", "90d", "todos")
+
+_cache = CacheDoisNiveis("dashboard", ttl_local=DASHBOARD_CACHE_TTL_S,
+                         ttl_redis=DASHBOARD_CACHE_TTL_S, max_itens=len(PERIODOS))
+
+
+def obter(periodo):
+    """Entrada em cache do período ({"etag", "gz"}) ou None."""
+    if periodo not in PERIODOS:
+        return None
+    return _cache.get(periodo)
+
+
+def gravar(periodo, payload):
+    """Serializa, comprime e guarda o payload. Retorna a entrada."""
+    corpo = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()
+    entrada = {
+        "etag": hashlib.sha1(corpo).hexdigest()[:20],
+        "gz": base64.b64encode(gzip.compress(corpo, compresslevel=6)).decode(),
+    }
+    if periodo in PERIODOS:
+        _cache.set(periodo, entrada)
+    return entrada
+
+
+def corpo_gzip(entrada):
+    """Bytes gzip da entrada (decodificados uma vez por cópia local)."""
+    gz = entrada.get("_bytes")
+    if gz is None:
+        gz = entrada["_bytes"] = base64.b64decode(entrada["gz"])
+    return gz
+
+
+def invalidar():
+    """Derruba a resposta de todos os períodos em todos os processos."""
+    for periodo in PERIODOS:
+        _cache.delete(periodo)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+filas.py
+========
+Nomes de filas RQ e chaves Redis compartilhadas entre o app (web) e o
+worker, mais o resumo de profundidade/idade das filas.
+
+Cada etapa da venda tem a sua fila, para que uma etapa lenta (handshake
+SMTP, insert no Supabase) não segure as outras:
+
+  licencas    ativação/renovação de assinatura + e-mail da licença
+  emails      entrega de produto digital/físico (chave + e-mail)
+  pagamentos  verificação do pagamento no Mercado Pago (webhook)
+  supabase    registro da venda no dashboard (best-effort)
+  manutencao  tarefas periódicas do supervisor (reconciliação do ranking,
+              drenagem do outbox de webhooks)
+
+O worker escuta na ordem de FILAS_POR_PRIORIDADE: entregas primeiro (o
+cliente já pagou e está esperando), depois novas verificações, e o
+Supabase e a manutenção por último.
+"""
+
+import time
+from datetime import datetime, timezone
+
+FILA_PAGAMENTOS = "pagamentos"
+FILA_LICENCAS = "licencas"
+FILA_EMAILS = "emails"
+FILA_SUPABASE = "supabase"
+FILA_MANUTENCAO = "manutencao"
+# Fila antiga: ainda escutada para drenar jobs enfileirados antes da divisão.
+FILA_PADRAO = "default"
+
+FILAS_POR_PRIORIDADE = [FILA_LICENCAS, FILA_EMAILS, FILA_PAGAMENTOS, FILA_SUPABASE, FILA_MANUTENCAO,
+                        FILA_PADRAO]
+
+# Janela máxima de deduplicação de webhooks: enquanto existir esta chave,
+# já há um job enfileirado (ainda não iniciado) para o pagamento. O worker
+# apaga a chave ao começar o job, então uma notificação nova depois disso
+# (ex.: "pending" -> "approved") volta a enfileirar.
+WEBHOOK_JANELA_S = 600
+
+# Status de job que já garantem que a etapa vai rodar (não reenfileirar).
+STATUS_PENDENTES = ("queued", "started", "deferred", "scheduled")
+
+
+def chave_webhook_pendente(payment_id):
+    return f"webhook:pendente:{payment_id}"
+
+
+def job_id_pagamento(payment_id):
+    """job_id idempotente do RQ para a verificação de um pagamento."""
+    return f"mp-{payment_id}"
+
+
+def job_id_entrega(cobranca_id):
+    return f"entrega-{cobranca_id}"
+
+
+def job_id_venda(payment_id):
+    return f"venda-{payment_id}"
+
+
+JOB_ID_RECONCILIAR_RANKING = "ranking-reconciliar"
+JOB_ID_DRENAR_OUTBOX = "webhooks-outbox"
+
+# Webhooks recebidos com o Redis fora ficam na tabela webhook_outbox (modelo
+# WebhookOutbox do app). O app drena no próximo webhook; o supervisor do
+# worker agenda a drenagem a cada OUTBOX_INTERVALO_S, para que nada fique
+# parado se nenhum pagamento novo chegar.
+JOB_PAGAMENTO = "worker.process_mercado_pago_webhook"
+OUTBOX_INTERVALO_S = 60
+OUTBOX_LOTE = 200
+
+
+def reprocessar_outbox(sessao, conn, limite=OUTBOX_LOTE):
+    """Reenfileira (em lote, numa única ida ao Redis) os webhooks guardados no outbox.
+
+    sessao: sessão SQLAlchemy (app ou worker); conn: Redis da fila.
+    Retorna quantas linhas foram consumidas."""
+    from rq import Queue
+    from rq.job import Job
+    from sqlalchemy import bindparam, text
+
+    sql = "SELECT id, payment_id FROM webhook_outbox ORDER BY id LIMIT :limite"
+    if sessao.get_bind().dialect.name == "postgresql":
+        # Vários processos podem drenar ao mesmo tempo sem pegar a mesma linha.
+        sql += " FOR UPDATE SKIP LOCKED"
+    linhas = sessao.execute(text(sql), {"limite": limite}).all()
+    if not linhas:
+        sessao.rollback()
+        return 0
+
+    ids = list(dict.fromkeys(payment_id for _, payment_id in linhas))
+    pipe = conn.pipeline()
+    for pid in ids:
+        pipe.set(chave_webhook_pendente(pid), 1, nx=True, ex=WEBHOOK_JANELA_S)
+    # Chaves criadas por esta chamada: se o enfileiramento falhar, são
+    # apagadas, senão a próxima drenagem tomaria o pagamento por pendente.
+    criadas = [chave_webhook_pendente(pid) for pid, novo in zip(ids, pipe.execute()) if novo]
+
+    try:
+        # A chave de dedupe pode ter sobrado de uma drenagem que falhou; só o
+        # job em si prova que o pagamento vai ser verificado (regra do webhook).
+        jobs = Job.fetch_many([job_id_pagamento(pid) for pid in ids], connection=conn)
+        a_enfileirar = []
+        for pid, job in zip(ids, jobs):
+            status = job.get_status(refresh=False) if job is not None else None
+            if status in ("queued", "deferred", "scheduled"):
+                continue
+            job_id = job_id_pagamento(pid)
+            if status == "started":
+                job_id = f"{job_id}-{int(time.time())}"
+            a_enfileirar.append(Queue.prepare_data(JOB_PAGAMENTO, args=(pid,), job_id=job_id))
+        if a_enfileirar:
+            pipe = conn.pipeline()
+            Queue(FILA_PAGAMENTOS, connection=conn).enqueue_many(a_enfileirar, pipeline=pipe)
+            pipe.execute()
+    except Exception:
+        # As linhas continuam no outbox (rollback) para a próxima drenagem.
+        sessao.rollback()
+        if criadas:
+            try:
+                conn.delete(*criadas)
+            except Exception:
+                pass
+        raise
+
+    # Toda linha lida tem agora um job pendente (já existente ou recém-criado).
+    sessao.execute(text("DELETE FROM webhook_outbox WHERE id IN :ids")
+                   .bindparams(bindparam("ids", expanding=True)),
+                   {"ids": [id_ for id_, _ in linhas]})
+    sessao.commit()
+    print(f"[WEBHOOK] Outbox: {len(linhas)} notificação(ões) -> {len(a_enfileirar)} job(s) reenfileirado(s).")
+    return len(linhas)
+
+
+def estatisticas_filas(conn):
+    """Profundidade e idade do job mais antigo de cada fila.
+
+    {fila: {profundidade, idade_s, em_execucao, agendados, falhas}}"""
+    from rq import Queue
+
+    agora = datetime.now(timezone.utc)
+    saida = {}
+    for nome in FILAS_POR_PRIORIDADE:
+        fila = Queue(nome, connection=conn)
+        idade = 0.0
+        primeiro = fila.get_job_ids(0, 0)
+        job = fila.fetch_job(primeiro[0]) if primeiro else None
+        if job is not None and job.enqueued_at:
+            enfileirado = job.enqueued_at
+            if enfileirado.tzinfo is None:
+                enfileirado = enfileirado.replace(tzinfo=timezone.utc)
+            idade = round((agora - enfileirado).total_seconds(), 1)
+        saida[nome] = {
+            "profundidade": fila.count,
+            "idade_s": idade,
+            "em_execucao": fila.started_job_registry.count,
+            "agendados": fila.scheduled_job_registry.count,
+            "falhas": fila.failed_job_registry.count,
+        }
+    return saida
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+frete_cache.py
+==============
+Cache das cotações do Melhor Envio.
+
+A mesma cotação é pedida duas vezes por compra (/api/cotar-frete mostra as
+opções; o checkout recota para não confiar no preço enviado pelo cliente),
+e CEPs da mesma região devolvem os mesmos preços. A chave agrupa:
+
+  CEP de origem : prefixo do CEP de destino : faixa de peso : medidas : valor segurado
+
+  - prefixo do destino: FRETE_CEP_PREFIXO dígitos (5 = setor; 8 = CEP exato);
+  - peso arredondado para cima em faixas de 100 g, medidas para cima em cm
+    inteiros e valor segurado para cima em reais inteiros.
+
+Stale-while-revalidate: até FRETE_TTL_FRESCO a cotação é servida direto;
+entre FRETE_TTL_FRESCO e FRETE_TTL_MAX ela ainda é servida, mas uma thread
+recota em segundo plano. Assim um Melhor Envio lento não trava o checkout.
+Erros de cotação nunca vão para o cache.
+
+Contadores (hit/stale/miss/erro): somados no processo e enviados ao hash
+Redis CHAVE_STATS em lote (a cada FRETE_STATS_LOTE eventos ou
+FRETE_STATS_FLUSH_S segundos), para o hit local não pagar ida ao Redis.
+"""
+
+import os
+import math
+import time
+import threading
+
+import redis
+
+from cache import CacheDoisNiveis, get_redis
+
+FRETE_CEP_PREFIXO = int(os.environ.get("FRETE_CEP_PREFIXO", 5))
+FRETE_TTL_FRESCO = int(os.environ.get("FRETE_TTL_FRESCO", 600))   # 10 min
+FRETE_TTL_MAX = int(os.environ.get("FRETE_TTL_MAX", 3600))        # 1 h (stale)
+
+# A idade da cotação é checada no próprio item, então os dois níveis guardam
+# até FRETE_TTL_MAX (a cópia local também serve stale se o Redis cair).
+_cache = CacheDoisNiveis("frete", ttl_local=FRETE_TTL_MAX, ttl_redis=FRETE_TTL_MAX, max_itens=4096)
+
+CHAVE_STATS = "frete:stats"
+FRETE_STATS_LOTE = 50
+FRETE_STATS_FLUSH_S = 30
+_stats = {"hit": 0, "stale": 0, "miss": 0, "erro": 0}
+_stats_pendentes = {}   # ainda não enviados ao Redis
+_stats_enviado_em = time.monotonic()
+_stats_lock = threading.Lock()
+
+_revalidando = set()
+_revalidando_lock = threading.Lock()
+
+
+def chave_cotacao(cep_origem, cep_destino, peso_kg, altura_cm, largura_cm,
+                  comprimento_cm, valor_segurado=0.0):
+    """Chave de cache da cotação (ver faixas no cabeçalho do módulo)."""
+    peso = math.ceil(float(peso_kg or 0) * 10) / 10
+    medidas = "x".join(str(math.ceil(float(m or 0))) for m in (altura_cm, largura_cm, comprimento_cm))
+    valor = math.ceil(float(valor_segurado or 0))
+    return f"{cep_origem}:{cep_destino[:FRETE_CEP_PREFIXO]}:{peso:.1f}:{medidas}:{valor}"
+
+
+def _enviar_stats(forcar=False):
+    """Soma os contadores pendentes no hash Redis (um pipeline por lote)."""
+    global _stats_pendentes, _stats_enviado_em
+    with _stats_lock:
+        if not _stats_pendentes or not (
+                forcar or sum(_stats_pendentes.values()) >= FRETE_STATS_LOTE
+                or time.monotonic() - _stats_enviado_em >= FRETE_STATS_FLUSH_S):
+            return
+        lote, _stats_pendentes = _stats_pendentes, {}
+        _stats_enviado_em = time.monotonic()
+    r = get_redis()
+    try:
+        if r is None:
+            raise redis.ConnectionError("Redis indisponível")
+        pipe = r.pipeline(transaction=False)
+        for evento, n in lote.items():
+            pipe.hincrby(CHAVE_STATS, evento, n)
+        pipe.execute()
+    except redis.RedisError:
+        # Fica para o próximo lote.
+        with _stats_lock:
+            for evento, n in lote.items():
+                _stats_pendentes[evento] = _stats_pendentes.get(evento, 0) + n
+
+
+def _contar(evento):
+    with _stats_lock:
+        _stats[evento] += 1
+        _stats_pendentes[evento] = _stats_pendentes.get(evento, 0) + 1
+    _enviar_stats()
+
+
+def estatisticas():
+    """Contadores deste processo e o agregado de todos os processos (Redis)."""
+    _enviar_stats(forcar=True)
+    with _stats_lock:
+        local = dict(_stats)
+    total = None
+    r = get_redis()
+    if r is not None:
+        try:
+            total = {k.decode(): int(v) for k, v in r.hgetall(CHAVE_STATS).items()}
+        except redis.RedisError:
+            pass
+    return {"processo": local, "total": total}
+
+
+def _guardar(chave, opcoes):
+    _cache.set(chave, {"opcoes": opcoes, "cotado_em": time.time()})
+
+
+def _revalidar(chave, cotar):
+    """Recota em segundo plano (uma thread por chave por processo)."""
+    with _revalidando_lock:
+        if chave in _revalidando:
+            return
+        _revalidando.add(chave)
+
+    def _tarefa():
+        try:
+            opcoes, erro = cotar()
+            if erro is None:
+                _guardar(chave, opcoes)
+            else:
+                print(f"[FRETE-CACHE] revalidação falhou ({erro}); mantendo cotação antiga.")
+        except Exception as e:
+            print(f"[FRETE-CACHE] revalidação falhou: {e}")
+        finally:
+            with _revalidando_lock:
+                _revalidando.discard(chave)
+
+    threading.Thread(target=_tarefa, name="frete-revalidar", daemon=True).start()
+
+
+def obter(chave, cotar):
+    """Devolve (opcoes, erro) do cache ou chamando cotar() -> (opcoes, erro)."""
+    item = _cache.get(chave)
+    if item is not None:
+        idade = time.time() - item["cotado_em"]
+        if idade < FRETE_TTL_FRESCO:
+            _contar("hit")
+            return [dict(o) for o in item["opcoes"]], None
+        if idade < FRETE_TTL_MAX:
+            _contar("stale")
+            _revalidar(chave, cotar)
+            return [dict(o) for o in item["opcoes"]], None
+
+    _contar("miss")
+    opcoes, erro = cotar()
+    if erro is None:
+        _guardar(chave, [dict(o) for o in opcoes])
+    else:
+        _contar("erro")
+    return opcoes, erro
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+http_cliente.py
+===============
+Cliente HTTP de saída compartilhado (web e worker): Supabase, Melhor Envio,
+Mercado Pago e Resend.
+
+  - uma requests.Session por host, com pool de conexões e keep-alive
+    (sem TCP + TLS novo a cada chamada);
+  - timeout padrão em toda chamada (connect, read);
+  - retry com backoff exponencial + jitter em erros de conexão e em
+    429/502/503/504. Só métodos idempotentes repetem por padrão; um POST só
+    repete se quem chama pedir (tentativas=N);
+  - histograma de latência por host (metricas()).
+
+HTTP/2: o requests (urllib3) fala apenas HTTP/1.1; o ganho aqui vem do
+reaproveitamento das conexões.
+"""
+
+import os
+import time
+import random
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+HTTP_POOL = int(os.environ.get("HTTP_POOL", 10))
+HTTP_TIMEOUT_CONNECT = float(os.environ.get("HTTP_TIMEOUT_CONNECT", 3.05))
+HTTP_TIMEOUT_READ = float(os.environ.get("HTTP_TIMEOUT_READ", 10))
+HTTP_TENTATIVAS = int(os.environ.get("HTTP_TENTATIVAS", 3))
+HTTP_BACKOFF_BASE = 0.2   # s; espera ~ base * 2^n com jitter "full"
+HTTP_BACKOFF_MAX = 2.0
+
+METODOS_IDEMPOTENTES = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+STATUS_REPETIR = {429, 502, 503, 504}
+
+# Limites superiores (ms) das faixas do histograma de latência.
+FAIXAS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_sessoes = {}
+_metricas = {}
+_lock = threading.Lock()
+
+
+def _sessao(host):
+    sessao = _sessoes.get(host)
+    if sessao is None:
+        with _lock:
+            sessao = _sessoes.get(host)
+            if sessao is None:
+                sessao = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL, max_retries=0)
+                sessao.mount("https://", adapter)
+                sessao.mount("http://", adapter)
+                _sessoes[host] = sessao
+    return sessao
+
+
+def _registrar(host, ms, erro):
+    with _lock:
+        m = _metricas.get(host)
+        if m is None:
+            m = _metricas[host] = {"chamadas": 0, "erros": 0, "total_ms": 0.0,
+                                   "faixas": [0] * (len(FAIXAS_MS) + 1)}
+        m["chamadas"] += 1
+        m["total_ms"] += ms
+        if erro:
+            m["erros"] += 1
+        for i, limite in enumerate(FAIXAS_MS):
+            if ms <= limite:
+                m["faixas"][i] += 1
+                break
+        else:
+            m["faixas"][-1] += 1
+
+
+def metricas():
+    """Histograma de latência por host: {host: {chamadas, erros, media_ms, faixas}}."""
+    with _lock:
+        saida = {}
+        for host, m in _metricas.items():
+            rotulos = [f"<={f}ms" for f in FAIXAS_MS] + [f">{FAIXAS_MS[-1]}ms"]
+            saida[host] = {
+                "chamadas": m["chamadas"],
+                "erros": m["erros"],
+                "media_ms": round(m["total_ms"] / m["chamadas"], 1) if m["chamadas"] else 0.0,
+                "faixas": dict(zip(rotulos, m["faixas"])),
+            }
+        return saida
+
+
+def _espera(tentativa):
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** tentativa)))
+
+
+def requisitar(metodo, url, timeout=None, tentativas=None, **kwargs):
+    """Como requests.request, mas com sessão por host, timeout padrão e retry.
+
+    Devolve o requests.Response da última tentativa; levanta a exceção de
+    rede se todas as tentativas falharem na conexão."""
+    metodo = metodo.upper()
+    host = urlsplit(url).netloc
+    if timeout is None:
+        timeout = (HTTP_TIMEOUT_CONNECT, HTTP_TIMEOUT_READ)
+    if tentativas is None:
+        tentativas = HTTP_TENTATIVAS if metodo in METODOS_IDEMPOTENTES else 1
+    sessao = _sessao(host)
+
+    for tentativa in range(tentativas):
+        ultima = tentativa == tentativas - 1
+        inicio = time.monotonic()
+        try:
+            resp = sessao.request(metodo, url, timeout=timeout, **kwargs)
+        except requests.RequestException:
+            _registrar(host, (time.monotonic() - inicio) * 1000, erro=True)
+            if ultima:
+                raise
+        else:
+            repetir = resp.status_code in STATUS_REPETIR
+            _registrar(host, (time.monotonic() - inicio) * 1000, erro=resp.status_code >= 500)
+            if not repetir or ultima:
+                return resp
+        time.sleep(_espera(tentativa))
+
+
+def get(url, **kwargs):
+    return requisitar("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return requisitar("POST", url, **kwargs)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+importar_chaves.py
+==================
+Importação em massa de chaves de licença (ChaveLicenca) de um produto
+game/app, a partir de um CSV (primeira coluna = chave_serial) ou da entrada
+padrão:
+
+    python importar_chaves.py PRODUTO_ID chaves.csv
+    gunzip -c chaves.csv.gz | python importar_chaves.py PRODUTO_ID -
+
+  - lê o arquivo em blocos de IMPORTAR_BLOCO linhas (memória constante,
+    serve para milhões de chaves);
+  - Postgres: cada bloco vai por COPY para uma tabela temporária e, no fim,
+    um único INSERT ... SELECT DISTINCT ... ON CONFLICT (chave_serial)
+    DO NOTHING descarta as repetidas (no arquivo ou já no banco);
+  - SQLite (desenvolvimento): executemany com INSERT OR IGNORE por bloco;
+  - tudo numa transação só: se falhar no meio, nada é importado;
+  - mostra o progresso (linhas/s) e, no fim, inseridas x ignoradas.
+
+Depois do commit, o contador de estoque do alocador (alocador_chaves) é
+atualizado. Autossuficiente: não importa nada do app.py nem do worker.py.
+"""
+
+import os
+import sys
+import csv
+import time
+
+from sqlalchemy import create_engine, text
+
+import alocador_chaves
+
+IMPORTAR_BLOCO = int(os.environ.get("IMPORTAR_BLOCO", 50_000))
+TAMANHO_MAX_CHAVE = 100  # chaves_licenca.chave_serial é VARCHAR(100)
+CABECALHOS = {"chave", "chave_serial", "serial", "key"}
+
+
+def _db_url():
+    url = os.environ.get("DATABASE_URL", "sqlite:///cobrancas.db")
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql+psycopg://", 1)
+    elif url.startswith("postgresql://"):
+        url = url.replace("postgresql://", "postgresql+psycopg://", 1)
+    return url
+
+
+class _Contagem:
+    def __init__(self):
+        self.lidas = 0
+        self.invalidas = 0
+        self.inicio = time.monotonic()
+
+    def progresso(self):
+        decorrido = time.monotonic() - self.inicio
+        taxa = self.lidas / decorrido if decorrido else 0
+        print(f"[IMPORTAR] {self.lidas} linhas lidas ({taxa:,.0f} linhas/s)")
+
+
+def blocos(arquivo, contagem, tamanho=IMPORTAR_BLOCO):
+    """Gera listas de até `tamanho` seriais válidos, lendo o CSV em streaming."""
+    bloco = []
+    for n, linha in enumerate(csv.reader(arquivo)):
+        serial = linha[0].strip() if linha else ""
+        if n == 0 and serial.lower() in CABECALHOS:
+            continue
+        if not serial:
+            continue
+        contagem.lidas += 1
+        if len(serial) > TAMANHO_MAX_CHAVE:
+            contagem.invalidas += 1
+            continue
+        bloco.append(serial)
+        if len(bloco) >= tamanho:
+            yield bloco
+            bloco = []
+    if bloco:
+        yield bloco
+
+
+def _importar_postgres(conn, produto_id, arquivo, contagem):
+    conn.execute(text(
+        "CREATE TEMP TABLE chaves_importacao (chave_serial VARCHAR(100) NOT NULL) ON COMMIT DROP"))
+    cursor = conn.connection.driver_connection.cursor()
+    for bloco in blocos(arquivo, contagem):
+        with cursor.copy("COPY chaves_importacao (chave_serial) FROM STDIN") as copia:
+            for serial in bloco:
+                copia.write_row((serial,))
+        contagem.progresso()
+    print("[IMPORTAR] Gravando em chaves_licenca (ignorando repetidas)...")
+    return conn.execute(text("""
+        INSERT INTO chaves_licenca (chave_serial, produto_id, vendida)
+        SELECT DISTINCT chave_serial, :produto_id, false FROM chaves_importacao
+        ON CONFLICT (chave_serial) DO NOTHING
+    """), {"produto_id": produto_id}).rowcount
+
+
+def _importar_sqlite(conn, produto_id, arquivo, contagem):
+    inseridas = 0
+    sql = text("INSERT OR IGNORE INTO chaves_licenca (chave_serial, produto_id, vendida) "
+               "VALUES (:serial, :produto_id, 0)")
+    for bloco in blocos(arquivo, contagem):
+        inseridas += conn.execute(sql, [{"serial": s, "produto_id": produto_id} for s in bloco]).rowcount
+        contagem.progresso()
+    return inseridas
+
+
+def importar(produto_id, arquivo, engine=None):
+    """Importa as chaves do arquivo para o produto. Retorna quantas foram inseridas."""
+    engine = engine or create_engine(_db_url())
+    contagem = _Contagem()
+    with engine.begin() as conn:
+        produto = conn.execute(text("SELECT nome, tipo FROM produtos WHERE id = :id"),
+                               {"id": produto_id}).first()
+        if produto is None:
+            raise SystemExit(f"[IMPORTAR] ❌ Produto {produto_id} não existe.")
+        if produto.tipo not in ("game", "app"):
+            print(f"[IMPORTAR] ⚠️ Produto {produto_id} é do tipo '{produto.tipo}': "
+                  f"o worker só entrega chaves de produtos game/app.")
+        print(f"[IMPORTAR] Importando chaves para '{produto.nome}' (id {produto_id})...")
+        if conn.dialect.name == "postgresql":
+            inseridas = _importar_postgres(conn, produto_id, arquivo, contagem)
+        else:
+            inseridas = _importar_sqlite(conn, produto_id, arquivo, contagem)
+
+    alocador_chaves.registrar_entrada(produto_id, inseridas)
+
+    decorrido = time.monotonic() - contagem.inicio
+    ignoradas = contagem.lidas - contagem.invalidas - inseridas
+    print("====================================================")
+    print(f"  Linhas lidas:        {contagem.lidas}")
+    print(f"  Inseridas:           {inseridas}")
+    print(f"  Repetidas (ignor.):  {ignoradas}")
+    print(f"  Inválidas (>{TAMANHO_MAX_CHAVE}):    {contagem.invalidas}")
+    print(f"  Tempo:               {decorrido:.1f}s "
+          f"({contagem.lidas / decorrido if decorrido else 0:,.0f} linhas/s)")
+    print("====================================================")
+    return inseridas
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Uso: python importar_chaves.py PRODUTO_ID [arquivo.csv | -]")
+        sys.exit(2)
+    produto_id = int(sys.argv[1])
+    caminho = sys.argv[2] if len(sys.argv) > 2 else "-"
+    if caminho == "-":
+        importar(produto_id, sys.stdin)
+    else:
+        with open(caminho, newline="", encoding="utf-8") as arquivo:
+            importar(produto_id, arquivo)
+
+
+if __name__ == "__main__":
+    main()
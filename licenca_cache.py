@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+licenca_cache.py
+================
+Status de licença por e-mail para o /api/licenca/status (login e polling
+do BrooStock), sem ir ao Postgres a cada chamada.
+
+O cache guarda só os campos crus da licença (plano, status, expira_em) e
+o payload (ativa, dias_restantes, pode_testar...) é calculado na leitura:
+assim ele nunca fica "ativo" depois do vencimento por causa do TTL.
+
+Quem altera licença grava o valor novo direto no cache (write-through,
+depois do commit): worker (ativação/renovação), /api/licenca/trial e o
+cron notificar_expiracao. O TTL do Redis só cobre alterações feitas por
+fora (seeds, edição manual no banco).
+
+Autossuficiente: não importa nada do app.py nem do worker.py.
+"""
+
+import os
+import json
+import hashlib
+from datetime import datetime
+
+from cache import CacheDoisNiveis
+
+LICENCA_TTL_LOCAL = int(os.environ.get("LICENCA_TTL_LOCAL", 30))
+LICENCA_TTL_REDIS = int(os.environ.get("LICENCA_TTL_REDIS", 3600))
+
+_cache = CacheDoisNiveis("licenca", ttl_local=LICENCA_TTL_LOCAL, ttl_redis=LICENCA_TTL_REDIS, max_itens=4096)
+
+
+def _chave(email):
+    return (email or "").strip().lower()
+
+
+def campos(licenca):
+    """Campos crus (JSON) de uma Licenca, ou o marcador de "nunca teve licença"."""
+    if licenca is None:
+        return {"existe": False}
+    return {
+        "existe": True,
+        "plano": licenca.plano,
+        "status": licenca.status,
+        "expira_em": licenca.expira_em.isoformat() if licenca.expira_em else None,
+    }
+
+
+def obter(email, carregar):
+    """Campos da licença do e-mail; no miss chama carregar() -> Licenca | None."""
+    return _cache.obter(_chave(email), lambda: campos(carregar()))
+
+
+def gravar(email, licenca):
+    """Write-through: chamar DEPOIS do commit da licença."""
+    _cache.atualizar(_chave(email), campos(licenca))
+
+
+def payload(c, agora=None):
+    """Resposta do /api/licenca/status a partir dos campos crus."""
+    if not c.get("existe"):
+        # Nunca teve licença -> elegível ao teste grátis
+        return {"ativa": False, "plano": None, "status": None,
+                "expira_em": None, "is_trial": False,
+                "pode_testar": True, "dias_restantes": 0}
+    agora = agora or datetime.utcnow()
+    expira_em = datetime.fromisoformat(c["expira_em"]) if c.get("expira_em") else None
+    ativa = bool(c["status"] in ("ativa", "trial") and expira_em and expira_em > agora)
+    dias = 0
+    if expira_em and expira_em > agora:
+        dias = (expira_em - agora).days
+    return {
+        "ativa": ativa,
+        "plano": c.get("plano"),
+        "status": c.get("status"),
+        "expira_em": c.get("expira_em"),
+        "is_trial": c.get("status") == "trial",
+        "pode_testar": False,
+        "dias_restantes": dias,
+    }
+
+
+def etag(dados):
+    """Hash do payload para o ETag (muda quando qualquer campo da resposta muda)."""
+    bruto = json.dumps(dados, sort_keys=True, separators=(",", ":")).encode()
+    return hashlib.sha1(bruto).hexdigest()[:20]
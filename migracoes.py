@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+migracoes.py
+============
+Migrações de schema versionadas (o db.create_all() só cria tabelas novas,
+nunca altera as existentes).
+
+  - cada migração tem um id ordenável ("0001_...") e roda uma única vez;
+    as aplicadas ficam na tabela schema_migracoes;
+  - no Postgres, um advisory lock garante que só um processo migra por vez
+    (deploy com vários serviços subindo juntos);
+  - índices são criados com CREATE INDEX CONCURRENTLY (sem travar escrita
+    em cobrancas durante o deploy) e IF NOT EXISTS; um índice que ficou
+    INVALID por uma tentativa interrompida é refeito;
+  - no SQLite (desenvolvimento) o mesmo SQL roda sem CONCURRENTLY;
+  - migrações marcadas "de boot" (colunas novas: ALTER TABLE ... ADD
+    COLUMN, instantâneo) rodam ANTES das outras e de forma síncrona no boot
+    do app e do worker, porque os modelos já leem as colunas novas. Não
+    podem depender de outras migrações.
+
+Execução: automática no boot do app (as de boot na hora; o resto numa
+thread em segundo plano, logo depois do db.create_all()) e do worker (só
+as de boot), ou manual: python migracoes.py
+Autossuficiente: não importa nada do app.py nem do worker.py (só módulos
+de infraestrutura, ex.: vendas_diarias para a carga do rollup).
+"""
+
+import os
+import sys
+import threading
+from datetime import datetime
+
+from sqlalchemy import create_engine, text
+
+import vendas_diarias
+
+# Chaves arbitrárias (fixas) do pg_advisory_lock das migrações. As de boot
+# têm lock próprio: o boot não espera um índice/carga longa de outro processo.
+LOCK_MIGRACOES = 7_300_113
+LOCK_MIGRACOES_BOOT = 7_300_114
+MIGRACAO_LOTE = 5000
+
+
+def _db_url():
+    url = os.environ.get("DATABASE_URL", "sqlite:///cobrancas.db")
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql+psycopg://", 1)
+    elif url.startswith("postgresql://"):
+        url = url.replace("postgresql://", "postgresql+psycopg://", 1)
+    return url
+
+
+# ----------------------------------------------------------------------
+# Helpers usados pelas migrações
+# ----------------------------------------------------------------------
+def criar_indice(conn, nome, tabela, colunas, onde=None):
+    """CREATE INDEX (CONCURRENTLY no Postgres) IF NOT EXISTS, opcionalmente parcial."""
+    postgres = conn.dialect.name == "postgresql"
+    if postgres:
+        invalido = conn.execute(text("""
+            SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = :nome AND NOT i.indisvalid
+        """), {"nome": nome}).first()
+        if invalido:
+            print(f"[MIGRACAO] Índice {nome} ficou INVALID numa tentativa anterior; refazendo.")
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {nome}"))
+    sql = (f"CREATE INDEX {'CONCURRENTLY ' if postgres else ''}IF NOT EXISTS {nome} "
+           f"ON {tabela} ({colunas})")
+    if onde:
+        sql += f" WHERE {onde}"
+    conn.execute(text(sql))
+
+
+def adicionar_coluna(conn, tabela, coluna, tipo):
+    """ALTER TABLE ... ADD COLUMN (nullable, sem default: não reescreve a tabela)."""
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(f"ALTER TABLE {tabela} ADD COLUMN IF NOT EXISTS {coluna} {tipo}"))
+        return
+    existentes = {r[1] for r in conn.execute(text(f"PRAGMA table_info({tabela})"))}
+    if coluna not in existentes:
+        conn.execute(text(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {tipo}"))
+
+
+def atualizar_em_lotes(conn, tabela, sql_update):
+    """Roda um UPDATE por faixa de id (:de < id <= :ate), um commit por lote.
+
+    Evita uma transação gigante travando a tabela inteira numa carga."""
+    menor, maior = conn.execute(text(f"SELECT MIN(id), MAX(id) FROM {tabela}")).first()
+    if menor is None:
+        return 0
+    total = 0
+    for de in range(menor - 1, maior, MIGRACAO_LOTE):
+        total += conn.execute(text(sql_update), {"de": de, "ate": de + MIGRACAO_LOTE}).rowcount
+    print(f"[MIGRACAO] {tabela}: {total} linhas atualizadas.")
+    return total
+
+
+def _colunas(tabela, *definicoes):
+    def aplicar(conn):
+        for coluna, tipo in definicoes:
+            adicionar_coluna(conn, tabela, coluna, tipo)
+    aplicar.no_boot = True
+    return aplicar
+
+
+def _indices(*definicoes):
+    def aplicar(conn):
+        for d in definicoes:
+            criar_indice(conn, *d)
+    aplicar.indices = definicoes  # usado pelo bench_indices.py
+    return aplicar
+
+
+def _carregar_valores_cobrancas(conn):
+    d = vendas_diarias.sql_dialeto(conn.dialect.name)
+    atualizar_em_lotes(conn, "cobrancas", f"""
+        UPDATE cobrancas AS c
+        SET frete = {d['frete_json']}, subtotal_produto = {d['subtotal_json']},
+            transportadora = {d['transportadora_json']}
+        WHERE c.id > :de AND c.id <= :ate AND c.frete IS NULL
+    """)
+
+
+# ----------------------------------------------------------------------
+# Migrações (em ordem; nunca editar uma já publicada — crie outra)
+# ----------------------------------------------------------------------
+MIGRACOES = [
+    ("0001_indices_cobrancas",
+     "Cobranças: por data (dashboard), pagas por data e entregues por vendedor (ranking)",
+     _indices(
+         ("ix_cobrancas_data_criacao", "cobrancas", "data_criacao"),
+         ("ix_cobrancas_pagas_data", "cobrancas", "data_criacao",
+          "status IN ('approved', 'delivered')"),
+         ("ix_cobrancas_vendedor_entregues", "cobrancas", "vendedor_codigo",
+          "status = 'delivered' AND vendedor_codigo IS NOT NULL"),
+     )),
+    ("0002_indice_chaves_livres",
+     "Chaves de licença não vendidas por produto (reserva no worker)",
+     _indices(
+         ("ix_chaves_livres_produto", "chaves_licenca", "produto_id, id", "vendida = false"),
+     )),
+    ("0003_indice_licencas_email_expira",
+     "Licença mais recente por e-mail (/api/licenca/status)",
+     _indices(
+         ("ix_licencas_email_expira", "licencas", "cliente_email, expira_em DESC"),
+     )),
+    ("0004_vendas_diarias",
+     "Rollup diário de cobranças (dashboard e ranking) + carga inicial",
+     lambda conn: vendas_diarias.reconstruir(conn.engine)),
+    ("0005_colunas_valores_cobrancas",
+     "Cobranças: frete, subtotal_produto e transportadora em colunas (antes só no JSON de observacoes)",
+     _colunas("cobrancas",
+              ("frete", "DOUBLE PRECISION"),
+              ("subtotal_produto", "DOUBLE PRECISION"),
+              ("transportadora", "VARCHAR(100)"))),
+    ("0006_carga_valores_cobrancas",
+     "Cobranças antigas: copia frete/subtotal/transportadora do JSON de observacoes para as colunas",
+     lambda conn: _carregar_valores_cobrancas(conn)),
+    ("0007_indice_licencas_aviso_expiracao",
+     "Licenças trial/ativa por expiração e último aviso (cron notificar_expiracao)",
+     _indices(
+         ("ix_licencas_aviso_expiracao", "licencas", "status, expira_em, ultimo_aviso",
+          "status IN ('trial', 'ativa')"),
+     )),
+    ("0008_colunas_compressao_cobrancas",
+     "Cobranças: código de liberação dos compressores usado e job que o reservou",
+     _colunas("cobrancas",
+              ("compressao_usada", "BOOLEAN"),
+              ("compressao_img_usada", "BOOLEAN"),
+              ("compressao_job", "VARCHAR(64)"),
+              ("compressao_img_job", "VARCHAR(64)"))),
+]
+
+
+# ----------------------------------------------------------------------
+# Execução
+# ----------------------------------------------------------------------
+def _garantir_tabela(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migracoes (
+            id VARCHAR(100) PRIMARY KEY,
+            descricao VARCHAR(300),
+            aplicada_em TIMESTAMP NOT NULL
+        )
+    """))
+
+
+def _de_boot(migracao):
+    return getattr(migracao[2], "no_boot", False)
+
+
+def pendentes(conn, somente_boot=False):
+    """Migrações pendentes, as de boot primeiro (demais na ordem dos ids)."""
+    _garantir_tabela(conn)
+    feitas = {r[0] for r in conn.execute(text("SELECT id FROM schema_migracoes"))}
+    lista = [m for m in MIGRACOES if m[0] not in feitas and (_de_boot(m) or not somente_boot)]
+    return sorted(lista, key=lambda m: not _de_boot(m))
+
+
+def aplicar(engine=None, esperar=True, somente_boot=False):
+    """Aplica as migrações pendentes. Retorna a lista de ids aplicados.
+
+    esperar=False: se outro processo já estiver migrando, sai sem fazer nada.
+    somente_boot=True: só as migrações de boot (lock próprio, sempre espera)."""
+    engine = engine or create_engine(_db_url())
+    aplicadas = []
+    lock = LOCK_MIGRACOES_BOOT if somente_boot else LOCK_MIGRACOES
+    # AUTOCOMMIT: CREATE INDEX CONCURRENTLY não roda dentro de transação.
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        postgres = conn.dialect.name == "postgresql"
+        if postgres:
+            if esperar or somente_boot:
+                conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": lock})
+            elif not conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": lock}).scalar():
+                print("[MIGRACAO] Outro processo está migrando; pulando.")
+                return aplicadas
+        try:
+            for mid, descricao, funcao in pendentes(conn, somente_boot):
+                inicio = datetime.utcnow()
+                print(f"[MIGRACAO] {mid}: {descricao}...")
+                funcao(conn)
+                # ON CONFLICT: a de boot pode ter sido aplicada em paralelo pelo
+                # CLI (lock diferente); o ALTER é idempotente.
+                conn.execute(
+                    text("INSERT INTO schema_migracoes (id, descricao, aplicada_em) VALUES (:id, :d, :em) "
+                         "ON CONFLICT (id) DO NOTHING"),
+                    {"id": mid, "d": descricao, "em": datetime.utcnow()},
+                )
+                aplicadas.append(mid)
+                print(f"[MIGRACAO] {mid} aplicada em {(datetime.utcnow() - inicio).total_seconds():.1f}s.")
+        finally:
+            if postgres:
+                conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": lock})
+    if not aplicadas and not somente_boot:
+        print("[MIGRACAO] Nada pendente.")
+    return aplicadas
+
+
+def aplicar_no_boot(engine):
+    """Boot do app e do worker: colunas novas antes de qualquer consulta dos modelos."""
+    try:
+        aplicar(engine, somente_boot=True)
+    except Exception as e:
+        print(f"[MIGRACAO] ❌ Falha nas migrações de boot: {e}")
+
+
+def aplicar_em_segundo_plano(engine):
+    """Boot do app: migra numa thread para não atrasar o início do servidor."""
+    def rodar():
+        try:
+            aplicar(engine, esperar=False)
+        except Exception as e:
+            print(f"[MIGRACAO] ❌ Falha: {e}")
+
+    threading.Thread(target=rodar, name="migracoes", daemon=True).start()
+
+
+if __name__ == "__main__":
+    try:
+        aplicar()
+    except Exception as e:
+        print(f"[MIGRACAO] ❌ Falha: {e}")
+        sys.exit(1)
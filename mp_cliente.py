@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+mp_cliente.py
+=============
+SDK do Mercado Pago compartilhado pelo processo (web e worker).
+
+O HttpClient padrão do SDK abre uma requests.Session nova a cada chamada,
+ou seja, TCP + TLS do zero por pagamento. Aqui as chamadas passam pelo
+http_cliente.py (sessão persistente com keep-alive, timeout padrão e
+métricas por host) e o SDK é criado uma vez por processo.
+"""
+
+import os
+import threading
+
+import mercadopago
+from mercadopago.http.http_client import HttpClient
+
+import http_cliente
+
+
+class HttpClientPersistente(HttpClient):
+    """HttpClient do SDK sobre o http_cliente (sessão persistente)."""
+
+    def request(self, method, url, maxretries=None, **kwargs):
+        # Retry só nos métodos idempotentes (padrão do http_cliente): um POST
+        # de pagamento nunca é repetido às cegas.
+        api_result = http_cliente.requisitar(method, url, **kwargs)
+        return {"status": api_result.status_code, "response": api_result.json()}
+
+
+_sdk = None
+_sdk_lock = threading.Lock()
+
+
+def get_sdk():
+    """SDK lazy (criado na primeira chamada). None se o token não estiver configurado."""
+    global _sdk
+    if _sdk is None:
+        access_token = os.environ.get("MERCADOPAGO_ACCESS_TOKEN")
+        if not access_token:
+            return None
+        with _sdk_lock:
+            if _sdk is None:
+                _sdk = mercadopago.SDK(access_token, http_client=HttpClientPersistente())
+    return _sdk
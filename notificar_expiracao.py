@@ -5,47 +5,39 @@ notificar_expiracao.py — Job diário (Render Cron) que envia e-mails de aviso:
   • Assinatura paga: avisa faltando até 7 dias e quando expira.
 
 Cada estágio é enviado UMA vez (controlado pela coluna licencas.ultimo_aviso).
-Reaproveita o app/DB do BrooStore e o mesmo SMTP do worker.
+Cada estágio é uma consulta por janela de expira_em que só traz as licenças
+ainda não avisadas (índice parcial ix_licencas_aviso_expiracao, migração
+0007), lida em streaming; o estágio é gravado com um UPDATE por lote.
+Reaproveita o app/DB do BrooStore e o pool SMTP do worker (smtp_pool.py).
+
+Envio: os lotes saem em paralelo por AVISOS_THREADS threads (uma conexão
+SMTP do pool cada), todas sob o mesmo token bucket (AVISOS_TAXA_POR_MINUTO,
+cota do provedor). A gravação do estágio fica na thread principal (a
+sessão do banco não é thread-safe). Um lock no Redis impede que duas
+execuções do cron (uma atrasada e a seguinte) mandem o mesmo aviso, e o
+fim da execução mostra o resumo (vazão e falhas por tipo).
 
 Execução: python notificar_expiracao.py
 """
 import os
-import smtplib
-from datetime import datetime
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import time
+from collections import Counter
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import redis
+from redis.exceptions import LockError
+from sqlalchemy import and_, or_, select, update
 
+import cache
+import licenca_cache
+import smtp_pool
 from app import app, db, Licenca  # usa o mesmo contexto/engine do BrooStore
 
 BROOSTOCK_URL = os.environ.get("BROOSTOCK_URL", "https://brootechstock.netlify.app/login")
 
 
-def _enviar(destinatario: str, assunto: str, corpo_html: str) -> bool:
-    try:
-        smtp_server = os.environ.get("SMTP_SERVER", "smtp.zoho.com")
-        email_user = os.environ["EMAIL_USER"]
-        email_pass = os.environ["EMAIL_PASSWORD"]
-    except KeyError:
-        print("[CRON] ERRO: credenciais de e-mail não configuradas.")
-        return False
-
-    msg = MIMEMultipart("alternative")
-    msg["Subject"] = assunto
-    msg["From"] = email_user
-    msg["To"] = destinatario
-    msg.attach(MIMEText(corpo_html, "html"))
-    try:
-        smtp_port = int(os.environ.get("SMTP_PORT", 587))
-        with smtplib.SMTP(smtp_server, smtp_port, timeout=15) as server:
-            server.starttls()
-            server.login(email_user, email_pass)
-            server.send_message(msg)
-        return True
-    except Exception as exc:
-        print(f"[CRON] Falha no envio SMTP para {destinatario}: {exc}")
-        return False
-
-
 def _html(titulo: str, paragrafo: str, cta_label: str) -> str:
     return f"""<!DOCTYPE html>
 <html><body style="font-family:Arial,sans-serif;background:#0d1b2a;color:#e0e6ed;padding:24px;">
@@ -60,84 +52,249 @@ def _html(titulo: str, paragrafo: str, cta_label: str) -> str:
 </body></html>"""
 
 
+# Avisos enviados por lote numa mesma conexão SMTP; um UPDATE + commit por lote.
+LOTE_EMAILS = 50
+# Cada thread ocupa uma conexão do pool SMTP: mais threads que SMTP_POOL só
+# esperariam (aumente SMTP_POOL no serviço do cron junto).
+AVISOS_THREADS = max(1, min(int(os.environ.get("AVISOS_THREADS", smtp_pool.SMTP_POOL)), smtp_pool.SMTP_POOL))
+# Cota de envio do Zoho (ajuste ao plano); 0 = sem limite.
+AVISOS_TAXA_POR_MINUTO = int(os.environ.get("AVISOS_TAXA_POR_MINUTO", 60))
+AVISOS_RAJADA = int(os.environ.get("AVISOS_RAJADA", 10))
+# Lock da execução no Redis; renovado a cada lote gravado.
+AVISOS_LOCK = "avisos:expiracao:execucao"
+AVISOS_LOCK_TTL_S = 600
+
+# Antecedência de cada aviso: (expira_em - agora).days <= N, ou seja,
+# expira_em < agora + (N + 1) dias.
+DIAS_AVISO_TRIAL = 2
+DIAS_AVISO_ATIVA = 7
+
+
+def _ainda_sem(*stages):
+    """ultimo_aviso ainda não é nenhum dos estágios (NULL conta como não avisado)."""
+    return or_(Licenca.ultimo_aviso.is_(None), Licenca.ultimo_aviso.notin_(stages))
+
+
+def _janelas(agora):
+    """(estágio, filtro) de cada aviso: só as licenças que cruzaram o limiar
+    e ainda não receberam o aviso (índice ix_licencas_aviso_expiracao)."""
+    return [
+        ("expirado", and_(Licenca.status.in_(("trial", "ativa")),
+                          Licenca.expira_em <= agora,
+                          _ainda_sem("expirado"))),
+        ("2d", and_(Licenca.status == "trial",
+                    Licenca.expira_em > agora,
+                    Licenca.expira_em < agora + timedelta(days=DIAS_AVISO_TRIAL + 1),
+                    _ainda_sem("2d", "expirado"))),
+        ("7d", and_(Licenca.status == "ativa",
+                    Licenca.expira_em > agora,
+                    Licenca.expira_em < agora + timedelta(days=DIAS_AVISO_ATIVA + 1),
+                    _ainda_sem("7d", "expirado"))),
+    ]
+
+
+def _mensagem(stage, lic, agora):
+    dias = (lic.expira_em - agora).days
+    expira_str = lic.expira_em.strftime("%d/%m/%Y")
+    quando = "hoje" if dias <= 0 else (f"em {dias} dia" + ("s" if dias > 1 else ""))
+
+    if stage == "expirado" and lic.status == "trial":
+        assunto = "Seu teste grátis do BrooStock terminou"
+        corpo = _html(
+            "Seu teste grátis terminou",
+            "Esperamos que tenha gostado do BrooStock! Para voltar a acessar seu estoque e seu painel financeiro, escolha um plano e ative sua assinatura.",
+            "Assinar agora",
+        )
+    elif stage == "expirado":
+        assunto = "Sua licença do BrooStock expirou"
+        corpo = _html(
+            "Sua licença expirou",
+            "Sua assinatura do BrooStock chegou ao fim. Renove para reativar o acesso ao seu estoque e painel.",
+            "Renovar agora",
+        )
+    elif stage == "2d":
+        assunto = "Seu teste grátis do BrooStock está acabando ⏳"
+        corpo = _html(
+            "Seu teste está acabando",
+            f"Seu teste grátis termina <strong>{quando}</strong> ({expira_str}). Assine para não perder o acesso e continuar de onde parou.",
+            "Assinar e continuar",
+        )
+    else:
+        assunto = "Sua licença do BrooStock vai expirar"
+        corpo = _html(
+            "Sua licença vai expirar",
+            f"Sua assinatura expira <strong>{quando}</strong> ({expira_str}). Renove para manter o acesso sem interrupção.",
+            "Renovar agora",
+        )
+    return smtp_pool.mensagem(lic.cliente_email.strip(), assunto, corpo)
+
+
+class _Resumo:
+    def __init__(self):
+        self.inicio = time.monotonic()
+        self.por_estagio = Counter()
+        self.falhas = Counter()
+        self.sem_email = 0
+
+    def imprimir(self):
+        decorrido = time.monotonic() - self.inicio
+        enviados = sum(self.por_estagio.values())
+        falhas = sum(self.falhas.values())
+        print(f"[CRON] Resumo: {enviados} enviado(s), {falhas} falha(s), {self.sem_email} sem e-mail "
+              f"em {decorrido:.1f}s ({enviados / decorrido if decorrido else 0:.1f} e-mails/s).")
+        if self.por_estagio:
+            print("[CRON]   por estágio: " + ", ".join(f"{k}={n}" for k, n in sorted(self.por_estagio.items())))
+        if self.falhas:
+            print("[CRON]   falhas: " + ", ".join(f"{k}={n}" for k, n in self.falhas.most_common()))
+
+
+def _gravar_avisos(stage, filtro, avisos, resultados, resumo):
+    """Grava o estágio de quem recebeu o aviso (um UPDATE por lote). O UPDATE
+    repete o filtro da janela: uma licença renovada depois da leitura não é
+    sobrescrita. Retorna quantos saíram."""
+    ok = []
+    for (lic, _msg), erro in zip(avisos, resultados):
+        if erro is not None:
+            resumo.falhas[type(erro).__name__] += 1
+            print(f"[CRON] Falha no envio SMTP para {lic.cliente_email}: {erro}")
+            continue
+        ok.append(lic)
+        print(f"[CRON] Aviso '{stage}' enviado para {lic.cliente_email} (expira {lic.expira_em:%d/%m/%Y}).")
+    if not ok:
+        return 0
+
+    valores = {"ultimo_aviso": stage}
+    if stage == "expirado":
+        valores["status"] = "expirado"
+    try:
+        gravadas = db.session.execute(
+            update(Licenca).where(Licenca.id.in_([lic.id for lic in ok]), filtro).values(**valores)
+            .returning(Licenca.cliente_email, Licenca.plano, Licenca.status, Licenca.expira_em),
+            execution_options={"synchronize_session": False}).all()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        resumo.falhas["gravacao_no_banco"] += len(ok)
+        print(f"[CRON] ERRO ao salvar avisos do lote: {e}")
+        return 0
+    resumo.por_estagio[stage] += len(ok)
+    if len(gravadas) < len(ok):
+        print(f"[CRON] {len(ok) - len(gravadas)} licença(s) do lote '{stage}' mudaram desde a leitura; "
+              f"estágio não gravado.")
+    # Licenças que viraram "expirado" saem do cache de status já com o valor
+    # novo (só as que o UPDATE alterou, com os valores que ele devolveu).
+    if stage == "expirado":
+        for lic in gravadas:
+            licenca_cache.gravar(lic.cliente_email,
+                                 SimpleNamespace(plano=lic.plano, status=lic.status, expira_em=lic.expira_em))
+    return len(ok)
+
+
+def _enviar(mensagens, limite):
+    try:
+        return smtp_pool.enviar_lote(mensagens, limite)
+    except Exception as e:
+        return [e] * len(mensagens)
+
+
+def _concluir(em_voo, resumo, trava, todos=False):
+    """Espera lote(s) em envio e grava os resultados na thread principal."""
+    feitos, _ = wait(list(em_voo), return_when=ALL_COMPLETED if todos else FIRST_COMPLETED)
+    for futuro in feitos:
+        stage, filtro, avisos = em_voo.pop(futuro)
+        _gravar_avisos(stage, filtro, avisos, futuro.result(), resumo)
+    _renovar_trava(trava)
+
+
+# ----------------------------------------------------------------------
+# Lock da execução (Redis)
+# ----------------------------------------------------------------------
+def _travar_execucao():
+    """Lock da execução. False = outra execução em andamento; None = sem Redis."""
+    r = cache.get_redis()
+    if r is None:
+        print("[CRON] ⚠️ Redis indisponível: seguindo sem o lock de execução.")
+        return None
+    trava = r.lock(AVISOS_LOCK, timeout=AVISOS_LOCK_TTL_S, blocking=False)
+    try:
+        return trava if trava.acquire() else False
+    except redis.RedisError as e:
+        print(f"[CRON] ⚠️ Lock de execução indisponível ({e}); seguindo sem ele.")
+        return None
+
+
+def _renovar_trava(trava):
+    if trava:
+        try:
+            trava.reacquire()
+        except (redis.RedisError, LockError) as e:
+            print(f"[CRON] ⚠️ Não foi possível renovar o lock de execução: {e}")
+
+
+def _liberar_trava(trava):
+    if trava:
+        try:
+            trava.release()
+        except (redis.RedisError, LockError) as e:
+            print(f"[CRON] ⚠️ Lock de execução não liberado (expira sozinho): {e}")
+
+
+def _candidatas(leitura, filtro):
+    """Licenças da janela, em streaming (yield_per) no Postgres.
+
+    A leitura usa uma conexão própria: os commits de cada lote (na sessão)
+    não fecham o cursor. No SQLite (desenvolvimento) o leitor aberto
+    travaria esses commits, então a janela é lida inteira antes."""
+    consulta = (select(Licenca.id, Licenca.cliente_email, Licenca.plano, Licenca.status, Licenca.expira_em)
+                .where(filtro).order_by(Licenca.id))
+    if leitura.dialect.name == "postgresql":
+        return leitura.execution_options(yield_per=LOTE_EMAILS).execute(consulta)
+    return leitura.execute(consulta).all()
+
+
 def run():
-    enviados = 0
-    with app.app_context():
-        agora = datetime.utcnow()
-        licencas = Licenca.query.filter(Licenca.expira_em.isnot(None)).all()
-
-        for lic in licencas:
-            if not lic.expira_em:
-                continue
-            status = (lic.status or "").lower()
-            if status not in ("trial", "ativa"):
-                continue  # já expirada/cancelada: não reavisa
-
-            email = (lic.cliente_email or "").strip()
-            if not email:
-                continue
-
-            dias = (lic.expira_em - agora).days
-            expira_str = lic.expira_em.strftime("%d/%m/%Y")
-            venceu = lic.expira_em <= agora
-            stage = assunto = corpo = None
-
-            if status == "trial":
-                if venceu and lic.ultimo_aviso != "expirado":
-                    stage = "expirado"
-                    assunto = "Seu teste grátis do BrooStock terminou"
-                    corpo = _html(
-                        "Seu teste grátis terminou",
-                        "Esperamos que tenha gostado do BrooStock! Para voltar a acessar seu estoque e seu painel financeiro, escolha um plano e ative sua assinatura.",
-                        "Assinar agora",
-                    )
-                elif (not venceu) and dias <= 2 and lic.ultimo_aviso not in ("2d", "expirado"):
-                    stage = "2d"
-                    quando = "hoje" if dias <= 0 else (f"em {dias} dia" + ("s" if dias > 1 else ""))
-                    assunto = "Seu teste grátis do BrooStock está acabando ⏳"
-                    corpo = _html(
-                        "Seu teste está acabando",
-                        f"Seu teste grátis termina <strong>{quando}</strong> ({expira_str}). Assine para não perder o acesso e continuar de onde parou.",
-                        "Assinar e continuar",
-                    )
-
-            elif status == "ativa":
-                if venceu and lic.ultimo_aviso != "expirado":
-                    stage = "expirado"
-                    assunto = "Sua licença do BrooStock expirou"
-                    corpo = _html(
-                        "Sua licença expirou",
-                        "Sua assinatura do BrooStock chegou ao fim. Renove para reativar o acesso ao seu estoque e painel.",
-                        "Renovar agora",
-                    )
-                elif (not venceu) and dias <= 7 and lic.ultimo_aviso not in ("7d", "expirado"):
-                    stage = "7d"
-                    quando = "hoje" if dias <= 0 else (f"em {dias} dia" + ("s" if dias > 1 else ""))
-                    assunto = "Sua licença do BrooStock vai expirar"
-                    corpo = _html(
-                        "Sua licença vai expirar",
-                        f"Sua assinatura expira <strong>{quando}</strong> ({expira_str}). Renove para manter o acesso sem interrupção.",
-                        "Renovar agora",
-                    )
-
-            if not stage:
-                continue
-
-            if _enviar(email, assunto, corpo):
-                lic.ultimo_aviso = stage
-                if stage == "expirado":
-                    lic.status = "expirado"
-                try:
-                    db.session.commit()
-                    enviados += 1
-                    print(f"[CRON] Aviso '{stage}' enviado para {email} (expira {expira_str}).")
-                except Exception as e:
-                    db.session.rollback()
-                    print(f"[CRON] ERRO ao salvar aviso de {email}: {e}")
-            else:
-                db.session.rollback()
-
-    print(f"[CRON] Concluído. {enviados} e-mail(s) enviado(s).")
+    if not smtp_pool.configurado():
+        print("[CRON] ERRO: credenciais de e-mail não configuradas.")
+        return
+    trava = _travar_execucao()
+    if trava is False:
+        print("[CRON] Outra execução dos avisos ainda está rodando; saindo.")
+        return
+    resumo = _Resumo()
+    limite = smtp_pool.LimiteTaxa(AVISOS_TAXA_POR_MINUTO, AVISOS_RAJADA) if AVISOS_TAXA_POR_MINUTO > 0 else None
+    try:
+        with app.app_context(), ThreadPoolExecutor(max_workers=AVISOS_THREADS,
+                                                   thread_name_prefix="aviso") as executor:
+            agora = datetime.utcnow()
+            em_voo = {}  # futuro -> (estágio, filtro da janela, avisos do lote)
+
+            def despachar(stage, filtro, avisos):
+                futuro = executor.submit(_enviar, [msg for _lic, msg in avisos], limite)
+                em_voo[futuro] = (stage, filtro, avisos)
+                # Poucos lotes prontos à frente do envio: memória constante.
+                if len(em_voo) >= 2 * AVISOS_THREADS:
+                    _concluir(em_voo, resumo, trava)
+
+            with db.engine.connect() as leitura:
+                for stage, filtro in _janelas(agora):
+                    avisos = []
+                    for lic in _candidatas(leitura, filtro):
+                        if not (lic.cliente_email or "").strip():
+                            resumo.sem_email += 1
+                            continue
+                        avisos.append((lic, _mensagem(stage, lic, agora)))
+                        if len(avisos) >= LOTE_EMAILS:
+                            despachar(stage, filtro, avisos)
+                            avisos = []
+                    if avisos:
+                        despachar(stage, filtro, avisos)
+            if em_voo:
+                _concluir(em_voo, resumo, trava, todos=True)
+    finally:
+        _liberar_trava(trava)
+
+    resumo.imprimir()
+    print(f"[CRON] Concluído. {sum(resumo.por_estagio.values())} e-mail(s) enviado(s).")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+ranking.py
+==========
+Ranking de vendedores (/api/ranking) em sorted sets do Redis.
+
+O endpoint somava as entregas de todos os vendedores a cada chamada. Aqui
+cada quadro é um ZSET (membro = codigo_ranking, score = pontos):
+
+  ranking:total                 todo o histórico
+  ranking:semana:<AAAA-Www>     semana ISO (UTC) da data_criacao
+  ranking:dia:<AAAA-MM-DD>      dia (UTC) da data_criacao
+
+  - o worker chama registrar_entrega() depois do commit da entrega
+    (ZINCRBY nos três quadros, numa ida ao Redis);
+  - ler() devolve o top-N (ZREVRANGE) e a posição de um vendedor
+    (ZREVRANK), O(log n), sem tocar no banco;
+  - reconciliar() acerta os quadros atuais pelo rollup vendas_diarias: lê
+    o banco, depois o ZSET, e soma a diferença (ZUNIONSTORE, numa MULTI)
+    em vez de sobrescrever o quadro, para não apagar os ZINCRBY que chegam
+    durante a reconciliação. O worker roda a reconciliação a cada
+    RANKING_RECONCILIAR_S; um ZINCRBY perdido (Redis fora na hora da
+    entrega) some na próxima rodada.
+
+Os pontos do dia/semana usam o dia da data_criacao, igual ao rollup, para a
+reconciliação bater com o incremental. Enquanto não houver reconciliação
+(RANKING_PRONTO ausente) ou o quadro estiver vazio, ler() devolve None e o
+endpoint usa o banco.
+
+Autossuficiente: não importa nada do app.py nem do worker.py.
+"""
+
+import os
+import time
+from datetime import datetime, timedelta
+
+import redis
+from sqlalchemy import text
+
+import vendas_diarias
+from cache import get_redis
+
+RANKING_RECONCILIAR_S = int(os.environ.get("RANKING_RECONCILIAR_S", 600))
+RANKING_LIMITE = int(os.environ.get("RANKING_LIMITE", 100))
+RANKING_TTL_DIA_S = 3 * 86400
+RANKING_TTL_SEMANA_S = 15 * 86400
+
+QUADROS = ("total", "semana", "dia")
+RANKING_NOMES = "ranking:nomes"   # hash codigo -> nome do vendedor
+RANKING_SOMAS = "ranking:somas"   # hash chave do quadro -> soma dos pontos
+RANKING_PRONTO = "ranking:reconciliado_em"
+
+
+def inicio_quadro(quadro, quando):
+    """Primeiro dia (date) do quadro que contém `quando`; None = total."""
+    if quadro == "dia":
+        return quando.date()
+    if quadro == "semana":
+        return quando.date() - timedelta(days=quando.weekday())
+    return None
+
+
+def chave(quadro, quando=None):
+    """Chave do ZSET do quadro no instante `quando` (UTC, padrão agora)."""
+    quando = quando or datetime.utcnow()
+    if quadro == "dia":
+        return f"ranking:dia:{quando:%Y-%m-%d}"
+    if quadro == "semana":
+        ano, semana, _ = quando.isocalendar()
+        return f"ranking:semana:{ano}-W{semana:02d}"
+    return "ranking:total"
+
+
+def _ttl(quadro):
+    return {"dia": RANKING_TTL_DIA_S, "semana": RANKING_TTL_SEMANA_S}.get(quadro)
+
+
+# ----------------------------------------------------------------------
+# Incremental (worker, depois do commit da entrega)
+# ----------------------------------------------------------------------
+def registrar_entrega(vendedor_codigo, data_criacao):
+    """+1 ponto para o vendedor nos quadros total, semana e dia da cobrança."""
+    r = get_redis()
+    if r is None or not vendedor_codigo:
+        return
+    try:
+        pipe = r.pipeline(transaction=False)
+        for quadro in QUADROS:
+            k = chave(quadro, data_criacao)
+            pipe.zincrby(k, 1, vendedor_codigo)
+            pipe.hincrby(RANKING_SOMAS, k, 1)
+            if _ttl(quadro):
+                pipe.expire(k, _ttl(quadro))
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"[RANKING] Falha ao pontuar {vendedor_codigo} ({e}); a reconciliação corrige.")
+
+
+# ----------------------------------------------------------------------
+# Leitura (endpoint)
+# ----------------------------------------------------------------------
+def ler(quadro="total", limite=RANKING_LIMITE, codigo=None):
+    """Top-N do quadro atual e a posição de `codigo`.
+
+    {"itens": [(nome, codigo, pontos)], "soma": int, "posicao": (rank, pontos) | None}
+    None = Redis indisponível, ranking ainda não reconciliado ou quadro vazio."""
+    r = get_redis()
+    if r is None:
+        return None
+    k = chave(quadro)
+    try:
+        pipe = r.pipeline(transaction=False)
+        pipe.exists(RANKING_PRONTO)
+        pipe.zrevrange(k, 0, limite - 1, withscores=True)
+        pipe.hget(RANKING_SOMAS, k)
+        if codigo:
+            pipe.zrevrank(k, codigo)
+            pipe.zscore(k, codigo)
+        res = pipe.execute()
+        if not res[0] or not res[1]:
+            # Sem reconciliação ainda, ou quadro novo (dia/semana) sem venda.
+            return None
+        top = [(m.decode() if isinstance(m, bytes) else m, int(s)) for m, s in res[1]]
+        nomes = r.hmget(RANKING_NOMES, [c for c, _ in top]) if top else []
+    except redis.RedisError as e:
+        print(f"[RANKING] Redis indisponível para leitura: {e}")
+        return None
+
+    posicao = None
+    if codigo and res[3] is not None:
+        posicao = (res[3] + 1, int(res[4] or 0))
+    return {
+        "itens": [((n.decode() if n else c), c, pontos) for (c, pontos), n in zip(top, nomes)],
+        "soma": int(res[2] or 0),
+        "posicao": posicao,
+    }
+
+
+# ----------------------------------------------------------------------
+# Reconciliação (worker, periódica)
+# ----------------------------------------------------------------------
+def reconciliar(conexao, agora=None):
+    """Acerta os quadros atuais pelo banco. Retorna {quadro: vendedores}.
+
+    Cada quadro recebe a diferença banco - Redis, com o Redis lido logo
+    depois do banco, e os ZINCRBY que chegam até o fim da reconciliação
+    continuam valendo. Só uma entrega que caia entre as duas leituras
+    (milissegundos) fica fora, e a próxima rodada corrige."""
+    r = get_redis()
+    if r is None:
+        return None
+    agora = agora or datetime.utcnow()
+    inicio = time.monotonic()
+    vendedores = dict(conexao.execute(text("SELECT codigo_ranking, nome_vendedor FROM vendedores")).all())
+
+    chaves_atuais = {chave(quadro, agora) for quadro in QUADROS}
+    pipe = r.pipeline(transaction=True)
+    # Somas de quadros passados (entregas de cobranças antigas) não são mais lidas.
+    velhas = [k for k in r.hkeys(RANKING_SOMAS) if (k.decode() if isinstance(k, bytes) else k) not in chaves_atuais]
+    if velhas:
+        pipe.hdel(RANKING_SOMAS, *velhas)
+    if vendedores:
+        pipe.delete(RANKING_NOMES)
+        pipe.hset(RANKING_NOMES, mapping=vendedores)
+    contagem = {}
+    for quadro in QUADROS:
+        pontos = vendas_diarias.pontos_por_vendedor(conexao, desde=inicio_quadro(quadro, agora))
+        # Vendedor sem venda também aparece (com 0), como no ranking do banco.
+        membros = {codigo: 0 for codigo in vendedores}
+        membros.update(pontos)
+        k = chave(quadro, agora)
+
+        leitura = r.pipeline(transaction=True)
+        leitura.zrange(k, 0, -1, withscores=True)
+        leitura.hget(RANKING_SOMAS, k)
+        no_redis, soma_redis = leitura.execute()
+        no_redis = {(m.decode() if isinstance(m, bytes) else m): int(p) for m, p in no_redis}
+
+        diferenca = {codigo: p - no_redis.get(codigo, 0) for codigo, p in membros.items()}
+        if diferenca:
+            temp = f"{k}:reconciliando"
+            r.delete(temp)
+            r.zadd(temp, diferenca)
+            r.expire(temp, RANKING_RECONCILIAR_S)
+            pipe.zunionstore(k, [k, temp])  # SUM: leitura + diferença + ZINCRBY recentes
+            pipe.delete(temp)
+        sobras = [codigo for codigo in no_redis if codigo not in membros]
+        if sobras:
+            pipe.zrem(k, *sobras)  # vendedor removido do banco
+        if _ttl(quadro):
+            pipe.expire(k, _ttl(quadro))  # o ZUNIONSTORE zera o TTL
+        pipe.hincrby(RANKING_SOMAS, k, sum(pontos.values()) - int(soma_redis or 0))
+        contagem[quadro] = len(membros)
+    pipe.set(RANKING_PRONTO, agora.isoformat())
+    pipe.execute()
+    print(f"[RANKING] Reconciliado em {time.monotonic() - inicio:.2f}s: "
+          + ", ".join(f"{q}={n}" for q, n in contagem.items()))
+    return contagem
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+smtp_pool.py
+============
+Transporte de e-mail compartilhado (worker, app e cron de avisos).
+
+Antes, cada e-mail abria um smtplib.SMTP novo e pagava TCP + STARTTLS +
+LOGIN para uma única mensagem. Aqui as conexões já autenticadas ficam num
+pool por processo e são reaproveitadas:
+
+  - até SMTP_POOL conexões simultâneas por processo;
+  - conexão parada há mais de SMTP_VERIFICAR_S é testada com NOOP antes de
+    ser usada; parada há mais de SMTP_OCIOSO_MAX_S é descartada (o servidor
+    já derrubou);
+  - depois de SMTP_MAX_MENSAGENS a conexão é renovada (limite por sessão
+    dos provedores);
+  - desconexão no meio do envio: reconecta e tenta mais uma vez;
+  - enviar_lote aceita um LimiteTaxa (token bucket) compartilhado entre
+    threads, para envios em massa não estourarem a cota do provedor.
+
+Porta 465 usa SSL direto; as demais usam STARTTLS (mesma regra que o
+worker já usava no e-mail de produto físico).
+
+Envio em segundo plano: job_enviar é o job RQ genérico de e-mail (fila
+"emails", com Retry do RQ); enviar_em_segundo_plano é o plano B em thread
+do próprio processo quando o Redis não está disponível.
+"""
+
+import os
+import time
+import queue
+import smtplib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+
+SMTP_SERVER = os.environ.get("SMTP_SERVER", "smtp.zoho.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", 587))
+EMAIL_USER = os.environ.get("EMAIL_USER")
+EMAIL_PASSWORD = os.environ.get("EMAIL_PASSWORD")
+
+SMTP_POOL = int(os.environ.get("SMTP_POOL", 2))
+SMTP_TIMEOUT = float(os.environ.get("SMTP_TIMEOUT", 15))
+SMTP_VERIFICAR_S = 30
+SMTP_OCIOSO_MAX_S = 240
+SMTP_MAX_MENSAGENS = int(os.environ.get("SMTP_MAX_MENSAGENS", 100))
+
+# Erros em que o servidor recusou a mensagem, mas a sessão continua boa.
+ERROS_DA_MENSAGEM = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+class _Conexao:
+    def __init__(self, servidor):
+        self.servidor = servidor
+        self.usada_em = time.monotonic()
+        self.mensagens = 0
+
+
+_livres = queue.LifoQueue()
+_vagas = threading.BoundedSemaphore(SMTP_POOL)
+_contadores = {"conexoes": 0, "mensagens": 0}  # deste processo
+
+
+def configurado():
+    return bool(EMAIL_USER and EMAIL_PASSWORD)
+
+
+def estatisticas():
+    """Conexões SMTP abertas e mensagens enviadas por este processo. Com o
+    pool funcionando, mensagens sequenciais não abrem conexão nova."""
+    return dict(_contadores)
+
+
+def _conectar():
+    if SMTP_PORT == 465:
+        servidor = smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT)
+    else:
+        servidor = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        servidor.starttls()
+    servidor.login(EMAIL_USER, EMAIL_PASSWORD)
+    _contadores["conexoes"] += 1
+    return _Conexao(servidor)
+
+
+def _fechar(con):
+    try:
+        con.servidor.quit()
+    except Exception:
+        try:
+            con.servidor.close()
+        except Exception:
+            pass
+
+
+def _utilizavel(con):
+    parada = time.monotonic() - con.usada_em
+    if parada > SMTP_OCIOSO_MAX_S or con.mensagens >= SMTP_MAX_MENSAGENS:
+        return False
+    if parada > SMTP_VERIFICAR_S:
+        try:
+            return con.servidor.noop()[0] == 250
+        except Exception:
+            return False
+    return True
+
+
+def _pegar():
+    while True:
+        try:
+            con = _livres.get_nowait()
+        except queue.Empty:
+            return _conectar()
+        if _utilizavel(con):
+            return con
+        _fechar(con)
+
+
+@contextmanager
+def conexao():
+    """Empresta uma conexão autenticada do pool (devolvida ao sair do with)."""
+    if not _vagas.acquire(timeout=SMTP_TIMEOUT * 2):
+        raise smtplib.SMTPException("pool SMTP esgotado")
+    con = None
+    try:
+        con = _pegar()
+        yield con
+    except ERROS_DA_MENSAGEM:
+        raise
+    except Exception:
+        if con is not None:
+            _fechar(con)
+            con = None
+        raise
+    finally:
+        if con is not None:
+            con.usada_em = time.monotonic()
+            _livres.put(con)
+        _vagas.release()
+
+
+class LimiteTaxa:
+    """Token bucket thread-safe: até `por_minuto` mensagens por minuto, com
+    rajadas de até `rajada`. aguardar() bloqueia até haver uma ficha."""
+
+    def __init__(self, por_minuto, rajada=1):
+        self.por_segundo = por_minuto / 60.0
+        self.capacidade = max(1, rajada)
+        self.fichas = float(self.capacidade)
+        self.atualizado = time.monotonic()
+        self._lock = threading.Lock()
+
+    def aguardar(self):
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self.fichas = min(self.capacidade, self.fichas + (agora - self.atualizado) * self.por_segundo)
+                self.atualizado = agora
+                if self.fichas >= 1:
+                    self.fichas -= 1
+                    return
+                espera = (1 - self.fichas) / self.por_segundo
+            time.sleep(espera)
+
+
+def _enviar_na(con, msg):
+    con.servidor.send_message(msg)
+    con.mensagens += 1
+    _contadores["mensagens"] += 1
+
+
+def enviar(msg):
+    """Envia uma mensagem pelo pool. Levanta a exceção do smtplib se falhar."""
+    for tentativa in range(2):
+        try:
+            with conexao() as con:
+                _enviar_na(con, msg)
+            return
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # Conexão do pool morreu entre o teste e o envio: uma nova tentativa.
+            if tentativa:
+                raise
+
+
+def enviar_lote(mensagens, limite=None):
+    """Envia várias mensagens reaproveitando a mesma conexão.
+
+    limite: LimiteTaxa consultado antes de cada mensagem (None = sem limite).
+    Retorna uma lista com None (enviada) ou a exceção de cada mensagem, na
+    mesma ordem."""
+    resultados = []
+    pendentes = list(mensagens)
+    while pendentes:
+        try:
+            with conexao() as con:
+                while pendentes:
+                    if limite is not None:
+                        limite.aguardar()
+                    try:
+                        _enviar_na(con, pendentes[0])
+                        resultados.append(None)
+                    except ERROS_DA_MENSAGEM as e:
+                        resultados.append(e)
+                    pendentes.pop(0)
+                    if con.mensagens >= SMTP_MAX_MENSAGENS:
+                        break
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # Reconecta e segue do ponto onde parou; falha em seguida = desiste dessa mensagem.
+            try:
+                enviar(pendentes[0])
+                resultados.append(None)
+            except Exception as e:
+                resultados.append(e)
+            pendentes.pop(0)
+        except Exception as e:
+            # Sem conexão (login/rede): todas as restantes falham com o mesmo erro.
+            resultados.extend([e] * len(pendentes))
+            pendentes = []
+    return resultados
+
+
+def mensagem(destinatario, assunto, corpo_html):
+    """MIME html padrão dos e-mails da loja (From = EMAIL_USER)."""
+    msg = MIMEMultipart("alternative")
+    msg["Subject"] = assunto
+    msg["From"] = EMAIL_USER
+    msg["To"] = destinatario
+    msg.attach(MIMEText(corpo_html, "html"))
+    return msg
+
+
+def job_enviar(destinatario, assunto, corpo_html):
+    """Job RQ genérico de e-mail. Falha de envio = exceção (o Retry do RQ
+    reagenda). SMTP não configurado não é falha transitória: só loga."""
+    if not configurado():
+        print(f"[EMAIL] NÃO enviado para {destinatario}: SMTP (EMAIL_USER/EMAIL_PASSWORD) não configurado.")
+        return
+    enviar(mensagem(destinatario, assunto, corpo_html))
+    print(f"[EMAIL] Enviado para {destinatario}: {assunto}")
+
+
+# Plano B sem Redis: poucas threads, tentativas com espera crescente.
+EMAIL_THREADS = 2
+EMAIL_TENTATIVAS = 3
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _enviar_com_tentativas(destinatario, assunto, corpo_html):
+    if not configurado():
+        print(f"[EMAIL] NÃO enviado para {destinatario}: SMTP (EMAIL_USER/EMAIL_PASSWORD) não configurado.")
+        return False
+    for tentativa in range(EMAIL_TENTATIVAS):
+        try:
+            job_enviar(destinatario, assunto, corpo_html)
+            return True
+        except Exception as e:
+            print(f"[EMAIL] Tentativa {tentativa + 1}/{EMAIL_TENTATIVAS} para {destinatario} falhou: {e}")
+            if tentativa < EMAIL_TENTATIVAS - 1:
+                time.sleep(5 * 3 ** tentativa)
+    return False
+
+
+def enviar_em_segundo_plano(destinatario, assunto, corpo_html):
+    """Envia numa thread do processo (sem bloquear a requisição). Retorna o Future."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=EMAIL_THREADS, thread_name_prefix="email")
+    return _executor.submit(_enviar_com_tentativas, destinatario, assunto, corpo_html)
+
+
+def _descartar_herdadas():
+    """Processo filho (fork) não pode usar sockets SMTP do pai."""
+    global _livres, _vagas, _executor, _contadores
+    _livres = queue.LifoQueue()
+    _executor = None
+    _vagas = threading.BoundedSemaphore(SMTP_POOL)
+    _contadores = {"conexoes": 0, "mensagens": 0}
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_descartar_herdadas)
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+vendas_diarias.py
+=================
+Rollup diário de cobranças: uma linha por
+dia x produto x categoria x status x vendedor, com pedidos, bruto, frete e
+subtotal. O dashboard (Dashboard_api.py) e o ranking (ranking.py) leem estas
+poucas centenas de linhas em vez de varrer cobrancas.
+
+Manutenção incremental, na MESMA transação da cobrança:
+  - checkout cria a cobrança      -> +1 no status inicial;
+  - worker marca como delivered   -> -1 no status anterior, +1 em delivered.
+O dia é o da data_criacao (igual ao filtro do dashboard), então a troca de
+status nunca muda a linha de dia.
+
+Reconstrução completa (backfill / correção de divergência):
+    python vendas_diarias.py
+A migração 0004 cria a tabela e roda a reconstrução uma vez.
+
+Autossuficiente: não importa nada do app.py nem do worker.py.
+"""
+
+import os
+import sys
+import json
+import time
+
+from sqlalchemy import create_engine, text
+
+STATUS_PAGOS = ("approved", "delivered")
+
+# Categorias de comissão da BrooStore (ver categoria()).
+TIPOS_FISICO = ("fisico",)
+TIPOS_JOGOS_APPS = ("game", "app", "jogo", "aplicativo")
+
+# Sentinelas das dimensões nulas (NULL não casa no ON CONFLICT da chave).
+SEM_PRODUTO = 0
+SEM_VENDEDOR = ""
+SEM_STATUS = "desconhecido"
+
+DDL = """
+    CREATE TABLE IF NOT EXISTS vendas_diarias (
+        dia DATE NOT NULL,
+        product_id INTEGER NOT NULL,
+        categoria VARCHAR(20) NOT NULL,
+        status VARCHAR(50) NOT NULL,
+        vendedor_codigo VARCHAR(50) NOT NULL,
+        pedidos INTEGER NOT NULL DEFAULT 0,
+        bruto NUMERIC(14, 2) NOT NULL DEFAULT 0,
+        frete NUMERIC(14, 2) NOT NULL DEFAULT 0,
+        subtotal NUMERIC(14, 2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (dia, product_id, categoria, status, vendedor_codigo)
+    )
+"""
+
+_UPSERT = text("""
+    INSERT INTO vendas_diarias
+        (dia, product_id, categoria, status, vendedor_codigo, pedidos, bruto, frete, subtotal)
+    VALUES (:dia, :product_id, :categoria, :status, :vendedor_codigo, :pedidos, :bruto, :frete, :subtotal)
+    ON CONFLICT (dia, product_id, categoria, status, vendedor_codigo) DO UPDATE SET
+        pedidos = vendas_diarias.pedidos + excluded.pedidos,
+        bruto = vendas_diarias.bruto + excluded.bruto,
+        frete = vendas_diarias.frete + excluded.frete,
+        subtotal = vendas_diarias.subtotal + excluded.subtotal
+""")
+
+
+def _db_url():
+    url = os.environ.get("DATABASE_URL", "sqlite:///cobrancas.db")
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql+psycopg://", 1)
+    elif url.startswith("postgresql://"):
+        url = url.replace("postgresql://", "postgresql+psycopg://", 1)
+    return url
+
+
+# ----------------------------------------------------------------------
+# Regras de negócio (usadas também pelo Dashboard_api)
+# ----------------------------------------------------------------------
+def categoria(tipo):
+    """
+    Classifica o produto numa das 3 categorias de comissão da BrooStore.
+    Ajuste TIPOS_FISICO / TIPOS_JOGOS_APPS se surgirem novos 'tipo'.
+      - fisico                       -> produtos físicos
+      - game / app                   -> jogos e aplicativos
+      - ebook / digital / assinatura -> produtos digitais (default)
+    """
+    t = (tipo or "").strip().lower()
+    if t in TIPOS_FISICO:
+        return "fisico"
+    if t in TIPOS_JOGOS_APPS:
+        return "jogos_apps"
+    return "digital"
+
+
+def ler_observacoes(raw):
+    """Lê o JSON da coluna observacoes com segurança. Retorna dict."""
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw) if isinstance(raw, str) else dict(raw)
+    except Exception:
+        return {}
+
+
+def valores(valor, observacoes, frete=None, subtotal_produto=None):
+    """
+    Decompõe o valor de uma cobrança em (subtotal_produto, frete).
+    - 'frete' e 'subtotal_produto' vêm das colunas; cobrança ainda sem as
+      colunas preenchidas (frete NULL) cai para o JSON de observacoes.
+    - Pedidos antigos/digitais podem não ter: usa fallback seguro.
+    """
+    valor = float(valor or 0)
+    if frete is not None:
+        subtotal = subtotal_produto
+    else:
+        obs = ler_observacoes(observacoes)
+        frete = obs.get("frete")
+        subtotal = obs.get("subtotal_produto")
+    frete = float(frete or 0)
+    if subtotal is None:
+        subtotal = max(0.0, valor - frete)
+    return round(float(subtotal), 2), round(frete, 2)
+
+
+def sql_dialeto(dialeto):
+    """Fragmentos SQL por banco com a mesma regra de valores() e categoria().
+
+    Usam o alias c (cobrancas) e p (produtos). frete/subtotal leem as
+    colunas e só vão ao JSON (*_json) quando c.frete ainda está NULL."""
+    tipo = "lower(trim(p.tipo))"
+    sql_categoria = (f"CASE WHEN {tipo} IN ({', '.join(repr(t) for t in TIPOS_FISICO)}) THEN 'fisico' "
+                     f"WHEN {tipo} IN ({', '.join(repr(t) for t in TIPOS_JOGOS_APPS)}) THEN 'jogos_apps' "
+                     f"ELSE 'digital' END")
+    if dialeto == "postgresql":
+        obs = "(CASE WHEN left(ltrim(c.observacoes), 1) = '{' THEN CAST(c.observacoes AS jsonb) END)"
+        d = {
+            "frete_json": f"COALESCE(CAST(NULLIF({obs} ->> 'frete', '') AS double precision), 0)",
+            "subtotal_json": f"CAST(NULLIF({obs} ->> 'subtotal_produto', '') AS double precision)",
+            "transportadora_json": f"left({obs} ->> 'transportadora', 100)",
+            "maior": "GREATEST",
+            "dia": "to_char(c.data_criacao, 'YYYY-MM-DD')",
+            "data": "CAST(c.data_criacao AS DATE)",
+            "categoria": sql_categoria,
+        }
+    else:
+        obs = "CASE WHEN json_valid(c.observacoes) THEN json_extract(c.observacoes, '$.{campo}') END"
+        d = {
+            "frete_json": f"COALESCE(CAST({obs.format(campo='frete')} AS REAL), 0)",
+            "subtotal_json": f"CAST({obs.format(campo='subtotal_produto')} AS REAL)",
+            "transportadora_json": f"substr({obs.format(campo='transportadora')}, 1, 100)",
+            "maior": "MAX",
+            "dia": "strftime('%Y-%m-%d', c.data_criacao)",
+            "data": "date(c.data_criacao)",
+            "categoria": sql_categoria,
+        }
+    d["frete"] = f"COALESCE(c.frete, {d['frete_json']})"
+    d["subtotal"] = f"(CASE WHEN c.frete IS NOT NULL THEN c.subtotal_produto ELSE {d['subtotal_json']} END)"
+    return d
+
+
+# ----------------------------------------------------------------------
+# Manutenção incremental
+# ----------------------------------------------------------------------
+def _linha(cobranca, tipo_produto, status, sinal):
+    subtotal, frete = valores(cobranca.valor, cobranca.observacoes,
+                              getattr(cobranca, "frete", None), getattr(cobranca, "subtotal_produto", None))
+    return {
+        "dia": cobranca.data_criacao.date(),
+        "product_id": cobranca.product_id or SEM_PRODUTO,
+        "categoria": categoria(tipo_produto),
+        "status": status or SEM_STATUS,
+        "vendedor_codigo": getattr(cobranca, "vendedor_codigo", None) or SEM_VENDEDOR,
+        "pedidos": sinal,
+        "bruto": sinal * round(float(cobranca.valor or 0), 2),
+        "frete": sinal * frete,
+        "subtotal": sinal * subtotal,
+    }
+
+
+def registrar(sessao, cobranca, tipo_produto, status_anterior=None):
+    """Aplica a criação (status_anterior=None) ou a troca de status da cobrança.
+
+    Roda na transação de quem chama (o commit é dela), dentro de um
+    SAVEPOINT: se o rollup falhar (ex.: migração ainda não aplicada), a
+    cobrança segue e a próxima reconstrução corrige."""
+    if status_anterior == cobranca.status:
+        return
+    linhas = [_linha(cobranca, tipo_produto, cobranca.status, 1)]
+    if status_anterior is not None:
+        linhas.insert(0, _linha(cobranca, tipo_produto, status_anterior, -1))
+    try:
+        with sessao.begin_nested():
+            for linha in linhas:
+                sessao.execute(_UPSERT, linha)
+    except Exception as e:
+        print(f"[ROLLUP] ⚠️ vendas_diarias não atualizada (cobrança {cobranca.id}): {e}")
+
+
+# ----------------------------------------------------------------------
+# Leitura
+# ----------------------------------------------------------------------
+def pontos_por_vendedor(conexao, desde=None):
+    """Cobranças entregues por vendedor -> {codigo: pontos}.
+
+    desde (date): só os dias a partir dele; None = todo o histórico."""
+    filtro = "AND dia >= :desde" if desde is not None else ""
+    return {codigo: int(pontos) for codigo, pontos in conexao.execute(text(f"""
+        SELECT vendedor_codigo, SUM(pedidos) FROM vendas_diarias
+        WHERE status = 'delivered' AND vendedor_codigo <> '{SEM_VENDEDOR}' {filtro}
+        GROUP BY vendedor_codigo
+    """), {"desde": desde} if desde is not None else {})}
+
+
+# ----------------------------------------------------------------------
+# Reconstrução
+# ----------------------------------------------------------------------
+def reconstruir(engine=None):
+    """Recalcula o rollup inteiro a partir de cobrancas (numa transação)."""
+    engine = engine or create_engine(_db_url())
+    inicio = time.monotonic()
+    with engine.begin() as conn:
+        d = sql_dialeto(conn.dialect.name)
+        conn.execute(text(DDL))
+        if conn.dialect.name == "postgresql":
+            # Entregas/checkouts concorrentes esperam a reconstrução terminar.
+            conn.execute(text("LOCK TABLE vendas_diarias IN EXCLUSIVE MODE"))
+        conn.execute(text("DELETE FROM vendas_diarias"))
+        inseridas = conn.execute(text(f"""
+            INSERT INTO vendas_diarias
+                (dia, product_id, categoria, status, vendedor_codigo, pedidos, bruto, frete, subtotal)
+            SELECT dia, product_id, categoria, status, vendedor_codigo,
+                   COUNT(*), SUM(bruto), SUM(frete), SUM(COALESCE(subtotal_obs, {d['maior']}(bruto - frete, 0)))
+            FROM (
+                SELECT {d['data']} AS dia,
+                       COALESCE(c.product_id, {SEM_PRODUTO}) AS product_id,
+                       {d['categoria']} AS categoria,
+                       COALESCE(c.status, '{SEM_STATUS}') AS status,
+                       COALESCE(c.vendedor_codigo, '{SEM_VENDEDOR}') AS vendedor_codigo,
+                       COALESCE(c.valor, 0) AS bruto,
+                       {d['frete']} AS frete,
+                       {d['subtotal']} AS subtotal_obs
+                FROM cobrancas c
+                LEFT JOIN produtos p ON p.id = c.product_id
+            ) linhas
+            GROUP BY dia, product_id, categoria, status, vendedor_codigo
+        """)).rowcount
+    print(f"[ROLLUP] vendas_diarias reconstruída: {inseridas} linhas em {time.monotonic() - inicio:.1f}s.")
+    return inseridas
+
+
+if __name__ == "__main__":
+    try:
+        reconstruir()
+    except Exception as e:
+        print(f"[ROLLUP] ❌ Falha: {e}")
+        sys.exit(1)
@@ -5,18 +5,26 @@ Processa webhooks do Mercado Pago, entrega produtos e registra vendas no Supabas
 """
 
 import os
-import mercadopago
-import smtplib
-import redis
-import requests
 import time
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from rq import Worker, Queue 
+import signal
+import multiprocessing
+import redis
+from rq import SimpleWorker, Queue, Retry, get_current_job
 from datetime import datetime, timedelta
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 
+import dashboard_cache
+import filas
+import http_cliente
+from alocador_chaves import AlocadorChaves
+import licenca_cache
+import migracoes
+import mp_cliente
+import ranking
+import smtp_pool
+import vendas_diarias
+
 # ============================================
 # CONFIGURAÇÃO DO FLASK / DB LOCAL
 # ============================================
@@ -53,6 +61,9 @@ class Cobranca(db.Model):
     status = db.Column(db.String(50), default="pending", nullable=False)
     data_criacao = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('produtos.id'), nullable=True)
+    vendedor_codigo = db.Column(db.String(50), nullable=True)  # dimensão do rollup vendas_diarias
+    frete = db.Column(db.Float, nullable=True)
+    subtotal_produto = db.Column(db.Float, nullable=True)
     observacoes = db.Column(db.Text, nullable=True)  # JSON com endereco/frete do pedido fisico
     produto = db.relationship('Produto')
     chave_usada = db.relationship('ChaveLicenca', backref='cobranca_rel', uselist=False)
@@ -127,7 +138,7 @@ def registrar_venda_no_supabase(product_id, customer_email, amount, payment_id):
         
         # Verifica se payment_id já existe antes de inserir (proteção anti-duplicata)
         check_url = f"{SUPABASE_URL}/rest/v1/sales?payment_id=eq.{payment_id}&select=id"
-        check_resp = requests.get(check_url, headers=headers, timeout=10)
+        check_resp = http_cliente.get(check_url, headers=headers, timeout=10)
         if check_resp.status_code == 200 and check_resp.json():
             print(f"[WORKER] ⚠️ Venda {payment_id} já registrada no Supabase. Ignorando duplicata.")
             return True
@@ -141,7 +152,7 @@ def registrar_venda_no_supabase(product_id, customer_email, amount, payment_id):
         }
         
         print(f"[WORKER] Inserindo no Supabase: Produto {product_id}, Valor {amount}")
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
+        response = http_cliente.post(url, json=payload, headers=headers, timeout=10)
         
         print(f"[WORKER] Resposta Supabase: Status {response.status_code}")
         
@@ -161,11 +172,7 @@ def registrar_venda_no_supabase(product_id, customer_email, amount, payment_id):
 # ============================================
 def enviar_email_produto_fisico(destinatario, nome_cliente, valor, nome_produto, cobranca):
     """Envia email de confirmação de pedido para produto físico."""
-    try:
-        smtp_server = os.environ.get("SMTP_SERVER", "smtp.zoho.com")
-        email_user  = os.environ["EMAIL_USER"]
-        email_pass  = os.environ["EMAIL_PASSWORD"]
-    except KeyError:
+    if not smtp_pool.configurado():
         print("[WORKER] ERRO: Credenciais de email não configuradas.")
         return False
 
@@ -223,24 +230,7 @@ body{{font-family:Arial,sans-serif;line-height:1.6;color:#333;margin:0;padding:0
 </body></html>"""
 
     try:
-        import smtplib
-        from email.mime.multipart import MIMEMultipart
-        from email.mime.text import MIMEText
-        msg = MIMEMultipart("alternative")
-        msg["Subject"] = assunto
-        msg["From"]    = email_user
-        msg["To"]      = destinatario
-        msg.attach(MIMEText(corpo_html, "html"))
-        smtp_port = int(os.environ.get("SMTP_PORT", 587))
-        if smtp_port == 465:
-            with smtplib.SMTP_SSL(smtp_server, smtp_port, timeout=10) as server:
-                server.login(email_user, email_pass)
-                server.send_message(msg)
-        else:
-            with smtplib.SMTP(smtp_server, smtp_port, timeout=10) as server:
-                server.starttls()
-                server.login(email_user, email_pass)
-                server.send_message(msg)
+        smtp_pool.enviar(smtp_pool.mensagem(destinatario, assunto, corpo_html))
         print(f"[WORKER] Email físico enviado para {destinatario}")
         return True
     except Exception as e:
@@ -250,11 +240,7 @@ body{{font-family:Arial,sans-serif;line-height:1.6;color:#333;margin:0;padding:0
 
 def enviar_email_confirmacao(destinatario, nome_cliente, valor, link_produto, cobranca, nome_produto, chave_acesso=None):
     """Envia email de entrega do produto."""
-    try:
-        smtp_server = os.environ.get("SMTP_SERVER", "smtp.zoho.com")
-        email_user = os.environ["EMAIL_USER"]
-        email_pass = os.environ["EMAIL_PASSWORD"]
-    except KeyError:
+    if not smtp_pool.configurado():
         print("[WORKER] ERRO: Credenciais de email não configuradas.")
         return False
     
@@ -325,18 +311,8 @@ def enviar_email_confirmacao(destinatario, nome_cliente, valor, link_produto, co
 </body>
 </html>"""
     
-    msg = MIMEMultipart("alternative")
-    msg["Subject"] = assunto
-    msg["From"] = email_user
-    msg["To"] = destinatario
-    msg.attach(MIMEText(corpo_html, "html"))
-    
     try:
-        smtp_port = int(os.environ.get("SMTP_PORT", 587))
-        with smtplib.SMTP(smtp_server, smtp_port, timeout=10) as server:
-            server.starttls()
-            server.login(email_user, email_pass)
-            server.send_message(msg)
+        smtp_pool.enviar(smtp_pool.mensagem(destinatario, assunto, corpo_html))
         print(f"[WORKER] Email enviado para {destinatario}")
         return True
     except Exception as exc:
@@ -348,11 +324,7 @@ def enviar_email_confirmacao(destinatario, nome_cliente, valor, link_produto, co
 # ============================================
 def enviar_email_licenca(destinatario, nome_cliente, rotulo_plano, expira_em):
     """Envia e-mail confirmando a ativação/renovação da licença do BrooStock."""
-    try:
-        smtp_server = os.environ.get("SMTP_SERVER", "smtp.zoho.com")
-        email_user = os.environ["EMAIL_USER"]
-        email_pass = os.environ["EMAIL_PASSWORD"]
-    except KeyError:
+    if not smtp_pool.configurado():
         print("[WORKER] ERRO: Credenciais de email não configuradas.")
         return False
 
@@ -374,18 +346,8 @@ def enviar_email_licenca(destinatario, nome_cliente, rotulo_plano, expira_em):
   </div>
 </body></html>"""
 
-    msg = MIMEMultipart("alternative")
-    msg["Subject"] = assunto
-    msg["From"] = email_user
-    msg["To"] = destinatario
-    msg.attach(MIMEText(corpo_html, "html"))
-
     try:
-        smtp_port = int(os.environ.get("SMTP_PORT", 587))
-        with smtplib.SMTP(smtp_server, smtp_port, timeout=10) as server:
-            server.starttls()
-            server.login(email_user, email_pass)
-            server.send_message(msg)
+        smtp_pool.enviar(smtp_pool.mensagem(destinatario, assunto, corpo_html))
         print(f"[WORKER] Email de licença enviado para {destinatario}")
         return True
     except Exception as exc:
@@ -444,17 +406,59 @@ def ativar_ou_renovar_licenca(produto, cobranca):
 # ============================================
 # JOB PRINCIPAL: PROCESSAR WEBHOOK
 # ============================================
-def process_mercado_pago_webhook(payment_id):
+def _liberar_dedupe_webhook(payment_id):
+    """Apaga a chave de dedupe do app ao iniciar o job: uma notificação que
+    chegar daqui em diante (ex.: pending -> approved) volta a enfileirar."""
+    job = get_current_job()
+    if job is None:
+        return
+    try:
+        job.connection.delete(filas.chave_webhook_pendente(payment_id))
+    except redis.RedisError as e:
+        print(f"[WORKER] Não consegui liberar dedupe de {payment_id}: {e}")
+
+
+# Webhook que chega antes do commit da cobrança: em vez de segurar o worker
+# com sleep, o job é reagendado (RQ scheduler) com atraso exponencial e o
+# worker segue processando outros pagamentos. COBRANCA_TENTATIVAS conta a
+# execução inicial: 6 tentativas = 5 reagendamentos, 1+2+4+8+16 = 31 s.
+COBRANCA_TENTATIVAS = int(os.environ.get("COBRANCA_TENTATIVAS", 6))
+COBRANCA_ATRASO_BASE_S = 1
+
+
+def _reagendar_pagamento(payment_id, tentativa):
+    """Reagenda a verificação do pagamento. False se não houver job/Redis."""
+    job = get_current_job()
+    if job is None:
+        return False
+    atraso = COBRANCA_ATRASO_BASE_S * (2 ** tentativa)
+    try:
+        fila = Queue(job.origin, connection=job.connection)
+        fila.enqueue_in(
+            timedelta(seconds=atraso), process_mercado_pago_webhook, payment_id, tentativa + 1,
+            job_id=f"{filas.job_id_pagamento(payment_id)}-r{tentativa + 1}",
+        )
+        # Mantém o dedupe do app ligado: o reagendamento já cobre as
+        # notificações que chegarem enquanto isso.
+        job.connection.set(filas.chave_webhook_pendente(payment_id), 1, ex=filas.WEBHOOK_JANELA_S)
+    except redis.RedisError as e:
+        print(f"[WORKER] Falha ao reagendar pagamento {payment_id}: {e}")
+        return False
+    print(f"[WORKER] Tentativa {tentativa + 1}: cobrança não encontrada, reagendado em {atraso}s.")
+    return True
+
+
+def process_mercado_pago_webhook(payment_id, tentativa=0):
     """Processa pagamento aprovado do Mercado Pago."""
+    _liberar_dedupe_webhook(payment_id)
     with app.app_context():
-        # 1. Verificar token
-        access_token = os.environ.get("MERCADOPAGO_ACCESS_TOKEN")
-        if not access_token:
+        # 1. Verificar token (SDK compartilhado pelo processo, sessão HTTP persistente)
+        sdk = mp_cliente.get_sdk()
+        if sdk is None:
             print("[WORKER] ERRO: MERCADOPAGO_ACCESS_TOKEN não configurado.")
             return
         
         # 2. Consultar Mercado Pago
-        sdk = mercadopago.SDK(access_token)
         try:
             resp = sdk.payment().get(payment_id)
         except Exception as e:
@@ -479,16 +483,10 @@ def process_mercado_pago_webhook(payment_id):
         
         print(f"[WORKER] Processando pagamento {payment_id} | ExtRef: {external_ref}")
         
-        # Retry com delay
-        cobranca = None
-        for tentativa in range(5):
-            cobranca = Cobranca.query.filter_by(external_reference=str(external_ref)).first()
-            if cobranca:
-                break
-            if tentativa < 4:
-                print(f"[WORKER] Tentativa {tentativa+1}: cobrança não encontrada, aguardando 2s...")
-                time.sleep(2)
-                db.session.expire_all()
+        cobranca = Cobranca.query.filter_by(external_reference=str(external_ref)).first()
+        if not cobranca and tentativa < COBRANCA_TENTATIVAS - 1:
+            if _reagendar_pagamento(payment_id, tentativa):
+                return
         
         if not cobranca:
             print(f"[WORKER] ERRO: Cobrança {external_ref} não encontrada.")
@@ -498,12 +496,80 @@ def process_mercado_pago_webhook(payment_id):
             print(f"[WORKER] Cobrança {cobranca.id} já foi entregue. Ignorando.")
             return
         
-        # 4. Buscar produto
+        # 4. Despachar a entrega para a fila do tipo de produto
         produto = cobranca.produto
         if not produto:
             print(f"[WORKER] ERRO: Produto não encontrado.")
             return
         
+        nome_fila = filas.FILA_LICENCAS if produto.tipo == "assinatura" else filas.FILA_EMAILS
+        _despachar(nome_fila, entregar_cobranca, cobranca.id, payment_id,
+                   job_id=filas.job_id_entrega(cobranca.id))
+
+
+# ============================================
+# RESERVA DE CHAVES (game/app)
+# ============================================
+ALERTA_ESTOQUE_EMAIL = os.environ.get("ALERTA_ESTOQUE_EMAIL") or smtp_pool.EMAIL_USER
+
+
+def _alertar_estoque_baixo(produto_id, restantes):
+    """E-mail para a loja quando as chaves de um produto estão acabando."""
+    if not ALERTA_ESTOQUE_EMAIL:
+        print(f"[WORKER] ⚠️ Estoque baixo do produto {produto_id}: {restantes} chave(s) (sem ALERTA_ESTOQUE_EMAIL).")
+        return
+    assunto = f"⚠️ Estoque baixo: produto {produto_id} ({restantes} chave(s))"
+    corpo = (f"<p>Restam <b>{restantes}</b> chave(s) livre(s) do produto <b>{produto_id}</b>.</p>"
+             f"<p>Importe novas chaves para não interromper as entregas.</p>")
+    job = get_current_job()
+    if job is not None:
+        Queue(filas.FILA_EMAILS, connection=job.connection).enqueue(
+            'smtp_pool.job_enviar', ALERTA_ESTOQUE_EMAIL, assunto, corpo,
+            retry=Retry(max=3, interval=[30, 120, 600]))
+    else:
+        smtp_pool.enviar_em_segundo_plano(ALERTA_ESTOQUE_EMAIL, assunto, corpo)
+    print(f"[WORKER] ⚠️ Alerta de estoque baixo do produto {produto_id} ({restantes}).")
+
+
+alocador = AlocadorChaves(db, ChaveLicenca, alertar=_alertar_estoque_baixo)
+
+
+def _despachar(nome_fila, funcao, *args, job_id, **opcoes):
+    """Enfileira a próxima etapa na fila dedicada (uma vez por job_id).
+
+    Fora de um job RQ (chamada direta), executa a etapa na hora."""
+    job = get_current_job()
+    if job is None:
+        return funcao(*args)
+    fila = Queue(nome_fila, connection=job.connection)
+    existente = fila.fetch_job(job_id)
+    if existente is not None and existente.get_status() in filas.STATUS_PENDENTES:
+        print(f"[WORKER] {job_id} já está em andamento ({existente.get_status()}).")
+        return
+    fila.enqueue(funcao, *args, job_id=job_id, **opcoes)
+    print(f"[WORKER] {job_id} -> fila '{nome_fila}'.")
+
+
+# ============================================
+# JOB: ENTREGAR COBRANÇA PAGA
+# ============================================
+def entregar_cobranca(cobranca_id, payment_id):
+    """Entrega o produto de uma cobrança paga (chave/licença + e-mail)."""
+    with app.app_context():
+        # Trava a linha até o commit: com vários processos de worker, duas
+        # entregas da mesma cobrança não podem correr ao mesmo tempo.
+        cobranca = Cobranca.query.filter_by(id=cobranca_id).with_for_update().first()
+        if not cobranca:
+            print(f"[WORKER] ERRO: Cobrança {cobranca_id} não encontrada.")
+            return
+        
+        if cobranca.status == "delivered":
+            print(f"[WORKER] Cobrança {cobranca.id} já foi entregue. Ignorando.")
+            db.session.rollback()
+            return
+        
+        produto = cobranca.produto
+        
         # 5. Gerenciar estoque
         link_entrega = produto.link_download
         chave_entregue = None
@@ -524,14 +590,11 @@ def process_mercado_pago_webhook(payment_id):
 
         elif produto.tipo in ["game", "app"]:
             print(f"[WORKER] Reservando chave para {produto.nome}...")
-            chave_obj = ChaveLicenca.query.filter(
-                ChaveLicenca.produto_id == produto.id,
-                ChaveLicenca.vendida == False
-            ).order_by(ChaveLicenca.id.asc()).with_for_update().first()
+            # SKIP LOCKED / lote no Redis: entregas paralelas do mesmo
+            # produto não disputam a mesma linha.
+            chave_obj = alocador.reservar(produto.id)
             
             if chave_obj:
-                chave_obj.vendida = True
-                chave_obj.vendida_em = datetime.utcnow()
                 chave_obj.cobranca_id = cobranca.id
                 chave_obj.cliente_email = cobranca.cliente_email
                 chave_entregue = chave_obj.chave_serial
@@ -578,15 +641,32 @@ def process_mercado_pago_webhook(payment_id):
             #     (a licença já foi adicionada/flushada na ativação). Isso NÃO
             #     pode depender do registro de venda.
             try:
+                status_anterior = cobranca.status
                 cobranca.status = "delivered"
                 db.session.add(cobranca)
+                vendas_diarias.registrar(db.session, cobranca, produto.tipo, status_anterior)
                 db.session.commit()
                 print(f"[WORKER] ✅ Cobrança/licença salvas.")
+                if licenca_ativa:
+                    # Write-through do status consultado pelo BrooStock no login.
+                    licenca_cache.gravar(licenca_ativa.cliente_email, licenca_ativa)
             except Exception as e:
                 print(f"[WORKER] ERRO ao salvar cobrança/licença: {e}")
                 db.session.rollback()
                 return
 
+            # Central Financeira: a próxima leitura do painel já inclui esta venda.
+            dashboard_cache.invalidar()
+            # Ranking de vendedores (ZINCRBY nos quadros total/semana/dia).
+            ranking.registrar_entrega(cobranca.vendedor_codigo, cobranca.data_criacao)
+
+            if produto.tipo in ["game", "app"] and produto.id != 99:
+                # Baixa o contador de estoque (e alerta se estiver acabando).
+                try:
+                    alocador.confirmar_venda(produto.id)
+                except Exception as e:
+                    print(f"[WORKER] ⚠️ Contador de estoque não atualizado: {e}")
+
             # 7b. Registro de venda — best-effort, NÃO derruba a licença.
             #     Assinatura: os planos vivem em 'produtos', não em 'products'
             #     (a FK de 'sales' aponta para 'products'), então pulamos.
@@ -601,20 +681,158 @@ def process_mercado_pago_webhook(payment_id):
                     print(f"[WORKER] ⚠️ Não foi possível salvar em 'sales': {e}")
                     db.session.rollback()
 
-                supabase_ok = registrar_venda_no_supabase(
-                    product_id=produto.id,
-                    customer_email=cobranca.cliente_email,
-                    amount=cobranca.valor,
-                    payment_id=payment_id
-                )
-                if supabase_ok:
-                    print(f"[WORKER] ✅ Dashboard atualizado!")
-                else:
-                    print(f"[WORKER] ⚠️ Dashboard NÃO atualizado.")
+                # Supabase em fila própria: a entrega não espera o dashboard.
+                try:
+                    _despachar(filas.FILA_SUPABASE, sincronizar_venda_supabase,
+                               produto.id, cobranca.cliente_email, cobranca.valor, payment_id,
+                               job_id=filas.job_id_venda(payment_id),
+                               retry=Retry(max=3, interval=[30, 120, 600]))
+                except redis.RedisError as e:
+                    print(f"[WORKER] ⚠️ Registro no Supabase não enfileirado: {e}")
         else:
             print(f"[WORKER] ERRO: Falha no envio de email.")
             db.session.rollback()
 
+
+# ============================================
+# JOB: REGISTRAR VENDA NO SUPABASE
+# ============================================
+def sincronizar_venda_supabase(product_id, customer_email, amount, payment_id):
+    if registrar_venda_no_supabase(product_id, customer_email, amount, payment_id):
+        print(f"[WORKER] ✅ Dashboard atualizado!")
+        return
+    print(f"[WORKER] ⚠️ Dashboard NÃO atualizado.")
+    if SUPABASE_SERVICE_ROLE_KEY:
+        # Falha transitória: o RQ reagenda (Retry do enqueue).
+        raise RuntimeError(f"Falha ao registrar venda {payment_id} no Supabase")
+
+# ============================================
+# JOB: RECONCILIAR O RANKING DE VENDEDORES
+# ============================================
+def reconciliar_ranking():
+    """Refaz os quadros do ranking no Redis a partir do rollup vendas_diarias."""
+    with app.app_context():
+        try:
+            ranking.reconciliar(db.session)
+        finally:
+            db.session.rollback()
+
+# ============================================
+# JOB: DRENAR O OUTBOX DE WEBHOOKS
+# ============================================
+def drenar_outbox_webhooks():
+    """Reenfileira os webhooks que ficaram no outbox enquanto o Redis estava fora."""
+    conn = get_current_job().connection
+    with app.app_context():
+        try:
+            while filas.reprocessar_outbox(db.session, conn) == filas.OUTBOX_LOTE:
+                pass
+        finally:
+            db.session.rollback()
+
+# ============================================
+# SUPERVISOR: N PROCESSOS DE WORKER
+# ============================================
+# Cada processo é um SimpleWorker RQ escutando todas as filas na ordem de
+# prioridade (filas.FILAS_POR_PRIORIDADE). SimpleWorker roda o job no
+# próprio processo: o Worker padrão faz fork de um work-horse por job, e os
+# pools (SMTP, HTTP, Mercado Pago) morreriam com ele a cada entrega. O
+# isolamento fica por conta do supervisor, que reinicia processos que
+# morrerem (o RQ marca o job deles como abandonado) e loga
+# profundidade/idade das filas periodicamente. Também
+# enfileira a reconciliação do ranking a cada RANKING_RECONCILIAR_S e a
+# drenagem do outbox de webhooks a cada filas.OUTBOX_INTERVALO_S (o
+# supervisor não abre conexão com o banco: quem roda é um worker).
+WORKER_PROCESSOS = int(os.environ.get("WORKER_PROCESSOS", os.cpu_count() or 1))
+WORKER_RELATORIO_S = int(os.environ.get("WORKER_RELATORIO_S", 60))
+MANUTENCAO_FALHA_TTL_S = 86400
+
+
+def _rodar_worker(redis_url, indice):
+    conn = redis.from_url(redis_url)
+    worker = SimpleWorker(filas.FILAS_POR_PRIORIDADE, connection=conn)
+    print(f"[WORKER] 🚀 Worker {indice} iniciado (pid {os.getpid()})...")
+    # with_scheduler: necessário para os jobs reagendados (enqueue_in/Retry).
+    # Só um processo por vez pega o lock do scheduler.
+    worker.work(with_scheduler=True)
+    e = smtp_pool.estatisticas()
+    print(f"[WORKER] Worker {indice} encerrado: {e['mensagens']} e-mail(s) em {e['conexoes']} conexão(ões) SMTP.")
+
+
+def _logar_filas(conn):
+    try:
+        for nome, e in filas.estatisticas_filas(conn).items():
+            if e["profundidade"] or e["em_execucao"] or e["agendados"]:
+                print(f"[FILAS] {nome}: {e['profundidade']} na fila (mais antigo {e['idade_s']}s), "
+                      f"{e['em_execucao']} rodando, {e['agendados']} agendados, {e['falhas']} falhas")
+    except redis.RedisError as e:
+        print(f"[FILAS] Redis indisponível: {e}")
+
+
+def _agendar_manutencao(conn, funcao, job_id):
+    """Enfileira a tarefa periódica, a menos que ela já esteja pendente.
+    Redis fora: tenta de novo no próximo intervalo."""
+    try:
+        fila = Queue(filas.FILA_MANUTENCAO, connection=conn)
+        existente = fila.fetch_job(job_id)
+        if existente is not None and existente.get_status() in filas.STATUS_PENDENTES:
+            return
+        fila.enqueue(funcao, job_id=job_id, result_ttl=0, failure_ttl=MANUTENCAO_FALHA_TTL_S)
+    except redis.RedisError as e:
+        print(f"[WORKER] {job_id} não enfileirado: {e}")
+
+
+def supervisionar(redis_url, n_processos):
+    # Conexões do pool do SQLAlchemy não podem ser herdadas pelo fork.
+    with app.app_context():
+        db.engine.dispose()
+    ctx = multiprocessing.get_context("fork")
+    processos = {}
+    parar = []
+
+    def iniciar(indice):
+        proc = ctx.Process(target=_rodar_worker, args=(redis_url, indice), daemon=False)
+        proc.start()
+        processos[indice] = proc
+
+    def encerrar(signum, _frame):
+        parar.append(signum)
+        for proc in processos.values():
+            if proc.is_alive():
+                os.kill(proc.pid, signal.SIGTERM)  # warm shutdown do RQ
+
+    for i in range(n_processos):
+        iniciar(i)
+    signal.signal(signal.SIGTERM, encerrar)
+    signal.signal(signal.SIGINT, encerrar)
+    print(f"[WORKER] Supervisor com {n_processos} processo(s): {', '.join(filas.FILAS_POR_PRIORIDADE)}")
+
+    conn = redis.from_url(redis_url)
+    proximo_relatorio = 0.0
+    proxima_reconciliacao = 0.0
+    proxima_drenagem = 0.0
+    while not parar:
+        for indice, proc in list(processos.items()):
+            proc.join(timeout=1)
+            if not proc.is_alive() and not parar:
+                print(f"[WORKER] ⚠️ Worker {indice} saiu (código {proc.exitcode}); reiniciando.")
+                iniciar(indice)
+        agora = time.monotonic()
+        if agora >= proximo_relatorio:
+            proximo_relatorio = agora + WORKER_RELATORIO_S
+            _logar_filas(conn)
+        if agora >= proxima_reconciliacao:
+            proxima_reconciliacao = agora + ranking.RANKING_RECONCILIAR_S
+            _agendar_manutencao(conn, reconciliar_ranking, filas.JOB_ID_RECONCILIAR_RANKING)
+        if agora >= proxima_drenagem:
+            proxima_drenagem = agora + filas.OUTBOX_INTERVALO_S
+            _agendar_manutencao(conn, drenar_outbox_webhooks, filas.JOB_ID_DRENAR_OUTBOX)
+
+    for proc in processos.values():
+        proc.join()
+    print("[WORKER] Supervisor encerrado.")
+
+
 # ============================================
 # INICIALIZAÇÃO DO WORKER
 # ============================================
@@ -635,12 +853,11 @@ if __name__ == "__main__":
     # Criar tabelas se necessário
     with app.app_context():
         db.create_all()
+        migracoes.aplicar_no_boot(db.engine)
         print("[WORKER] ✅ Tabelas verificadas.")
     
-    # Iniciar worker
+    # Iniciar os workers (supervisor)
     try:
-        worker = Worker(["default"], connection=redis_conn)
-        print("[WORKER] 🚀 Worker iniciado...")
-        worker.work()
+        supervisionar(redis_url, WORKER_PROCESSOS)
     except Exception as e:
         print(f"[WORKER] ❌ Erro fatal: {e}")